@@ -1,19 +1,30 @@
+import json
+import os
 from os import listdir, path, remove
+import threading
+from collections import OrderedDict
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from flask_restplus import Api, Resource, fields
 import time
 
+from data.classify_job import ClassifyJob
+from data.label_import import LabelImporter, get_file_format, iter_label_rows
 from data.web_page_type import WebPageType
-from nlp.evaluation_model import WebPageTypeModelEvaluation
-from nlp.modeler import WebPageTypeModeler
+from nlp.classify_job_worker import ClassifyJobWorker, chunk_tasks, default_job_queue_name
+from nlp.feature_selection import list_feature_selection
+from nlp.predict_batcher import PredictBatcher
 from nlp.predict_data import PredictWebPageType
-from nlp.tokenizer import GeneralTokenizer
-from parser.content_getter import ContentGetter
-from parser.crawler import PageCrawlerWithStorage, PageCrawler
-from parser.extractor import DragnetPageExtractor, ReadabilityPageExtractor, GoosePageExtractor, \
-    GooseDragnetPageExtractor
-from util.database import get_mg_client, get_redis_conn
+from nlp.prediction_cache import PredictionCache
+from nlp.url_classifier import UrlTypeClassifier
+from parser.content_getter import ContentGetter, get_content_getter
+from parser.crawler import PageCrawlerWithStorage
+from parser.extractor import get_extractor, list_extractor
+from util import metrics
+from util.admission import AdmissionController
+from util.database import get_mg_client, get_redis_conn, get_pool_stats
+from util.job_queue import RedisJobQueue, LocalJobQueue
+from util.timing import StageTimer, latency_stats
 from util.utils import get_logger
 
 logger = get_logger(__name__)
@@ -21,44 +32,192 @@ logger = get_logger(__name__)
 app = Flask(__name__)
 api = Api(app, doc='/doc/', version='1.0', title='Web pages type classification')
 
-model_loc_dir = path.dirname(path.realpath(__file__)) + '/../model'
-default_model_name = '6k_ecommerce_news_blog_urls_dragnet_extractor.model'
+model_loc_dir = os.environ.get('PAGE_TYPE_MODEL_DIR', path.dirname(path.realpath(__file__)) + '/../model')
+default_model_name = os.environ.get('PAGE_TYPE_MODEL_NAME', '6k_ecommerce_news_blog_urls_dragnet_extractor.model')
 default_model_file_path = path.join(model_loc_dir, default_model_name)
-crawler = PageCrawler()
-extractor = DragnetPageExtractor()
-content_getter = ContentGetter(crawler=crawler, extractor=extractor)
-classifier = PredictWebPageType(model_loc_dir, default_model_name, content_getter)
-
-# set cur model to redis
-kv_storage = get_redis_conn()
-kv_storage.set(classifier.model_name_key, default_model_name)
-
-list_extractor = ['dragnet', 'readability', 'goose']
+default_url_model_name = 'url_page_type_classifier.model'
+default_url_threshold = 0.9
+content_getter = get_content_getter(list_extractor[0])
+prediction_cache = PredictionCache(get_redis_conn(), ttl=3600)
+# merge predict calls of concurrent requests, set max batch size to 1 to disable. A batch only waits while
+# other requests are classifying, so a worker serving one request at a time never waits
+predict_batcher = PredictBatcher(max_batch_size=64, max_wait_ms=5)
+# models are loaded by warm_up, not at import (see gunicorn_conf.py)
+url_classifier = UrlTypeClassifier(model_loc_dir, default_url_model_name, get_redis_conn())
+classifier = PredictWebPageType(model_loc_dir, default_model_name, content_getter, prediction_cache=prediction_cache,
+                                predict_batcher=predict_batcher, url_classifier=url_classifier,
+                                use_scoring_engine=True)
+warm_up_html = '<html><head><title>Warm up</title></head><body><p>Warm up the classifier.</p></body></html>'
+
+job_chunk_size = 50
+# PAGE_TYPE_JOB_QUEUE=local runs the jobs in a worker thread of this process instead of Redis and job_worker.py
+local_job_queue = os.environ.get('PAGE_TYPE_JOB_QUEUE') == 'local'
+job_queue = LocalJobQueue() if local_job_queue else RedisJobQueue(get_redis_conn(), default_job_queue_name)
+local_job_worker = None
+local_job_worker_lock = threading.Lock()
+
+# urls crawled, extracted or classified at the same time by this worker, larger lists go to /job/classify
+admission = AdmissionController(
+    max_urls_per_request=int(os.environ.get('PAGE_TYPE_MAX_URLS_PER_REQUEST', 200)),
+    max_in_flight_urls=int(os.environ.get('PAGE_TYPE_MAX_IN_FLIGHT_URLS', 400)),
+    small_request_urls=int(os.environ.get('PAGE_TYPE_SMALL_REQUEST_URLS', 10)),
+    small_request_reserve=int(os.environ.get('PAGE_TYPE_SMALL_REQUEST_RESERVE', 50)),
+    retry_after=int(os.environ.get('PAGE_TYPE_RETRY_AFTER', 1)))
+
+
+def get_bool_param(name, default):
+    value = request.values.get(name, '')
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+def get_fields_param():
+    fields = request.values.get('fields', '')
+    return [f.strip() for f in fields.split(',') if f.strip()]
+
+
+def select_fields(page, fields):
+    if not fields:
+        return page
+    # always keep the url, so that a line can be matched to its request
+    return {f: page[f] for f in ['url'] + fields if f in page}
+
+
+def ndjson_response(pages, fields, headers=None, timer=None):
+    """Stream one JSON line per page as soon as the page is ready"""
+    def generate():
+        for page in pages:
+            yield json.dumps(select_fields(page, fields)) + '\n'
+    response = Response(generate(), mimetype='application/x-ndjson', headers=headers)
+    if timer:
+        # headers are sent before the pages, so the stream total only goes to the latency stats
+        response.call_on_close(timer.finish)
+    # the urls are processed while streaming, they stay in flight until the stream ends
+    ticket = getattr(g, 'admission_ticket', None)
+    if ticket:
+        response.call_on_close(ticket.release)
+        g.admission_ticket = None
+    return response
+
+
+def timings_response(result, timer, with_timings):
+    timer.finish()
+    if with_timings:
+        result['timings'] = timer.to_dict()
+    return result, 200, {'Server-Timing': timer.server_timing()}
+
+
+def admit(urls, result):
+    """Hold the urls in this worker until the request ends.
+
+    Return None if the request is admitted, else the error response to return (413, 429 or 503).
+    """
+    ticket = admission.acquire(len(urls), endpoint=get_endpoint_label())
+    if not ticket.admitted:
+        result['error'] = True
+        result['message'] = ticket.message
+        headers = {'Retry-After': str(ticket.retry_after)} if ticket.retry_after else {}
+        return result, ticket.status, headers
+    g.admission_ticket = ticket
+    return None
 
 
-def get_extractor(name):
-    if name == 'dragnet':
-        return DragnetPageExtractor()
-    elif name == 'readability':
-        return ReadabilityPageExtractor()
-    elif name == 'goose':
-        return GoosePageExtractor()
-    elif name == 'goose_dragnet':
-        return GooseDragnetPageExtractor()
-    else:
-        return None
+def warm_up():
+    """Load the models and classify a dummy page, so that the first request does not pay for it.
+
+    Call it in each worker before it accepts requests, the page indexes are created once by the master
+    (see gunicorn_conf.py). The current model is read from Redis by the model watcher, the default model is
+    used until it answers.
+    """
+    start = time.time()
+    # a missing or broken model fails the classify requests, it must not stop the worker from starting
+    try:
+        if not url_classifier.is_available():
+            url_classifier.load_model()
+        model = classifier.get_model()
+        # imports the extractor backend and runs the tokenizer and scorer once
+        url, content = content_getter.extractor.extract(('http://warm.up/', warm_up_html))
+        model.scorer.predict_proba([', '.join([url, content])])
+    except Exception as ex:
+        logger.error('Warm up error, the models are loaded by the first requests: %s' % ex)
+        return
+    logger.info('Warm up with model %s in %.2f seconds' % (model.name, time.time() - start))
+
+
+def preload():
+    """Load the models and the extractor backend in the gunicorn master, the forked workers share them.
+
+    Unlike `warm_up` it starts no thread, threads do not survive fork.
+    """
+    start = time.time()
+    try:
+        url_classifier.load_model()
+        model = classifier.preload_model()
+        content_getter.extractor.extract(('http://warm.up/', warm_up_html))
+    except Exception as ex:
+        logger.error('Preload error, each worker loads the models itself: %s' % ex)
+        return
+    logger.info('Preload model %s in %.2f seconds' % (model.name, time.time() - start))
+
+
+def get_endpoint_label():
+    # the route pattern, not the path, so that job ids do not create a label each
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.time()
+    metrics.requests_in_progress.labels(endpoint=get_endpoint_label()).inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = get_endpoint_label()
+    metrics.requests_total.labels(endpoint=endpoint, method=request.method, status=response.status_code).inc()
+    if hasattr(g, 'request_start'):
+        metrics.request_duration.labels(endpoint=endpoint, method=request.method).observe(
+            time.time() - g.request_start)
+    return response
+
+
+@app.teardown_request
+def end_request_metrics(exception=None):
+    if hasattr(g, 'request_start'):
+        metrics.requests_in_progress.labels(endpoint=get_endpoint_label()).dec()
+
+
+@app.teardown_request
+def release_admission(exception=None):
+    # streamed responses moved their ticket to the end of the stream
+    ticket = getattr(g, 'admission_ticket', None)
+    if ticket:
+        ticket.release()
+
+
+def ensure_local_job_worker():
+    global local_job_worker
+    with local_job_worker_lock:
+        if local_job_worker:
+            return
+        job_storage = ClassifyJob(get_mg_client().web)
+        job_storage.ensure_indexes()
+        local_job_worker = ClassifyJobWorker(job_queue, job_storage, classifier, get_content_getter, pop_timeout=1)
+        local_job_worker.start()
 
 
 def check_unlabeled_data(urls):
     mg_client = get_mg_client()
     storage = mg_client.web.page
     web_page_type = WebPageType(storage)
-    mg_client.close()
     return web_page_type.check_unlabeled_data(urls)
 
 ns_type = api.namespace('type', 'Classify new web page')
 ns_data = api.namespace('data', 'Manage data')
 ns_model = api.namespace('model', 'Manage models')
+ns_job = api.namespace('job', 'Asynchronous batch classification jobs')
+ns_stats = api.namespace('stats', 'Service statistics')
 
 page_type_response = api.model('page_type_response', {
     'error': fields.String(default='False if request successfully, else return True'),
@@ -94,8 +253,23 @@ class PageTypeResource(Resource):
     """Classify web pages into types (ecommerce, news/blog,...)"""
     @api.doc(params={'urls': 'The urls to be classified (If many urls, separate by comma)',
                      'extractor': 'The name of extractor to be used, currently support `%s`, default `%s`' %
-                                  (', '.join(list_extractor), list_extractor[0])})
+                                  (', '.join(list_extractor), list_extractor[0]),
+                     'cache': 'Use cached predictions (true/false), default is true',
+                     'refresh': 'Ignore cached predictions and re-classify the urls (true/false), default is false',
+                     'mode': 'Classify mode, `content` (crawl every url) or `url_first` (answer from the url only '
+                             'when the url model is confident, crawl the others), default is `content`',
+                     'url_threshold': 'Minimum url model confident to skip crawling in `url_first` mode, '
+                                      'default is %s' % default_url_threshold,
+                     'stream': 'Stream one JSON line per url (application/x-ndjson) as soon as it is classified '
+                               '(true/false), default is false',
+                     'fields': 'The page fields to be returned (If many, separate by comma), e.g. `type,confident` '
+                               'to omit content. Default is all fields',
+                     'timings': 'Return the milliseconds spent in each stage and on each url in `timings` '
+                                '(true/false), default is false. Stage times are always in the Server-Timing header'})
     @api.response(200, 'Success', model='page_type_response')
+    @api.response(413, 'Too many urls in the request')
+    @api.response(429, 'Only small requests are accepted at the moment, retry after Retry-After seconds')
+    @api.response(503, 'The worker is busy, retry after Retry-After seconds')
     def post(self):
         """Post web page urls to check
         """
@@ -112,8 +286,8 @@ class PageTypeResource(Resource):
             return result
 
         extractor_name = request.values.get('extractor', list_extractor[0])
-        s_extractor = get_extractor(extractor_name)
-        if not extractor:
+        s_content_getter = get_content_getter(extractor_name)
+        if not s_content_getter:
             result['error'] = True
             result['message'] = "The extractor name '%s' does not support yet" % extractor_name
             return result
@@ -123,10 +297,147 @@ class PageTypeResource(Resource):
             if not url.startswith('http'):
                 urls[idx] = 'http://' + url
 
-        s_content_getter = ContentGetter(crawler=PageCrawler(), extractor=s_extractor)
-        classifier.content_getter = s_content_getter
-        result['pages'] = classifier.predict(urls)
-        result['model_name'] = classifier.model_name
+        mode = request.values.get('mode', 'content')
+        if mode not in ('content', 'url_first'):
+            result['error'] = True
+            result['message'] = "The mode '%s' is not supported, please choose `content` or `url_first`" % mode
+            return result
+
+        url_threshold = None
+        if mode == 'url_first':
+            try:
+                url_threshold = float(request.values.get('url_threshold', default_url_threshold))
+            except ValueError:
+                result['error'] = True
+                result['message'] = 'url_threshold must be number'
+                return result
+
+        rejected = admit(urls, result)
+        if rejected:
+            return rejected
+
+        fields = get_fields_param()
+        use_cache = get_bool_param('cache', True)
+        refresh_cache = get_bool_param('refresh', False)
+        with_timings = get_bool_param('timings', False)
+        timer = StageTimer(prefix='classify.')
+        if get_bool_param('stream', False):
+            model = classifier.get_model()
+            pages = classifier.predict_iter(urls, content_getter=s_content_getter, use_cache=use_cache,
+                                            refresh_cache=refresh_cache, url_threshold=url_threshold, timer=timer,
+                                            with_timings=with_timings)
+            if with_timings and fields:
+                fields.append('timings')
+            return ndjson_response(pages, fields, headers={'X-Model-Name': model.name}, timer=timer)
+
+        model = classifier.get_model()
+        pages = classifier.predict(urls, content_getter=s_content_getter, use_cache=use_cache,
+                                   refresh_cache=refresh_cache, url_threshold=url_threshold, timer=timer)
+        result['pages'] = [select_fields(p, fields) for p in pages]
+        result['model_name'] = model.name
+        return timings_response(result, timer, with_timings)
+
+
+@ns_job.route('/classify')
+class ClassifyJobResource(Resource):
+    """Submit urls to be classified in background"""
+    @api.doc(params={'urls': 'The urls to be classified (If many urls, separate by comma)',
+                     'file': 'Uploaded text file of urls to be classified, one url per line',
+                     'extractor': 'The name of extractor to be used, currently support `%s`, default `%s`' %
+                                  (', '.join(list_extractor), list_extractor[0]),
+                     'mode': 'Classify mode, `content` or `url_first`, default is `content`',
+                     'url_threshold': 'Minimum url model confident to skip crawling in `url_first` mode, '
+                                      'default is %s' % default_url_threshold})
+    @api.response(200, 'Success')
+    def post(self):
+        """Post urls for a classification job, return the job id for polling"""
+        result = {
+            'error': False,
+            'message': ''
+        }
+        urls = request.values.get('urls', '')
+        urls = [u.strip().lower() for u in urls.split(',') if u.strip()]
+        upload = request.files.get('file')
+        if upload:
+            urls += [line.strip().lower() for line in upload.stream if line.strip()]
+        if not urls:
+            result['error'] = True
+            result['message'] = 'Urls is empty'
+            return result
+
+        extractor_name = request.values.get('extractor', list_extractor[0])
+        if not get_extractor(extractor_name):
+            result['error'] = True
+            result['message'] = "The extractor name '%s' does not support yet" % extractor_name
+            return result
+
+        url_threshold = None
+        if request.values.get('mode', 'content') == 'url_first':
+            try:
+                url_threshold = float(request.values.get('url_threshold', default_url_threshold))
+            except ValueError:
+                result['error'] = True
+                result['message'] = 'url_threshold must be number'
+                return result
+
+        # append urls that missing schema
+        for idx, url in enumerate(urls):
+            if not url.startswith('http'):
+                urls[idx] = 'http://' + url
+
+        # a chunk returns one page per distinct url, repeated urls would keep the job from reaching total
+        urls = list(OrderedDict.fromkeys(urls))
+
+        options = {'extractor': extractor_name, 'url_threshold': url_threshold}
+        mg_client = get_mg_client()
+        job_id = ClassifyJob(mg_client.web).create(len(urls), options)
+        job_queue.push(chunk_tasks(job_id, urls, job_chunk_size, options))
+        if local_job_queue:
+            ensure_local_job_worker()
+
+        result['message'] = 'The job %s of %s urls was queued' % (job_id, len(urls))
+        result['job_id'] = job_id
+        result['total'] = len(urls)
+        return result
+
+
+@ns_job.route('/<string:job_id>')
+class ClassifyJobStatusResource(Resource):
+    """Progress and results of a classification job"""
+    @api.doc(params={'limit': 'Limit number of results in returned data, default is 100',
+                     'offset': 'The offset of the results, default is 0'})
+    @api.response(200, 'Success')
+    def get(self, job_id):
+        """Get job progress and the results classified so far"""
+        result = {
+            'error': False,
+            'message': '',
+            'pages': []
+        }
+        try:
+            limit = int(request.values.get('limit', '100'))
+            offset = int(request.values.get('offset', '0'))
+        except ValueError:
+            result['error'] = True
+            result['message'] = 'limit and offset must be in integer'
+            return result
+
+        mg_client = get_mg_client()
+        job_storage = ClassifyJob(mg_client.web)
+        job = job_storage.get(job_id)
+        if not job:
+            result['error'] = True
+            result['message'] = 'The job %s does not exist or has expired' % job_id
+            return result
+
+        result['pages'] = job_storage.get_results(job_id, offset, limit)
+        result['job_id'] = job_id
+        result['status'] = job['status']
+        result['total'] = job['total']
+        result['processed'] = job['processed']
+        result['failed'] = job['failed']
+        result['progress'] = round(float(job['processed']) / job['total'], 4) if job['total'] else 1.0
+        result['created_date'] = str(job['created_date'])
         return result
 
 
@@ -135,6 +446,9 @@ class CrawlerStorageResource(Resource):
     """Post urls for crawling and save to database"""
     @api.doc(params={'urls': 'The urls for crawling (If many urls, separate by comma)'})
     @api.response(200, 'Success')
+    @api.response(413, 'Too many urls in the request')
+    @api.response(429, 'Only small requests are accepted at the moment, retry after Retry-After seconds')
+    @api.response(503, 'The worker is busy, retry after Retry-After seconds')
     def post(self):
         """Post urls for crawling and save to database"""
         result = {
@@ -154,11 +468,14 @@ class CrawlerStorageResource(Resource):
             if not url.startswith('http'):
                 urls[idx] = 'http://' + url
 
+        rejected = admit(urls, result)
+        if rejected:
+            return rejected
+
         mg_client = get_mg_client()
         storage = mg_client.web.page
         s_crawler = PageCrawlerWithStorage(storage)
         pages = s_crawler.process(urls)
-        mg_client.close()
         result['message'] = '%s was crawled successfully' % len(pages)
         return result
 
@@ -168,8 +485,17 @@ class ExtractorStorageResource(Resource):
     """Post urls for extracting content (note: do not save the result)"""
     @api.doc(params={'urls': 'The urls for crawling (If many urls, separate by comma)',
                      'extractor': 'The name of extractor to be used, currently support `%s`, default `%s`' %
-                                  (', '.join(list_extractor), list_extractor[0])})
+                                  (', '.join(list_extractor), list_extractor[0]),
+                     'stream': 'Stream one JSON line per url (application/x-ndjson) as soon as it is extracted '
+                               '(true/false), default is false',
+                     'fields': 'The page fields to be returned (If many, separate by comma), e.g. `error,message` '
+                               'to omit content. Default is all fields',
+                     'timings': 'Return the milliseconds spent in each stage and on each url in `timings` '
+                                '(true/false), default is false. Stage times are always in the Server-Timing header'})
     @api.response(200, 'Success')
+    @api.response(413, 'Too many urls in the request')
+    @api.response(429, 'Only small requests are accepted at the moment, retry after Retry-After seconds')
+    @api.response(503, 'The worker is busy, retry after Retry-After seconds')
     def post(self):
         """Post urls for extracting content (note: do not save the result)"""
         result = {
@@ -185,8 +511,8 @@ class ExtractorStorageResource(Resource):
             return result
 
         extractor_name = request.values.get('extractor', list_extractor[0])
-        s_extractor = get_extractor(extractor_name)
-        if not extractor:
+        s_content_getter = get_content_getter(extractor_name)
+        if not s_content_getter:
             result['error'] = True
             result['message'] = "The extractor name '%s' does not support yet" % extractor_name
             return result
@@ -196,10 +522,30 @@ class ExtractorStorageResource(Resource):
             if not url.startswith('http'):
                 urls[idx] = 'http://' + url
 
-        s_crawler = PageCrawler()
-        s_content_getter = ContentGetter(crawler=s_crawler, extractor=s_extractor)
-        result['pages'] = s_content_getter.process(urls)
-        return result
+        rejected = admit(urls, result)
+        if rejected:
+            return rejected
+
+        fields = get_fields_param()
+        with_timings = get_bool_param('timings', False)
+        timer = StageTimer(prefix='extract.')
+        if get_bool_param('stream', False):
+            def generate():
+                for url, page in s_content_getter.process_iter(urls, timer):
+                    page = page.to_dict()
+                    page['url'] = url
+                    if with_timings:
+                        page['timings'] = timer.get_url(url)
+                    yield page
+
+            pages = generate()
+            if with_timings and fields:
+                fields.append('timings')
+            return ndjson_response(pages, fields, timer=timer)
+
+        pages = s_content_getter.process(urls, timer)
+        result['pages'] = {url: select_fields(page.to_dict(), fields) for url, page in pages.items()}
+        return timings_response(result, timer, with_timings)
 
 
 list_tokenizer = ['general']
@@ -207,6 +553,7 @@ list_tokenizer = ['general']
 
 def get_tokenizer(name):
     if name == 'general':
+        from nlp.tokenizer import GeneralTokenizer
         return GeneralTokenizer().tokenize
     return None
 
@@ -282,7 +629,6 @@ class PageTypeStorageResource(Resource):
         storage = mg_client.web.page
         web_page_type = WebPageType(storage)
         updated_count = web_page_type.update(urls, page_type)
-        mg_client.close()
         result['message'] = '%s urls has been updated label successful' % updated_count
         return result
 
@@ -290,7 +636,9 @@ class PageTypeStorageResource(Resource):
                      'type': 'The web page type (ecommerce, news/blog,...). If many, separate by comma. '
                              'If empty, get all',
                      'limit': 'Limit number of urls in returned data, default is 50',
-                     'offset': 'The offset that want to get the urls, default is 0'})
+                     'offset': 'The offset that want to get the urls, default is 0. Slow on deep pages, use `after`',
+                     'after': 'Get the urls after this one, pass the `next_after` of the previous page. '
+                              'Type counts are cached for a minute'})
     @api.response(200, 'Success')
     def get(self):
         """Get list labeled data"""
@@ -303,18 +651,21 @@ class PageTypeStorageResource(Resource):
         page_types = request.values.get('type', '')
         limit = request.values.get('limit', '50')
         offset = request.values.get('offset', '0')
+        after = request.values.get('after', '').strip()
 
         try:
             limit = int(limit)
         except ValueError as ex:
             result['error'] = True
             result['message'] = 'limit must be in integer'
+            return result
 
         try:
             offset = int(offset)
         except ValueError as ex:
             result['error'] = True
             result['message'] = 'offset must be in integer'
+            return result
 
         page_types = [t.strip().lower() for t in page_types.split(',')] if page_types else []
         urls = [u.strip().lower() for u in urls.split(',') if u] if urls else []
@@ -326,11 +677,11 @@ class PageTypeStorageResource(Resource):
         mg_client = get_mg_client()
         storage = mg_client.web.page
         web_page_type = WebPageType(storage)
-        pages, type_count, total = web_page_type.search(page_types, urls, limit, offset)
-        mg_client.close()
+        pages, type_count, total, next_after = web_page_type.search(page_types, urls, limit, offset, after)
         result['pages'] = pages
         result['type_count'] = type_count
         result['total'] = total
+        result['next_after'] = next_after
         return result
 
     @api.doc(params={'urls': 'The urls to be filtered (If many urls, separate by comma).',
@@ -363,7 +714,41 @@ class PageTypeStorageResource(Resource):
         web_page_type = WebPageType(storage)
         deleted_count = web_page_type.delete(page_types, urls)
         result['message'] = '%s urls was deleted' % deleted_count
-        mg_client.close()
+        return result
+
+
+@ns_data.route('/label/import')
+class PageTypeImportResource(Resource):
+    """Import labeled data from a file"""
+    @api.doc(params={'file': 'Uploaded file of labels, CSV rows `url,type` (or `url` with the `type` param) or, '
+                             'for a .ndjson or .jsonl file, JSON lines {"url": .., "type": ..}',
+                     'type': 'The web page type of the rows without one',
+                     'format': 'The file format, `csv` or `ndjson`, default is from the file extension'})
+    @api.response(200, 'Success')
+    def post(self):
+        """Post a file of labeled urls, the rows are upserted in batches as the file is read"""
+        result = {
+            'error': False,
+            'message': ''
+        }
+        upload = request.files.get('file')
+        if not upload:
+            result['error'] = True
+            result['message'] = 'The file is empty'
+            return result
+
+        file_format = request.values.get('format', '') or get_file_format(upload.filename)
+        if file_format not in ('csv', 'ndjson'):
+            result['error'] = True
+            result['message'] = "The format '%s' is not supported, please choose `csv` or `ndjson`" % file_format
+            return result
+
+        mg_client = get_mg_client()
+        importer = LabelImporter(mg_client.web.page)
+        stats = importer.process(iter_label_rows(upload.stream, file_format, request.values.get('type')))
+        result['message'] = '%s rows were imported, %s inserted, %s updated, %s invalid, %s failed' % (
+            stats['rows'], stats['inserted'], stats['updated'], stats['invalid'], stats['failed'])
+        result.update(stats)
         return result
 
 
@@ -381,7 +766,15 @@ class PageTypeModelerResource(Resource):
                                   % (', '.join(list_tokenizer), list_tokenizer[0]),
                      'model_name': 'The model name, default `%s_page_type_classifier.model`' % date_time_format,
                      'min_ngram': 'Word minimum ngram, default is 1',
-                     'max_ngram': 'Word maximum ngram, default is 2'})
+                     'max_ngram': 'Word maximum ngram, default is 2',
+                     'min_df': 'Ignore terms having document frequency lower than this (float for proportion, '
+                               'integer for absolute count), default is 0.1',
+                     'max_df': 'Ignore terms having document frequency higher than this (float for proportion, '
+                               'integer for absolute count), default is 0.9',
+                     'alpha': 'Naive Bayes additive smoothing parameter, default is 1.0',
+                     'feature_selection': 'Prune the vocabulary by feature selection, currently support `%s`, '
+                                          'default is no selection' % ', '.join(list_feature_selection),
+                     'num_features': 'Number of best features to keep when feature selection is used'})
     @api.response(200, 'Success')
     def post(self):
         """Post web page urls to train new model"""
@@ -398,14 +791,14 @@ class PageTypeModelerResource(Resource):
 
         extractor_name = request.values.get('extractor', list_extractor[0])
         s_extractor = get_extractor(extractor_name)
-        if not extractor:
+        if not s_extractor:
             result['error'] = True
             result['message'] = "The extractor name '%s' does not support yet" % extractor_name
             return result
 
         model_name = request.values.get('model_name', time.strftime(self.date_time_format) +
                                         '_page_type_classifier.model')
-        if model_name in get_list_model():
+        if model_name in get_list_model() or model_name == default_url_model_name:
             result['error'] = True
             result['message'] = "The model name '%s' is duplicated, please select another model name." % model_name
             return result
@@ -434,6 +827,32 @@ class PageTypeModelerResource(Resource):
             result['message'] = 'Max ngram and min ngram must be integer'
             return result
 
+        try:
+            min_df = parse_df(request.values.get('min_df', '0.1'))
+            max_df = parse_df(request.values.get('max_df', '0.9'))
+            alpha = float(request.values.get('alpha', '1.0'))
+        except ValueError:
+            result['error'] = True
+            result['message'] = 'Min df, max df and alpha must be number'
+            return result
+
+        feature_selection = request.values.get('feature_selection', '')
+        num_features = request.values.get('num_features', '')
+        if feature_selection:
+            if feature_selection not in list_feature_selection:
+                result['error'] = True
+                result['message'] = "Feature selection '%s' is not supported, please choose one of: %s" \
+                                    % (feature_selection, ', '.join(list_feature_selection))
+                return result
+            try:
+                num_features = int(num_features)
+            except ValueError:
+                result['error'] = True
+                result['message'] = 'Number of features must be integer'
+                return result
+        else:
+            num_features = None
+
         # append urls that missing schema
         for idx, url in enumerate(urls):
             if not url.startswith('http'):
@@ -448,10 +867,11 @@ class PageTypeModelerResource(Resource):
         mg_client = get_mg_client()
         storage = mg_client.web.page
         content_getter_with_storage = ContentGetter(PageCrawlerWithStorage(storage), s_extractor)
+        from nlp.modeler import WebPageTypeModeler
         modeler = WebPageTypeModeler(urls, content_getter_with_storage, path.join(model_loc_dir, model_name), tokenizer,
-                                     min_ngram, max_ngram)
+                                     min_ngram, max_ngram, min_df=min_df, max_df=max_df, alpha=alpha,
+                                     feature_selection=feature_selection or None, num_features=num_features)
         ok, msg = modeler.train()
-        mg_client.close()
         if not ok:
             result['error'] = True
             result['message'] = msg
@@ -463,8 +883,56 @@ class PageTypeModelerResource(Resource):
         return result
 
 
+@ns_model.route('/train_url')
+class UrlPageTypeModelerResource(Resource):
+    """Train the url only web page type classifier used by `url_first` classify mode"""
+    @api.doc(params={'type': 'The web page types to be trained (If many, separate by comma). If empty, use all '
+                             'labeled types',
+                     'max_urls_per_type': 'Maximum number of labeled urls sampled for each type, default is all'})
+    @api.response(200, 'Success')
+    def post(self):
+        """Train the url model from labeled urls and load it"""
+        result = {
+            'error': False,
+            'message': ''
+        }
+        page_types = request.values.get('type', '')
+        page_types = [t.strip().lower() for t in page_types.split(',') if t] if page_types else []
+        max_urls_per_type = request.values.get('max_urls_per_type', '')
+        try:
+            max_urls_per_type = int(max_urls_per_type) if max_urls_per_type else None
+        except ValueError:
+            result['error'] = True
+            result['message'] = 'max_urls_per_type must be integer'
+            return result
+
+        mg_client = get_mg_client()
+        storage = mg_client.web.page
+        from nlp.url_classifier import WebPageUrlTypeModeler
+        modeler = WebPageUrlTypeModeler(storage, path.join(model_loc_dir, default_url_model_name), page_types,
+                                        max_urls_per_type)
+        ok, msg = modeler.train()
+        if not ok:
+            result['error'] = True
+            result['message'] = msg
+            return result
+
+        # the other workers and the job worker load it before their next url prediction
+        url_classifier.publish_model()
+        result['message'] = 'The url model %s was trained successfully' % default_url_model_name
+        result['model_name'] = default_url_model_name
+        result.update(msg)
+        return result
+
+
+def parse_df(value):
+    # integer means absolute document count, float means proportion of documents
+    return float(value) if '.' in value else int(value)
+
+
 def get_list_model():
-    return listdir(model_loc_dir)
+    # the url model shares the directory, it cannot be loaded or evaluated as a content model
+    return [m for m in listdir(model_loc_dir) if m != default_url_model_name]
 
 
 @ns_model.route('/list')
@@ -489,6 +957,8 @@ class ListPageTypeModelResource(Resource):
 
         models = [m.strip().lower() for m in models.split(',') if m]
         for model_name in models:
+            if model_name == default_url_model_name:
+                continue
             file_path = path.join(model_loc_dir, model_name)
             if path.exists(file_path):
                 remove(file_path)
@@ -514,17 +984,14 @@ class ReloadPageTypeModelResource(Resource):
             result['models'] = list_model
             return result
 
-        global classifier
         if classifier.model_name == model_name:
             result['message'] = 'The model %s has been loaded already' % model_name
             return result
 
         # reload model
-        classifier.model_name = model_name
-        classifier.load_model()
-        # set cur model to redis
-        global kv_storage
-        kv_storage.set(classifier.model_name_key, model_name)
+        classifier.load_model(model_name)
+        # set cur model to redis and notify other workers
+        classifier.set_current_model(model_name)
 
         result['message'] = 'The model %s has been loaded successfully' % model_name
         return result
@@ -541,6 +1008,18 @@ class CurrentPageTypeModelResource(Resource):
         return result
 
 
+@ns_model.route('/batch_stats')
+class PredictBatchStatsResource(Resource):
+    """Batch sizes achieved by merging predict calls of concurrent requests"""
+    @api.response(200, 'Success')
+    def get(self):
+        """Get predict batch statistics of this worker"""
+        result = {'error': False, 'max_batch_size': predict_batcher.max_batch_size,
+                  'max_wait_ms': predict_batcher.max_wait * 1000}
+        result.update(predict_batcher.get_stats())
+        return result
+
+
 @ns_model.route('/evaluate')
 class EvaluationWebPageTypeModelResource(Resource):
     """Evaluate page type classifier models"""
@@ -580,7 +1059,7 @@ class EvaluationWebPageTypeModelResource(Resource):
 
         extractor_name = request.values.get('extractor', list_extractor[0])
         s_extractor = get_extractor(extractor_name)
-        if not extractor:
+        if not s_extractor:
             result['error'] = True
             result['message'] = "The extractor name '%s' does not support yet" % extractor_name
             return result
@@ -590,14 +1069,66 @@ class EvaluationWebPageTypeModelResource(Resource):
         s_crawler = PageCrawlerWithStorage(storage)
         s_content_getter = ContentGetter(crawler=s_crawler, extractor=s_extractor)
         s_classifier = PredictWebPageType(model_loc_dir, model_name, s_content_getter, evaluate_mode=True)
-        if classifier.get_current_model() != model_name:
-            s_classifier.web_page_type_classifier = None
-        else:
-            s_classifier.web_page_type_classifier = classifier.web_page_type_classifier
-            s_classifier.labels = classifier.web_page_type_classifier.named_steps['clf'].classes_
+        if classifier.get_current_model() == model_name:
+            # reuse the loaded model instead of loading the file again
+            s_classifier.share_model(classifier)
 
+        from nlp.evaluation_model import WebPageTypeModelEvaluation
         evaluation = WebPageTypeModelEvaluation(urls, storage, s_classifier)
         result.update(evaluation.evaluate())
         result['model_name'] = model_name
-        mg_client.close()
         return result
+
+
+@ns_stats.route('/pools')
+class PoolStatsResource(Resource):
+    """Mongo and Redis connection pools"""
+    @api.response(200, 'Success')
+    def get(self):
+        """Get connection pool checkout and wait counters of this worker"""
+        result = {'error': False}
+        result.update(get_pool_stats())
+        return result
+
+
+@ns_stats.route('/latency')
+class LatencyStatsResource(Resource):
+    """Latency percentiles of request stages"""
+    @api.response(200, 'Success')
+    def get(self):
+        """Get count, mean, p50, p90, p99 and max milliseconds of each stage in this worker.
+
+        Stages are prefixed by the endpoint (`classify.`, `extract.`, `job.`), `*_url` stages are per url and
+        `batch.*` stages are merged predict batches. Percentiles are over the last 2048 samples of a stage.
+        """
+        return {'error': False, 'stages': latency_stats.get_stats()}
+
+    @api.response(200, 'Success')
+    def delete(self):
+        """Reset the latency stats of this worker"""
+        latency_stats.reset()
+        return {'error': False, 'message': 'Latency stats were reset'}
+
+
+@ns_stats.route('/admission')
+class AdmissionStatsResource(Resource):
+    """Admission control of request urls"""
+    @api.response(200, 'Success')
+    def get(self):
+        """Get the urls in flight, the limits and the admitted and rejected requests of this worker"""
+        result = {'error': False}
+        result.update(admission.get_stats())
+        return result
+
+
+@api.route('/metrics')
+class MetricsResource(Resource):
+    """Prometheus metrics"""
+    @api.response(200, 'Success')
+    def get(self):
+        """Get request, url, error, cache, pool and model metrics in Prometheus text format.
+
+        All gunicorn workers are aggregated when prometheus_multiproc_dir is set, see gunicorn_conf.py.
+        """
+        body, content_type = metrics.get_metrics()
+        return Response(body, content_type=content_type)
@@ -0,0 +1,247 @@
+"""Classify a large set of pages offline with a process pool, without the api servers.
+
+    python classify_batch.py <input> <output> [--resume] [--processes N] [--model NAME] [--extractor NAME]
+
+The input is a file of urls (one per line, crawled by the workers), a directory of saved html files or a
+WARC crawl archive (needs warcio). A saved html file is classified under the url of its name, quoted
+(`urllib.quote(url, safe='')` + `.html`), else under its file:// path. Results are written as NDJSON, or CSV
+for a `.csv` output, as soon as each chunk is classified. With --resume the urls already in the output are
+skipped, so an interrupted run continues where it stopped.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import time
+import urllib
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from os import path
+
+from nlp.predict_data import PredictWebPageType
+from parser.content_getter import ContentGetter
+from parser.crawler import PageCrawler, StaticPageCrawler
+from parser.extractor import get_extractor, list_extractor
+from util.utils import get_logger, get_unicode
+
+logger = get_logger(__name__)
+
+model_loc_dir = os.environ.get('PAGE_TYPE_MODEL_DIR', path.join(path.dirname(path.realpath(__file__)), 'model'))
+default_model_name = os.environ.get('PAGE_TYPE_MODEL_NAME', '6k_ecommerce_news_blog_urls_dragnet_extractor.model')
+default_chunk_size = 50
+output_fields = ['url', 'type', 'confident', 'error', 'message']
+html_extensions = ('.html', '.htm')
+progress_interval = 10
+
+# set in each pool process by init_worker
+worker_classifier = None
+worker_extractor = None
+
+
+def to_page_url(url):
+    # same as the urls posted to the api
+    url = get_unicode(url).strip().lower()
+    if url and not url.startswith('http'):
+        url = 'http://' + url
+    return url
+
+
+def get_input_type(input_path):
+    if path.isdir(input_path):
+        return 'html'
+    if input_path.lower().endswith(('.warc', '.warc.gz', '.arc', '.arc.gz')):
+        return 'warc'
+    return 'urls'
+
+
+def iter_url_file(file_path):
+    """Yield (url, None), the pages are crawled by the workers"""
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rb') as f:
+        for line in f:
+            url = to_page_url(line)
+            if url:
+                yield url, None
+
+
+def iter_html_dir(dir_path):
+    """Yield (url, raw html) of the saved html files, in a stable order so that resume skips the same files"""
+    for root, dirs, files in os.walk(dir_path):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(html_extensions):
+                continue
+            file_path = path.join(root, name)
+            url = get_unicode(urllib.unquote(path.splitext(name)[0]))
+            if not url.startswith('http'):
+                url = 'file://' + get_unicode(path.abspath(file_path))
+            with open(file_path, 'rb') as f:
+                yield url, f.read()
+
+
+def iter_warc(file_path):
+    """Yield (url, raw html) of the html responses of a WARC archive"""
+    from warcio.archiveiterator import ArchiveIterator
+
+    with open(file_path, 'rb') as f:
+        for record in ArchiveIterator(f, arc2warc=True):
+            if record.rec_type != 'response' or not record.http_headers:
+                continue
+            if record.http_headers.get_statuscode() != '200':
+                continue
+            if 'html' not in (record.http_headers.get_header('Content-Type') or ''):
+                continue
+            yield get_unicode(record.rec_headers.get_header('WARC-Target-URI')), record.content_stream().read()
+
+
+def iter_input(input_path, input_type):
+    if input_type == 'html':
+        return iter_html_dir(input_path)
+    if input_type == 'warc':
+        return iter_warc(input_path)
+    return iter_url_file(input_path)
+
+
+def iter_chunks(items, chunk_size, done_urls):
+    chunk = []
+    for url, raw_content in items:
+        if url in done_urls:
+            continue
+        chunk.append((url, raw_content))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def init_worker(model_name, extractor_name):
+    global worker_classifier, worker_extractor
+    worker_extractor = get_extractor(extractor_name)
+    # pool processes are daemons, they cannot start the extractor process pool
+    worker_extractor.use_pool = False
+    worker_classifier = PredictWebPageType(model_loc_dir, model_name, None, evaluate_mode=True,
+                                           use_scoring_engine=True)
+    worker_classifier.get_model()
+
+
+def classify_chunk(chunk):
+    raw_pages = {url: raw_content for url, raw_content in chunk if raw_content is not None}
+    crawler = StaticPageCrawler(raw_pages) if raw_pages else PageCrawler()
+    content_getter = ContentGetter(crawler, worker_extractor)
+    pages = worker_classifier.predict([url for url, _ in chunk], content_getter=content_getter, use_cache=False)
+    return [{f: page.get(f) for f in output_fields} for page in pages]
+
+
+class ResultWriter(object):
+    """Append results to an NDJSON or CSV file, flushed after each chunk so that a resumed run loses nothing"""
+
+    def __init__(self, file_path, resume=False):
+        self.file_path = file_path
+        self.file_format = 'csv' if file_path.lower().endswith('.csv') else 'ndjson'
+        self.done_urls = set()
+        if resume and path.exists(file_path):
+            self._load_done_urls()
+        else:
+            open(file_path, 'wb').close()
+        write_header = self.file_format == 'csv' and not path.getsize(file_path)
+        self._file = open(file_path, 'ab')
+        self._csv_writer = csv.writer(self._file) if self.file_format == 'csv' else None
+        if write_header:
+            self._csv_writer.writerow(output_fields)
+
+    def _load_done_urls(self):
+        # a line cut by the interruption is dropped, its url is classified again
+        with open(self.file_path, 'rb+') as f:
+            content_end = 0
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                content_end += len(line)
+                if self.file_format == 'csv':
+                    url = next(csv.reader([line]))[0]
+                    if url != 'url':
+                        self.done_urls.add(url.decode('utf-8'))
+                else:
+                    self.done_urls.add(json.loads(line)['url'])
+            f.truncate(content_end)
+
+    def write(self, pages):
+        for page in pages:
+            if self._csv_writer:
+                # one line per row, resume reads the file line by line
+                self._csv_writer.writerow([unicode(page[f]).replace('\r', ' ').replace('\n', ' ').encode('utf-8')
+                                           if page[f] is not None else '' for f in output_fields])
+            else:
+                self._file.write(json.dumps(page) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run(input_path, output_path, input_type=None, resume=False, processes=None, chunk_size=default_chunk_size,
+        model_name=default_model_name, extractor_name=list_extractor[0]):
+    """Classify the input into the output file and return the counts"""
+    input_type = input_type or get_input_type(input_path)
+    processes = processes or cpu_count()
+    writer = ResultWriter(output_path, resume)
+    if writer.done_urls:
+        logger.info('Resume, skip %s urls already classified' % len(writer.done_urls))
+
+    stats = {'processed': 0, 'failed': 0, 'skipped': len(writer.done_urls)}
+    start = last_progress = time.time()
+    pool = Pool(processes, initializer=init_worker, initargs=(model_name, extractor_name))
+    # bounded in flight chunks, Pool.imap would read the whole input ahead of the workers
+    pending = deque()
+    max_pending = processes * 2
+
+    def write_next():
+        pages = pending.popleft().get()
+        writer.write(pages)
+        stats['processed'] += len(pages)
+        stats['failed'] += len([p for p in pages if p['error']])
+
+    try:
+        for chunk in iter_chunks(iter_input(input_path, input_type), chunk_size, writer.done_urls):
+            pending.append(pool.apply_async(classify_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                write_next()
+            if time.time() - last_progress >= progress_interval:
+                last_progress = time.time()
+                logger.info('Classified %s pages (%s failed), %.2f pages/second' %
+                            (stats['processed'], stats['failed'], stats['processed'] / (last_progress - start)))
+        while pending:
+            write_next()
+        pool.close()
+    finally:
+        pool.terminate()
+        writer.close()
+
+    stats['elapsed'] = round(time.time() - start, 2)
+    stats['throughput'] = round(stats['processed'] / max(stats['elapsed'], 1e-6), 2)
+    logger.info('Classified %s pages (%s failed) in %s seconds, %s pages/second' %
+                (stats['processed'], stats['failed'], stats['elapsed'], stats['throughput']))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='url list file, html directory or WARC archive')
+    parser.add_argument('output', help='.ndjson or .csv result file')
+    parser.add_argument('--input-type', choices=['urls', 'html', 'warc'], help='default is from the input path')
+    parser.add_argument('--resume', action='store_true', help='skip the urls already in the output')
+    parser.add_argument('--processes', type=int, help='default is the number of cpus')
+    parser.add_argument('--chunk-size', type=int, default=default_chunk_size)
+    parser.add_argument('--model', default=default_model_name, help='model file name in %s' % model_loc_dir)
+    parser.add_argument('--extractor', default=list_extractor[0], choices=list_extractor)
+    args = parser.parse_args()
+
+    stats = run(args.input, args.output, args.input_type, args.resume, args.processes, args.chunk_size,
+                args.model, args.extractor)
+    print json.dumps(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import uuid
+from datetime import datetime
+
+from pymongo import ASCENDING, ReturnDocument
+
+from util.utils import get_logger
+
+
+class ClassifyJob(object):
+    """Mongo storage of batch classification jobs and their results, both expire after `ttl` seconds"""
+    result_fields = ['url', 'type', 'confident', 'error', 'message', 'predicted_by']
+
+    def __init__(self, db, ttl=7 * 24 * 3600):
+        self.logger = get_logger(self.__class__.__name__)
+        self.jobs = db.classify_job
+        self.results = db.classify_job_result
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        self.jobs.create_index('created_date', expireAfterSeconds=self.ttl)
+        self.results.create_index('created_date', expireAfterSeconds=self.ttl)
+        self.results.create_index([('job_id', ASCENDING), ('_id', ASCENDING)])
+
+    def create(self, total, options):
+        job_id = uuid.uuid4().hex
+        self.jobs.insert_one({
+            '_id': job_id,
+            'status': 'queued',
+            'total': total,
+            'processed': 0,
+            'failed': 0,
+            'options': options,
+            'created_date': datetime.utcnow(),
+            'updated_date': datetime.utcnow()
+        })
+        return job_id
+
+    def add_results(self, job_id, pages):
+        if not pages:
+            return
+        now = datetime.utcnow()
+        docs = []
+        for page in pages:
+            doc = {f: page.get(f) for f in self.result_fields}
+            doc['job_id'] = job_id
+            doc['created_date'] = now
+            docs.append(doc)
+        self.results.insert_many(docs, ordered=False)
+
+        failed = len([p for p in pages if p.get('error')])
+        job = self.jobs.find_one_and_update({'_id': job_id},
+                                            {'$inc': {'processed': len(pages), 'failed': failed},
+                                             '$set': {'status': 'running', 'updated_date': now}},
+                                            return_document=ReturnDocument.AFTER)
+        if job and job['processed'] >= job['total']:
+            self.jobs.update_one({'_id': job_id}, {'$set': {'status': 'done', 'updated_date': now}})
+
+    def get(self, job_id):
+        return self.jobs.find_one({'_id': job_id})
+
+    def get_results(self, job_id, offset=0, limit=100):
+        result = []
+        for doc in self.results.find({'job_id': job_id}, self.result_fields + ['_id'])\
+                .sort('_id', ASCENDING)\
+                .skip(offset)\
+                .limit(limit):
+            doc.pop('_id')
+            result.append(doc)
+        return result
@@ -0,0 +1,107 @@
+"""Explain the main queries on web.page and flag the ones that scan the whole collection.
+
+    python -m data.explain_queries [--create-indexes]
+
+With --create-indexes the indexes of WebPageType are ensured first. Exits with 1 when a query uses COLLSCAN.
+"""
+import sys
+from datetime import datetime, timedelta
+
+from bson.son import SON
+
+from data.web_page_type import WebPageType
+
+sample_page_types = ['ecommerce', 'news/blog']
+sample_url_count = 50
+
+
+def get_stages(plan):
+    """Return the stages of an explain output, without the plans rejected by the planner"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key, value in plan.items():
+            if key != 'rejectedPlans':
+                stages += get_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += get_stages(value)
+    return stages
+
+
+def get_queries(storage):
+    """Return (name, explain function) of the queries the api, the modelers and the scripts run"""
+    sample_urls = [p['_id'] for p in storage.find({}, []).limit(sample_url_count)]
+    after = sample_urls[len(sample_urls) / 2] if sample_urls else ''
+    since = datetime.utcnow() - timedelta(days=7)
+
+    def find(q_filter, projection=None, sort=None, limit=0):
+        def explain():
+            cursor = storage.find(q_filter, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            return cursor.limit(limit).explain()
+        return explain
+
+    def aggregate(pipeline):
+        def explain():
+            return storage.database.command('aggregate', storage.name, pipeline=pipeline, explain=True)
+        return explain
+
+    type_filter = {'type': {'$in': sample_page_types}}
+    return [
+        ('search by type', find(type_filter, ['type', 'crawled_date'], [('_id', 1)], 50)),
+        ('search by type after url', find({'type': {'$in': sample_page_types}, '_id': {'$gt': after}},
+                                          ['type', 'crawled_date'], [('_id', 1)], 50)),
+        ('search all after url', find({'_id': {'$gt': after}}, ['type', 'crawled_date'], [('_id', 1)], 50)),
+        ('type counts', aggregate([{'$match': type_filter},
+                                   {'$group': {'_id': '$type', 'count': {'$sum': 1}}},
+                                   {'$sort': SON([('count', -1), ('_id', 1)])}])),
+        ('check unlabeled data', find({'_id': {'$in': sample_urls}, 'type': {'$exists': True}}, ['type'])),
+        ('delete by type', find(type_filter, [])),
+        ('training urls', aggregate([{'$match': type_filter},
+                                     {'$group': {'_id': '$type', 'urls': {'$push': '$_id'}}}])),
+        ('url model training urls', find({'type': {'$nin': ['', None]}}, ['type'])),
+        ('crawled since', find({'crawled_date': {'$gte': since}}, [])),
+        ('crawled since by type', find({'type': {'$in': sample_page_types}, 'crawled_date': {'$gte': since}}, []))
+    ]
+
+
+def explain_queries(storage):
+    """Return name, stages, COLLSCAN flag, examined and returned documents and milliseconds of each query"""
+    result = []
+    for name, explain in get_queries(storage):
+        plan = explain()
+        stats = plan.get('executionStats', {})
+        stages = get_stages(plan.get('queryPlanner', {}).get('winningPlan') or plan)
+        result.append({
+            'name': name,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages,
+            'docs_examined': stats.get('totalDocsExamined'),
+            'returned': stats.get('nReturned'),
+            'ms': stats.get('executionTimeMillis')
+        })
+    return result
+
+
+def main():
+    from util.database import get_mg_client
+
+    storage = get_mg_client().web.page
+    if '--create-indexes' in sys.argv[1:]:
+        WebPageType(storage).ensure_indexes()
+
+    print 'Indexes: %s' % ', '.join(sorted(storage.index_information()))
+    print '%-28s %-9s %12s %10s %8s  %s' % ('query', 'collscan', 'examined', 'returned', 'ms', 'stages')
+    reports = explain_queries(storage)
+    for report in reports:
+        print '%-28s %-9s %12s %10s %8s  %s' % (report['name'], 'YES' if report['collscan'] else '-',
+                                                report['docs_examined'], report['returned'], report['ms'],
+                                                ' < '.join(report['stages']))
+    sys.exit(1 if any(r['collscan'] for r in reports) else 0)
+
+
+if __name__ == '__main__':
+    main()
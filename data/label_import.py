@@ -0,0 +1,149 @@
+"""Import labels from a file of url,label rows into the page collection.
+
+    python -m data.label_import <file> [label]
+
+CSV rows are `url,label` or only `url` when a label is given, NDJSON lines are {"url": .., "type": ..}.
+A `.ndjson` or `.jsonl` file is read as NDJSON, any other as CSV.
+"""
+import csv
+import json
+import sys
+import time
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from data.web_page_type import type_count_cache
+from util.utils import get_logger, get_unicode
+
+default_batch_size = 1000
+ndjson_extensions = ('.ndjson', '.jsonl')
+
+
+def to_page_url(url):
+    # same as the urls posted to the api, not util.utils.normalize_url, so that labels match crawled pages
+    url = get_unicode(url).strip().lower()
+    if url and not url.startswith('http'):
+        url = 'http://' + url
+    return url
+
+
+def get_file_format(file_name):
+    return 'ndjson' if file_name and file_name.lower().endswith(ndjson_extensions) else 'csv'
+
+
+def iter_csv_rows(lines, label=None):
+    for row in csv.reader(line for line in lines if line.strip()):
+        url = row[0] if row else ''
+        if url.strip().lower() == 'url':
+            # header
+            continue
+        yield url, row[1] if len(row) > 1 and row[1].strip() else label
+
+
+def iter_ndjson_rows(lines, label=None):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            yield '', None
+            continue
+        url, row_label = row.get('url', ''), row.get('type') or row.get('label') or label
+        # a number or an object as url or label makes the row invalid, not the file
+        if not isinstance(url, basestring) or not isinstance(row_label, (basestring, type(None))):
+            yield '', None
+            continue
+        yield url, row_label
+
+
+def iter_label_rows(lines, file_format='csv', label=None):
+    """Yield normalized (url, label) of each row, url or label is empty for an invalid row.
+
+    `label` is used for the rows without one.
+    """
+    rows = iter_ndjson_rows(lines, label) if file_format == 'ndjson' else iter_csv_rows(lines, label)
+    for url, row_label in rows:
+        yield to_page_url(url or ''), get_unicode(row_label or '').strip()
+
+
+class LabelImporter(object):
+    """Upsert the labels of pages in unordered bulk batches, the rows are read as they come"""
+
+    def __init__(self, storage, batch_size=default_batch_size):
+        self.logger = get_logger(self.__class__.__name__)
+        self.storage = storage
+        self.batch_size = batch_size
+
+    def _write(self, batch, stats):
+        operations = [UpdateOne({'_id': url}, {'$set': {'type': label}}, upsert=True) for url, label in batch.items()]
+        try:
+            result = self.storage.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as ex:
+            # the other writes of the batch were applied
+            result = ex.details
+            errors = result.get('writeErrors', [])
+            stats['failed'] += len(errors)
+            self.logger.warning('%s labels failed in a batch: %s' % (len(errors), errors[:1]))
+        stats['inserted'] += result.get('nUpserted', 0)
+        stats['updated'] += result.get('nModified', 0)
+        stats['unchanged'] += result.get('nMatched', 0) - result.get('nModified', 0)
+        stats['batches'] += 1
+
+    def process(self, rows, progress=None):
+        """Apply the (url, label) rows and return the counts.
+
+        `progress(stats)` is called after each batch. A url repeated in a batch keeps its last label.
+        """
+        start = time.time()
+        stats = {'rows': 0, 'invalid': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'batches': 0}
+        batch = OrderedDict()
+        for url, label in rows:
+            stats['rows'] += 1
+            if not url or not label:
+                stats['invalid'] += 1
+                continue
+            batch.pop(url, None)
+            batch[url] = label
+            if len(batch) >= self.batch_size:
+                self._write(batch, stats)
+                batch = OrderedDict()
+                if progress:
+                    progress(stats)
+        if batch:
+            self._write(batch, stats)
+            if progress:
+                progress(stats)
+
+        stats['seconds'] = round(time.time() - start, 2)
+        if stats['batches']:
+            type_count_cache.clear()
+        self.logger.info('Import %s label rows in %s seconds: %s' % (stats['rows'], stats['seconds'], stats))
+        return stats
+
+
+def main():
+    from util.database import get_mg_client
+
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    file_path = sys.argv[1]
+    label = sys.argv[2] if len(sys.argv) > 2 else None
+
+    def progress(stats):
+        print '%s rows, %s inserted, %s updated, %s invalid, %s failed' % (
+            stats['rows'], stats['inserted'], stats['updated'], stats['invalid'], stats['failed'])
+
+    importer = LabelImporter(get_mg_client().web.page)
+    with open(file_path, 'rb') as f:
+        stats = importer.process(iter_label_rows(f, get_file_format(file_path), label), progress)
+    print 'Done in %s seconds: %s' % (stats['seconds'], stats)
+
+
+if __name__ == '__main__':
+    main()
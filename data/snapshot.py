@@ -0,0 +1,266 @@
+"""Columnar snapshots of labeled pages for offline training and evaluation.
+
+    python -m data.snapshot export <file.parquet> [extractor] [type ...]
+    python -m data.snapshot info <file.parquet>
+
+A snapshot is a Parquet file of url, type, extracted content, crawled_date and raw_size, one row group per
+export batch. Readers load only the columns and row groups they need, see PageSnapshot and
+SnapshotContentGetter. Requires pyarrow.
+"""
+import os
+import sys
+import threading
+import time
+
+from parser.extractor import get_extractor, list_extractor
+from parser.page import PageRecord
+from util.timing import StageTimer
+from util.utils import get_logger, get_unicode
+
+snapshot_columns = ['url', 'type', 'content', 'crawled_date', 'raw_size']
+default_batch_size = 1000
+export_projection = ['type', 'content', 'crawled_date']
+
+
+def get_schema(extractor_name):
+    import pyarrow as pa
+    return pa.schema([
+        pa.field('url', pa.string()),
+        pa.field('type', pa.string()),
+        pa.field('content', pa.string()),
+        pa.field('crawled_date', pa.timestamp('ms')),
+        pa.field('raw_size', pa.int64())
+    ], metadata={'extractor': extractor_name, 'created': str(time.time())})
+
+
+def export_snapshot(storage, file_path, extractor, page_types=None, batch_size=default_batch_size, progress=None):
+    """Extract the labeled and crawled pages of `storage` into a snapshot file and return the counts.
+
+    Pages are read with a projection in batches of `batch_size`, each batch is extracted and written as one row
+    group, so memory does not grow with the number of pages. `progress(stats)` is called after each batch.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    logger = get_logger(__name__)
+    start = time.time()
+    q_filter = {
+        'type': {'$in': page_types} if page_types else {'$nin': ['', None]},
+        'crawled_date': {'$exists': True},
+        'error': {'$ne': True}
+    }
+    schema = get_schema(extractor.name)
+    stats = {'pages': 0, 'row_groups': 0, 'raw_bytes': 0}
+    # write to a temporary file then rename, so readers never see a partial snapshot
+    tmp_path = file_path + '.tmp'
+    try:
+        writer = pq.ParquetWriter(tmp_path, schema, compression='snappy')
+        try:
+            batch = []
+            cursor = storage.find(q_filter, export_projection).batch_size(batch_size)
+            for page in cursor:
+                batch.append(page)
+                if len(batch) >= batch_size:
+                    _write_batch(pa, writer, schema, extractor, batch, stats)
+                    batch = []
+                    if progress:
+                        progress(stats)
+            if batch:
+                _write_batch(pa, writer, schema, extractor, batch, stats)
+                if progress:
+                    progress(stats)
+        finally:
+            writer.close()
+    except Exception:
+        # a failed export leaves no partial snapshot behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, file_path)
+
+    stats['seconds'] = round(time.time() - start, 2)
+    stats['file_bytes'] = os.path.getsize(file_path)
+    logger.info('Export %s pages to %s in %s seconds' % (stats['pages'], file_path, stats['seconds']))
+    return stats
+
+
+def _write_batch(pa, writer, schema, extractor, batch, stats):
+    raw_sizes = {}
+    pages = {}
+    for doc in batch:
+        page = PageRecord.from_document(doc)
+        # the record keeps the only reference to the html, it is released as soon as the page is extracted
+        doc.pop('content', None)
+        raw_sizes[page.url] = len(page.raw)
+        pages[page.url] = page
+    # the same "url, text" content the modeler trains on
+    pages = extractor.process(pages)
+
+    urls = [page['_id'] for page in batch]
+    arrays = [
+        pa.array([get_unicode(url) for url in urls], type=pa.string()),
+        pa.array([get_unicode(page['type']) for page in batch], type=pa.string()),
+        pa.array([get_unicode(pages[url].content) for url in urls], type=pa.string()),
+        pa.array([page.get('crawled_date') for page in batch], type=pa.timestamp('ms')),
+        pa.array([raw_sizes[url] for url in urls], type=pa.int64())
+    ]
+    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    stats['pages'] += len(batch)
+    stats['row_groups'] += 1
+    stats['raw_bytes'] += sum(raw_sizes.values())
+
+
+class PageSnapshot(object):
+    """Lazy reader of a snapshot file, the file is opened on first use"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = None
+
+    @property
+    def file(self):
+        if self._file is None:
+            import pyarrow.parquet as pq
+            self._file = pq.ParquetFile(self.file_path)
+        return self._file
+
+    @property
+    def extractor_name(self):
+        metadata = self.file.metadata.metadata or {}
+        return metadata.get(b'extractor', b'').decode('utf-8') or list_extractor[0]
+
+    @property
+    def num_rows(self):
+        return self.file.metadata.num_rows
+
+    @property
+    def num_row_groups(self):
+        return self.file.num_row_groups
+
+    def read_row_group(self, idx, columns=None):
+        """Return the pyarrow table of one row group with only `columns`"""
+        return self.file.read_row_group(idx, columns=columns)
+
+    def iter_row_groups(self, columns=None):
+        for idx in range(self.num_row_groups):
+            yield self.read_row_group(idx, columns)
+
+    def read(self, columns=None, page_types=None):
+        """Return a pandas data frame of `columns`, only the rows of `page_types` if given"""
+        import pandas as pd
+
+        columns = list(columns) if columns else None
+        read_columns = columns + ['type'] if columns and page_types and 'type' not in columns else columns
+        frames = []
+        # filter each row group before the next one is read, the other types are never all in memory
+        for table in self.iter_row_groups(read_columns):
+            frame = table.to_pandas()
+            if page_types:
+                frame = frame[frame['type'].isin(page_types)]
+            frames.append(frame[columns] if columns else frame)
+        if not frames:
+            return pd.DataFrame(columns=columns or snapshot_columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def get_labels(self, page_types=None):
+        """Return {url: type} of the snapshot, only the url and type columns are read"""
+        labels = {}
+        for table in self.iter_row_groups(['url', 'type']):
+            for url, page_type in zip(table.column('url').to_pylist(), table.column('type').to_pylist()):
+                if not page_types or page_type in page_types:
+                    labels[url] = page_type
+        return labels
+
+    def get_type_counts(self):
+        counts = {}
+        for table in self.iter_row_groups(['type']):
+            for page_type in table.column('type').to_pylist():
+                counts[page_type] = counts.get(page_type, 0) + 1
+        return counts
+
+
+class SnapshotContentGetter(object):
+    """Content getter serving extracted pages from a snapshot instead of crawling and extracting them.
+
+    Pass it to WebPageTypeModeler, or to the PredictWebPageType of an evaluation, to train or evaluate offline.
+    Only the row groups holding requested urls are read. Urls not in the snapshot are returned as errors.
+    """
+
+    def __init__(self, snapshot):
+        self.logger = get_logger(self.__class__.__name__)
+        self.snapshot = snapshot if isinstance(snapshot, PageSnapshot) else PageSnapshot(snapshot)
+        # the modeler keys its feature store by extractor name
+        self.extractor = get_extractor(self.snapshot.extractor_name)
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _get_index(self):
+        # url -> (row group, row), built once from the url column
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    index = {}
+                    for group_idx, table in enumerate(self.snapshot.iter_row_groups(['url'])):
+                        for row_idx, url in enumerate(table.column('url').to_pylist()):
+                            index[url] = (group_idx, row_idx)
+                    self._index = index
+        return self._index
+
+    def process(self, urls, timer=None):
+        timer = timer or StageTimer()
+        result = {}
+        group_rows = {}
+        with timer.stage('snapshot'):
+            index = self._get_index()
+            for url in set(urls):
+                position = index.get(get_unicode(url))
+                if position is None:
+                    result[url] = PageRecord(url, error=True, message='Not in snapshot')
+                    continue
+                group_rows.setdefault(position[0], []).append((url, position[1]))
+
+            for group_idx, rows in group_rows.items():
+                table = self.snapshot.read_row_group(group_idx, ['content', 'type'])
+                contents = table.column('content').to_pylist()
+                types = table.column('type').to_pylist()
+                for url, row_idx in rows:
+                    result[url] = PageRecord(url, content=contents[row_idx], type=types[row_idx])
+        return result
+
+    def process_iter(self, urls, timer=None):
+        for url, page in self.process(urls, timer).iteritems():
+            yield url, page
+
+
+def main():
+    from util.database import get_mg_client
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'info'):
+        print __doc__
+        sys.exit(1)
+    command, file_path = sys.argv[1], sys.argv[2]
+
+    if command == 'info':
+        snapshot = PageSnapshot(file_path)
+        print '%s: %s pages in %s row groups, extractor %s' % (file_path, snapshot.num_rows,
+                                                               snapshot.num_row_groups, snapshot.extractor_name)
+        for page_type, count in sorted(snapshot.get_type_counts().items()):
+            print '%-20s %10d' % (page_type, count)
+        return
+
+    extractor_name = sys.argv[3] if len(sys.argv) > 3 else list_extractor[0]
+    extractor = get_extractor(extractor_name)
+    if not extractor:
+        print "The extractor name '%s' does not support yet" % extractor_name
+        sys.exit(1)
+
+    def progress(stats):
+        print '%s pages, %s row groups, %.1f MB raw html' % (stats['pages'], stats['row_groups'],
+                                                             stats['raw_bytes'] / 1024.0 / 1024)
+
+    stats = export_snapshot(get_mg_client().web.page, file_path, extractor, sys.argv[4:] or None, progress=progress)
+    print 'Done in %s seconds, %.1f MB file: %s' % (stats['seconds'], stats['file_bytes'] / 1024.0 / 1024, stats)
+
+
+if __name__ == '__main__':
+    main()
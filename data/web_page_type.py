@@ -1,13 +1,36 @@
+import json
+
 from bson.son import SON
+from pymongo import ASCENDING
 
+from util.cache import LRUCache
 from util.utils import get_logger
 
+# type counts of a filter are a $group over all matching pages, browsing pages of the same filter reuses them.
+# Updates and deletes of this process clear it, other workers see them after the ttl
+type_count_cache = LRUCache(max_size=1000, ttl=60)
+# only these fields are listed, pages also store the raw html and the content
+search_projection = ['type', 'crawled_date']
+
 
 class WebPageType(object):
+    # (type, _id) serves the type filters sorted and paged by url, and type alone as its prefix,
+    # (type, crawled_date) and crawled_date the crawl date filters with or without a type
+    indexes = [
+        [('type', ASCENDING), ('_id', ASCENDING)],
+        [('type', ASCENDING), ('crawled_date', ASCENDING)],
+        [('crawled_date', ASCENDING)]
+    ]
+
     def __init__(self, storage):
         self.logger = get_logger(self.__class__.__name__)
         self.storage = storage
 
+    def ensure_indexes(self):
+        # background, a foreground build locks the collection while indexing millions of pages
+        for keys in self.indexes:
+            self.storage.create_index(keys, background=True)
+
     def update(self, urls, page_type):
         result = 0
         self.logger.info('Update urls with type %s: %s' % (urls, page_type))
@@ -24,6 +47,7 @@ class WebPageType(object):
         if urls:
             self.storage.insert_many({'_id': url, 'type': page_type} for url in urls)
             result += len(urls)
+        type_count_cache.clear()
         return result
 
     @staticmethod
@@ -36,18 +60,38 @@ class WebPageType(object):
 
         return q_filter
 
-    def search(self, page_types, urls, limit, offset):
+    def search(self, page_types, urls, limit, offset=0, after=None):
+        """Return a page of urls sorted by url, the count of each type and the total.
+
+        Pass the `next_after` of the previous page as `after` to get the next one, it seeks the _id index
+        instead of skipping `offset` pages. `next_after` is None after the last page.
+        """
         result = []
         q_filter = self._build_filter(page_types, urls)
-        for page in self.storage.find(q_filter)\
-                .sort('_id', 1)\
-                .skip(offset)\
-                .limit(limit):
+        page_filter = dict(q_filter)
+        if after:
+            page_filter['_id'] = dict(q_filter.get('_id', {}))
+            page_filter['_id']['$gt'] = after
+        cursor = self.storage.find(page_filter, search_projection).sort('_id', 1)
+        if offset and not after:
+            cursor = cursor.skip(offset)
+        for page in cursor.limit(limit):
             result.append({
                 'url': page['_id'],
                 'type': page.get('type', ''),
                 'crawled_date': str(page.get('crawled_date', "Haven't crawled yet"))
             })
+        next_after = result[-1]['url'] if limit and len(result) == limit else None
+
+        type_count, total = self.count_types(q_filter)
+        return result, type_count, total, next_after
+
+    def count_types(self, q_filter):
+        cache_key = json.dumps(q_filter, sort_keys=True)
+        cached = type_count_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         agg_pipeline = [
             {'$match': q_filter},
             {'$group': {'_id': '$type', 'count': {'$sum': 1}}},
@@ -61,10 +105,12 @@ class WebPageType(object):
             type_count.append({'type': a['_id'] if a['_id'] else '', 'count': count})
             total += count
 
-        return result, type_count, total
+        type_count_cache.set(cache_key, (type_count, total))
+        return type_count, total
 
     def delete(self, page_types, urls):
         result = self.storage.delete_many(self._build_filter(page_types, urls))
+        type_count_cache.clear()
         return result.deleted_count
 
     def check_unlabeled_data(self, urls):
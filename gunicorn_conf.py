@@ -0,0 +1,62 @@
+import gc
+import os
+import shutil
+
+from util import metrics
+
+# PAGE_TYPE_PRELOAD=1 loads the app, the models and the extractor backend once in the master before forking,
+# the workers share these memory pages copy-on-write instead of each loading its own copy
+page_type_preload = os.environ.get('PAGE_TYPE_PRELOAD') == '1'
+# gunicorn setting: import the app in the master, so that it is shared by the forked workers
+preload_app = page_type_preload
+# Python 2 has no gc.freeze and a full collection writes to every preloaded object, copying its pages,
+# so preloaded workers run full collections this many times less often
+worker_gc_full_collection_factor = int(os.environ.get('PAGE_TYPE_GC_FULL_COLLECTION_FACTOR', 100))
+
+
+def on_starting(server):
+    # metric files left by the workers of a previous run would be summed with the new ones
+    if metrics.multiprocess_dir:
+        if os.path.exists(metrics.multiprocess_dir):
+            shutil.rmtree(metrics.multiprocess_dir)
+        os.makedirs(metrics.multiprocess_dir)
+    # once in the master, not in every worker: an unreachable Mongo would hold each worker boot for the
+    # server selection timeout, close to the worker timeout
+    ensure_page_indexes(server)
+
+
+def ensure_page_indexes(server):
+    from data.web_page_type import WebPageType
+    from util.database import get_mg_client
+
+    # the workers still serve classification when Mongo is down, so only log
+    try:
+        WebPageType(get_mg_client().web.page).ensure_indexes()
+    except Exception as ex:
+        server.log.warning('Cannot ensure the indexes of web.page: %s' % ex)
+
+
+def when_ready(server):
+    # runs in the master before the first worker is forked
+    if not page_type_preload:
+        return
+    from api.api import preload
+    preload()
+    # the loaded objects survive into the oldest generation, only full collections visit them
+    gc.collect()
+
+
+def post_fork(server, worker):
+    if page_type_preload:
+        threshold0, threshold1, threshold2 = gc.get_threshold()
+        gc.set_threshold(threshold0, threshold1, threshold2 * worker_gc_full_collection_factor)
+
+
+def post_worker_init(worker):
+    # the worker starts accepting requests after this hook returns
+    from api.api import warm_up
+    warm_up()
+
+
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,33 @@
+import os
+from os import path
+
+from data.classify_job import ClassifyJob
+from nlp.classify_job_worker import ClassifyJobWorker, default_job_queue_name
+from nlp.predict_data import PredictWebPageType
+from nlp.prediction_cache import PredictionCache
+from nlp.url_classifier import UrlTypeClassifier
+from parser.content_getter import get_content_getter
+from util.database import get_mg_client, get_redis_conn
+from util.job_queue import RedisJobQueue
+
+# same model as the api workers
+model_loc_dir = os.environ.get('PAGE_TYPE_MODEL_DIR', path.join(path.dirname(path.realpath(__file__)), 'model'))
+default_model_name = os.environ.get('PAGE_TYPE_MODEL_NAME', '6k_ecommerce_news_blog_urls_dragnet_extractor.model')
+default_url_model_name = 'url_page_type_classifier.model'
+
+
+def main():
+    job_storage = ClassifyJob(get_mg_client().web)
+    job_storage.ensure_indexes()
+    url_classifier = UrlTypeClassifier(model_loc_dir, default_url_model_name, get_redis_conn())
+    url_classifier.load_model()
+    classifier = PredictWebPageType(model_loc_dir, default_model_name, get_content_getter(),
+                                    prediction_cache=PredictionCache(get_redis_conn()), url_classifier=url_classifier,
+                                    use_scoring_engine=True)
+    worker = ClassifyJobWorker(RedisJobQueue(get_redis_conn(), default_job_queue_name), job_storage, classifier,
+                               get_content_getter)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
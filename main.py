@@ -1,4 +1,5 @@
-from api.api import app
+from api.api import app, warm_up
 
 if __name__ == '__main__':
+    warm_up()
     app.run(debug=True, host='0.0.0.0', port=1999)
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from util.timing import StageTimer
+from util.utils import get_logger
+
+default_job_queue_name = 'page_type_classify_job'
+
+
+def chunk_tasks(job_id, urls, chunk_size, options):
+    tasks = []
+    for idx in range(0, len(urls), chunk_size):
+        task = {'job_id': job_id, 'urls': urls[idx:idx + chunk_size]}
+        task.update(options)
+        tasks.append(task)
+    return tasks
+
+
+class ClassifyJobWorker(object):
+    """Take url chunks of batch classification jobs from the queue, classify and store the results"""
+
+    def __init__(self, queue, job_storage, classifier, get_content_getter, pop_timeout=5, heartbeat_interval=10,
+                 requeue_interval=30, max_attempts=3):
+        self.logger = get_logger(self.__class__.__name__)
+        self.queue = queue
+        self.job_storage = job_storage
+        self.classifier = classifier
+        self.get_content_getter = get_content_getter
+        self.pop_timeout = pop_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.requeue_interval = requeue_interval
+        # a chunk requeued this many times killed its workers, its urls are stored as errors
+        self.max_attempts = max_attempts
+        self._stopped = threading.Event()
+
+    def process(self, task):
+        urls = task['urls']
+        if task.get('attempts', 0) >= self.max_attempts:
+            self.logger.error('Classify job %s chunk failed %s times, give up' % (task['job_id'], task['attempts']))
+            message = 'The worker stopped %s times while classifying these urls' % task['attempts']
+            pages = [{'url': url, 'type': '', 'confident': 0, 'error': True, 'message': message} for url in urls]
+            self.job_storage.add_results(task['job_id'], pages)
+            return
+        try:
+            pages = self.classifier.predict(urls, content_getter=self.get_content_getter(task.get('extractor')),
+                                            url_threshold=task.get('url_threshold'), timer=StageTimer(prefix='job.'))
+        except Exception as ex:
+            self.logger.error('Classify job %s error: %s' % (task['job_id'], ex))
+            pages = [{'url': url, 'type': '', 'confident': 0, 'error': True, 'message': str(ex)} for url in urls]
+        self.job_storage.add_results(task['job_id'], pages)
+
+    def _beat(self):
+        # a thread, processing a chunk can take longer than the heartbeat ttl
+        while not self._stopped.is_set():
+            try:
+                self.queue.heartbeat()
+            except Exception as ex:
+                self.logger.error('Classify job worker heartbeat error: %s' % ex)
+            self._stopped.wait(self.heartbeat_interval)
+
+    def _requeue_stale(self, include_self=False):
+        try:
+            self.queue.requeue_stale(include_self=include_self)
+        except Exception as ex:
+            self.logger.error('Requeue stale classify job chunks error: %s' % ex)
+
+    def run(self):
+        self.logger.info('Start classify job worker on queue %s...' % self.queue.name)
+        heartbeat = threading.Thread(target=self._beat, name='classify-job-heartbeat')
+        heartbeat.daemon = True
+        heartbeat.start()
+        # chunks left by a previous process with the same worker id
+        self._requeue_stale(include_self=True)
+        last_requeue = time.time()
+        while not self._stopped.is_set():
+            if time.time() - last_requeue >= self.requeue_interval:
+                self._requeue_stale()
+                last_requeue = time.time()
+            try:
+                task = self.queue.pop(timeout=self.pop_timeout)
+            except Exception as ex:
+                self.logger.error('Pop classify job error: %s, retry after %s seconds' % (ex, self.pop_timeout))
+                time.sleep(self.pop_timeout)
+                continue
+            if task:
+                start = time.time()
+                try:
+                    self.process(task)
+                except Exception:
+                    # the chunk stays in the processing list, stop the heartbeat so that it is requeued
+                    self._stopped.set()
+                    raise
+                # only once the results are saved, a chunk of a worker dying before is requeued
+                self.queue.ack(task)
+                self.logger.info('Classified %s urls of job %s in %.2f seconds' %
+                                 (len(task['urls']), task['job_id'], time.time() - start))
+        self.logger.info('End classify job worker on queue %s...' % self.queue.name)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='classify-job-worker')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
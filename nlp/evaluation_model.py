@@ -1,20 +1,37 @@
-from sklearn.metrics import classification_report, precision_recall_fscore_support, accuracy_score
-from util.utils import get_logger
+import time
+from collections import Counter
+
+import numpy as np
 import pandas as pd
 
+from util.utils import get_logger
+
 __author__ = 'diepdt'
 
 
 class WebPageTypeModelEvaluation(object):
-    def __init__(self, urls, storage, classifier):
+    """Evaluate a classifier on labeled urls.
+
+    Urls are streamed through the classifier in chunks of `chunk_size` and only the confusion
+    counts are kept between chunks, so memory does not grow with the test set size.
+    Labels are read from `storage`, or from `labels` ({url: type}, e.g. `PageSnapshot.get_labels()`) if given.
+    """
+
+    def __init__(self, urls, storage, classifier, chunk_size=500, labels=None):
         self.logger = get_logger(self.__class__.__name__)
         self.urls = urls
         self.storage = storage
         self.classifier = classifier
+        self.chunk_size = chunk_size
+        self.labels = labels
 
-    def load_test_data(self):
+    def load_test_data(self, urls):
         result = []
-        for page in self.storage.find({'_id': {'$in': self.urls}}):
+        if self.labels is not None:
+            pages = ({'_id': url, 'type': self.labels[url]} for url in urls if url in self.labels)
+        else:
+            pages = self.storage.find({'_id': {'$in': urls}, 'type': {'$exists': True}}, ['type'])
+        for page in pages:
             if not page['type']:
                 continue
             result.append([page['_id'], page['type']])
@@ -22,29 +39,69 @@ class WebPageTypeModelEvaluation(object):
         return pd.DataFrame(result, columns=['url', 'type'])
 
     def evaluate(self):
-        predicts = {p['url']: p['type'] for p in self.classifier.predict(self.urls)}
-        data = self.load_test_data()
-        removed_rows = []
-        data['predict'] = ''
-        for idx, row in data.iterrows():
-            pred = predicts.get(row['url'], '')
-            if pred:
-                row['predict'] = pred
-            else:
-                removed_rows.append(idx)
-
-        # data = data.drop(data.index[removed_rows])
-        # self.logger.debug('Test data: ' + data)
-
-        y_true = data['type'].values
-        y_pred = data['predict'].values
-        prf = precision_recall_fscore_support(y_true, y_pred, average='weighted', pos_label=None)
-        result = {
-            'summary': classification_report(y_true, y_pred),
-            'precision': round(prf[0], 2),
-            'recall': round(prf[1], 2),
-            'f_measure': round(prf[2], 2),
-            'accuracy': round(accuracy_score(y_true, y_pred), 2),
-            'data': {k: len(v) for k, v in data.groupby('type').groups.items()}
-        }
+        confusion = Counter()
+        failed = 0
+        processed = 0
+        start = time.time()
+        for idx in range(0, len(self.urls), self.chunk_size):
+            urls = self.urls[idx:idx + self.chunk_size]
+            data = self.load_test_data(urls)
+            predicts = pd.DataFrame([(p['url'], p['type']) for p in self.classifier.predict(urls)],
+                                    columns=['url', 'predict'])
+            # pages failed to crawl or extract have empty prediction
+            data = data.merge(predicts, on='url', how='left')
+            data['predict'] = data['predict'].fillna('')
+            failed += int((data['predict'] == '').sum())
+            for (y_true, y_pred), count in data.groupby(['type', 'predict']).size().iteritems():
+                confusion[(y_true, y_pred)] += int(count)
+
+            processed += len(urls)
+            self.logger.info('Evaluated %s/%s urls, %.2f urls/second' %
+                             (processed, len(self.urls), processed / max(time.time() - start, 1e-6)))
+
+        elapsed = time.time() - start
+        result = self._score(confusion)
+        result['failed'] = failed
+        result['elapsed'] = round(elapsed, 2)
+        result['throughput'] = round(processed / max(elapsed, 1e-6), 2)
         return result
+
+    @staticmethod
+    def _score(confusion):
+        labels = sorted(set(t for t, _ in confusion) | set(p for _, p in confusion))
+        label_index = {label: idx for idx, label in enumerate(labels)}
+        matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for (y_true, y_pred), count in confusion.items():
+            matrix[label_index[y_true], label_index[y_pred]] += count
+
+        true_positive = np.diag(matrix).astype(np.float64)
+        support = matrix.sum(axis=1)
+        predicted = matrix.sum(axis=0)
+        total = support.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.nan_to_num(true_positive / predicted)
+            recall = np.nan_to_num(true_positive / support)
+            f_measure = np.nan_to_num(2 * precision * recall / (precision + recall))
+
+        weights = support / float(total) if total else support
+        avg_precision, avg_recall, avg_f_measure = [float((v * weights).sum()) for v in (precision, recall, f_measure)]
+
+        # same layout as sklearn classification_report
+        width = max([len(l) for l in labels] + [len('avg / total')])
+        lines = ['%s %9s %9s %9s %9s' % (' ' * width, 'precision', 'recall', 'f1-score', 'support'), '']
+        for label, p, r, f, s in zip(labels, precision, recall, f_measure, support):
+            if not s and not label:
+                continue
+            lines.append('%s %9.2f %9.2f %9.2f %9d' % (label.rjust(width), p, r, f, s))
+        lines.append('')
+        lines.append('%s %9.2f %9.2f %9.2f %9d' % ('avg / total'.rjust(width), avg_precision, avg_recall,
+                                                   avg_f_measure, total))
+
+        return {
+            'summary': '\n'.join(lines) + '\n',
+            'precision': round(avg_precision, 2),
+            'recall': round(avg_recall, 2),
+            'f_measure': round(avg_f_measure, 2),
+            'accuracy': round(float(true_positive.sum()) / total, 2) if total else 0,
+            'data': {label: int(s) for label, s in zip(labels, support) if s}
+        }
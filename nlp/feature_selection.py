@@ -0,0 +1,59 @@
+import numpy as np
+import scipy.sparse as sp
+
+# sklearn is imported by the functions, the api only needs `list_feature_selection` at start up
+list_feature_selection = ['chi2', 'mutual_info']
+
+
+def get_score_func(name):
+    if name == 'chi2':
+        from sklearn.feature_selection import chi2
+        return chi2
+    elif name == 'mutual_info':
+        from sklearn.feature_selection import mutual_info_classif
+        return mutual_info_classif
+    return None
+
+
+def prune_vocabulary(vectorizer, support):
+    """Keep only the selected features in a fitted vectorizer, so transform outputs them directly"""
+    indices = np.flatnonzero(support)
+    new_index = dict((old, new) for new, old in enumerate(indices))
+    vectorizer.vocabulary_ = dict((term, new_index[idx]) for term, idx in vectorizer.vocabulary_.items()
+                                  if idx in new_index)
+    if hasattr(vectorizer, '_tfidf'):
+        idf = vectorizer.idf_[indices]
+        try:
+            vectorizer.idf_ = idf
+        except AttributeError:
+            # older sklearn has read only idf_
+            vectorizer._tfidf._idf_diag = sp.spdiags(idf, diags=0, m=len(idf), n=len(idf), format='csr')
+        if hasattr(vectorizer._tfidf, 'n_features_in_'):
+            vectorizer._tfidf.n_features_in_ = len(idf)
+    strip_stop_words(vectorizer)
+    return vectorizer
+
+
+def strip_stop_words(vectorizer):
+    # stop_words_ keeps every term cut by min_df/max_df, it is only for introspection and bloats the model file
+    if hasattr(vectorizer, 'stop_words_'):
+        vectorizer.stop_words_ = set()
+    return vectorizer
+
+
+def select_features(vectorizer, x, y, method, num_features):
+    """Select the `num_features` best features of a fitted vectorizer, return the pruned matrix"""
+    from sklearn.feature_selection import SelectKBest
+    from sklearn.preprocessing import normalize
+
+    score_func = get_score_func(method)
+    if not score_func:
+        raise ValueError("Feature selection '%s' is not supported" % method)
+    selector = SelectKBest(score_func, k=min(num_features, x.shape[1]))
+    selector.fit(x, y)
+    support = selector.get_support()
+    prune_vocabulary(vectorizer, support)
+    x = x[:, np.flatnonzero(support)]
+    # rows were normalized over the full vocabulary, re-normalize as transform of the pruned vectorizer does
+    norm = getattr(vectorizer, 'norm', None)
+    return normalize(x, norm=norm, copy=False) if norm else x
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import dill
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cross_validation import train_test_split
+from sklearn.metrics import f1_score, accuracy_score, classification_report
+
+from util.utils import get_logger
+
+
+def get_utf8(text):
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+
+class FeatureSet(object):
+    def __init__(self, matrix, vectorizer, urls, labels, params):
+        self.matrix = matrix
+        self.vectorizer = vectorizer
+        self.urls = urls
+        self.labels = labels
+        self.params = params
+
+    @property
+    def vocabulary(self):
+        return self.vectorizer.vocabulary_
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+
+class FeatureStore(object):
+    """Vectorized training corpora on disk, keyed by extractor, tokenizer, vectorizer parameters, urls and labels.
+
+    The CSR arrays are saved as .npy files and loaded memory mapped, so a stored corpus can be
+    reused by many classifier fitting and evaluation runs without crawling, extracting,
+    tokenizing or vectorizing again.
+    """
+    matrix_files = ['data', 'indices', 'indptr']
+
+    def __init__(self, root_dir):
+        self.logger = get_logger(self.__class__.__name__)
+        self.root_dir = root_dir
+        if not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+
+    @staticmethod
+    def build_key(extractor_name, tokenizer_name, vectorizer_params, urls, labels=None):
+        """`labels` is the current {url: type} of the urls, relabeled urls make a new key"""
+        labels = labels or {}
+        url_hash = hashlib.sha1()
+        for url in sorted(urls):
+            url_hash.update(get_utf8(url))
+            url_hash.update('\t%s\n' % get_utf8(labels.get(url) or ''))
+        params = {
+            'extractor': extractor_name,
+            'tokenizer': tokenizer_name,
+            'vectorizer': vectorizer_params,
+            'urls': url_hash.hexdigest()
+        }
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root_dir, key)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self._path(key), 'meta.json'))
+
+    def save(self, key, matrix, vectorizer, urls, labels, params=None):
+        matrix = sp.csr_matrix(matrix)
+        # write to a temporary directory then rename, so readers never see a partial entry
+        tmp_dir = tempfile.mkdtemp(dir=self.root_dir)
+        try:
+            for name in self.matrix_files:
+                np.save(os.path.join(tmp_dir, name + '.npy'), getattr(matrix, name))
+            np.save(os.path.join(tmp_dir, 'urls.npy'), np.array(urls, dtype=unicode))
+            np.save(os.path.join(tmp_dir, 'labels.npy'), np.array(labels, dtype=unicode))
+            with open(os.path.join(tmp_dir, 'vectorizer.dill'), 'wb') as f:
+                dill.dump(vectorizer, f)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'shape': matrix.shape, 'params': params or {}, 'created': time.time()}, f)
+            if os.path.exists(self._path(key)):
+                shutil.rmtree(self._path(key))
+            os.rename(tmp_dir, self._path(key))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.logger.info('Saved feature set %s: %s documents x %s features' % (key, matrix.shape[0], matrix.shape[1]))
+
+    def load(self, key, mmap=True):
+        entry_dir = self._path(key)
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(entry_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        data, indices, indptr = [np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode=mmap_mode)
+                                 for name in self.matrix_files]
+        matrix = sp.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+        with open(os.path.join(entry_dir, 'vectorizer.dill'), 'rb') as f:
+            vectorizer = dill.load(f)
+        urls = np.load(os.path.join(entry_dir, 'urls.npy'), mmap_mode=mmap_mode)
+        labels = np.load(os.path.join(entry_dir, 'labels.npy'), mmap_mode=mmap_mode)
+        self.logger.info('Loaded feature set %s: %s documents x %s features' % (key, matrix.shape[0], matrix.shape[1]))
+        return FeatureSet(matrix, vectorizer, urls, labels, meta['params'])
+
+    def delete(self, key):
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def list_keys(self):
+        return [k for k in os.listdir(self.root_dir) if self.exists(k)]
+
+
+def evaluate_classifier(feature_set, clf, test_ratio=0.3, random_state=0):
+    """Fit `clf` on a stored feature set and score it on a hold out split"""
+    indices = np.arange(len(feature_set))
+    train_indices, test_indices = train_test_split(indices, test_size=test_ratio, random_state=random_state)
+    labels = np.asarray(feature_set.labels)
+    start = time.time()
+    clf.fit(feature_set.matrix[train_indices], labels[train_indices])
+    fit_time = time.time() - start
+    start = time.time()
+    y_predict = clf.predict(feature_set.matrix[test_indices])
+    predict_time = time.time() - start
+    y_test = labels[test_indices]
+    return {
+        'summary': classification_report(y_test, y_predict),
+        'f_measure': round(f1_score(y_test, y_predict, average='weighted'), 4),
+        'accuracy': round(accuracy_score(y_test, y_predict), 4),
+        'fit_time': round(fit_time, 3),
+        'predict_time': round(predict_time, 3)
+    }
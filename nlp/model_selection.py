@@ -0,0 +1,150 @@
+import hashlib
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+import dill
+import numpy as np
+from sklearn.cross_validation import KFold
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.grid_search import ParameterGrid
+from sklearn.metrics import f1_score, accuracy_score
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+
+from util.utils import get_logger
+
+default_param_grid = {
+    'ngram_range': [(1, 1), (1, 2)],
+    'min_df': [1, 0.01, 0.1],
+    'max_df': [0.5, 0.9, 1.0],
+    'alpha': [0.01, 0.1, 1.0]
+}
+
+# data shared with pool processes, set before forking so it is not pickled per task
+_shared = {}
+
+
+def identity(tokens):
+    return tokens
+
+
+def build_pipeline(config):
+    """Build the classifier pipeline for pre-tokenized documents"""
+    return Pipeline([
+        ('vector', TfidfVectorizer(tokenizer=identity, preprocessor=identity, lowercase=False,
+                                   ngram_range=tuple(config['ngram_range']), min_df=config['min_df'],
+                                   max_df=config['max_df'])),
+        ('clf', MultinomialNB(alpha=config['alpha']))
+    ])
+
+
+def evaluate_fold((config_idx, fold_idx)):
+    config = _shared['configs'][config_idx]
+    train_indices, test_indices = _shared['folds'][fold_idx]
+    tokens = _shared['tokens']
+    labels = _shared['labels']
+    classifier = build_pipeline(config)
+
+    start = time.time()
+    try:
+        classifier.fit([tokens[i] for i in train_indices], labels[train_indices])
+    except ValueError as ex:
+        # e.g. min_df/max_df prune every term of this fold
+        return config_idx, fold_idx, {'error': str(ex)}
+    fit_time = time.time() - start
+
+    start = time.time()
+    y_predict = classifier.predict([tokens[i] for i in test_indices])
+    predict_time = time.time() - start
+
+    y_test = labels[test_indices]
+    return config_idx, fold_idx, {
+        'f1': f1_score(y_test, y_predict, average='weighted'),
+        'accuracy': accuracy_score(y_test, y_predict),
+        'fit_time': fit_time,
+        'predict_time_per_doc': predict_time / len(test_indices),
+        'vocabulary_size': len(classifier.named_steps['vector'].vocabulary_)
+    }
+
+
+class ModelSelectionRunner(object):
+    """Evaluate a grid of vectorizer and classifier settings by k-fold cross validation.
+
+    The corpus is tokenized once (and cached in `token_cache_file` if given), then every
+    (configuration, fold) pair is fitted and scored in a process pool.
+    """
+
+    def __init__(self, tokenizer, num_folds=10, processes=None, token_cache_file=None, random_state=0):
+        self.logger = get_logger(self.__class__.__name__)
+        self.tokenizer = tokenizer
+        self.num_folds = num_folds
+        self.processes = processes or cpu_count()
+        self.token_cache_file = token_cache_file
+        self.random_state = random_state
+
+    def tokenize(self, contents):
+        key = hashlib.sha1()
+        for content in contents:
+            key.update(content.encode('utf-8') if isinstance(content, unicode) else content)
+        key = key.hexdigest()
+
+        if self.token_cache_file and os.path.exists(self.token_cache_file):
+            with open(self.token_cache_file, 'rb') as f:
+                cache = dill.load(f)
+            if cache['key'] == key:
+                self.logger.info('Load tokens from cache %s' % self.token_cache_file)
+                return cache['tokens']
+
+        self.logger.info('Start tokenize %s documents...' % len(contents))
+        tokens = [self.tokenizer(c) for c in contents]
+        self.logger.info('End tokenize %s documents...' % len(contents))
+        if self.token_cache_file:
+            with open(self.token_cache_file, 'wb') as f:
+                dill.dump({'key': key, 'tokens': tokens}, f)
+        return tokens
+
+    def run(self, contents, labels, param_grid=None):
+        """Return one report per configuration, best f1 first (faster predict breaks ties)"""
+        configs = list(ParameterGrid(param_grid or default_param_grid))
+        labels = np.asarray(labels)
+        _shared['tokens'] = self.tokenize(contents)
+        _shared['labels'] = labels
+        _shared['configs'] = configs
+        _shared['folds'] = list(KFold(n=len(labels), n_folds=self.num_folds, shuffle=True,
+                                      random_state=self.random_state))
+
+        tasks = [(c, f) for c in range(len(configs)) for f in range(self.num_folds)]
+        self.logger.info('Start evaluate %s configurations x %s folds...' % (len(configs), self.num_folds))
+        pool = Pool(self.processes)
+        try:
+            fold_results = pool.map(evaluate_fold, tasks)
+        finally:
+            pool.close()
+            pool.terminate()
+            _shared.clear()
+        self.logger.info('End evaluate %s configurations x %s folds...' % (len(configs), self.num_folds))
+
+        scores = [[] for _ in configs]
+        errors = [None] * len(configs)
+        for config_idx, fold_idx, score in fold_results:
+            if 'error' in score:
+                errors[config_idx] = score['error']
+            else:
+                scores[config_idx].append(score)
+
+        result = []
+        for config, config_scores, error in zip(configs, scores, errors):
+            report = {'config': config}
+            if error or not config_scores:
+                report['error'] = error
+                result.append(report)
+                continue
+            for name in ['f1', 'accuracy', 'fit_time', 'predict_time_per_doc', 'vocabulary_size']:
+                values = [s[name] for s in config_scores]
+                report[name] = float(np.mean(values))
+            report['f1_std'] = float(np.std([s['f1'] for s in config_scores]))
+            result.append(report)
+
+        result.sort(key=lambda r: (-r.get('f1', -1), r.get('predict_time_per_doc', 0)))
+        return result
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+from util.utils import get_logger
+
+
+class CurrentModelWatcher(object):
+    """Keep the current model name in process, updated by Redis pub/sub.
+
+    `get` never touches Redis. A daemon thread listens on `channel` for model changes and
+    reconciles with the value stored at `key` every `reconcile_interval` seconds, so a missed
+    message (or a Redis outage) only delays the switch instead of failing requests.
+    """
+    channel = 'page_type_classifier_model_changed'
+
+    def __init__(self, kv_storage, key, default_model_name, reconcile_interval=30, retry_interval=5, channel=None):
+        self.logger = get_logger(self.__class__.__name__)
+        self.kv_storage = kv_storage
+        self.key = key
+        self.channel = channel or self.channel
+        self.model_name = default_model_name
+        self.reconcile_interval = reconcile_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def get(self):
+        self._ensure_started()
+        return self.model_name
+
+    def refresh(self):
+        """Read the current model name from Redis now, without starting the listener thread"""
+        try:
+            self._reconcile()
+        except Exception as ex:
+            self.logger.error('Read current model error: %s' % ex)
+        return self.model_name
+
+    def set(self, model_name):
+        """Store the new model name, notify the other workers and apply it locally"""
+        self.model_name = model_name
+        try:
+            self.kv_storage.set(self.key, model_name)
+            self.kv_storage.publish(self.channel, model_name)
+        except Exception as ex:
+            self.logger.error('Publish current model %s error: %s' % (model_name, ex))
+
+    def _ensure_started(self):
+        # the listener thread does not survive fork, so start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='watcher-%s' % self.key)
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _reconcile(self):
+        cur_model = self.kv_storage.get(self.key)
+        if cur_model and cur_model != self.model_name:
+            self.logger.info('Reconcile current model: %s -> %s' % (self.model_name, cur_model))
+            self.model_name = cur_model
+
+    def _run(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.kv_storage.pubsub()
+                pubsub.subscribe(self.channel)
+                self._reconcile()
+                next_reconcile = time.time() + self.reconcile_interval
+                while True:
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message['type'] == 'message' and message['data']:
+                        self.logger.info('Current model changed: %s -> %s' % (self.model_name, message['data']))
+                        self.model_name = message['data']
+                    if time.time() >= next_reconcile:
+                        self._reconcile()
+                        next_reconcile = time.time() + self.reconcile_interval
+            except Exception as ex:
+                self.logger.error('Current model watcher error: %s, retry after %s seconds'
+                                  % (ex, self.retry_interval))
+                time.sleep(self.retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
@@ -1,3 +1,4 @@
+import copy
 import random
 
 import dill
@@ -7,11 +8,39 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
 
+from nlp.feature_selection import select_features, strip_stop_words
+from nlp.feature_store import FeatureStore
 from util.utils import get_logger
 
 
+def vectorize(contents, tokenizer, min_ngram, max_ngram, min_df=0.1, max_df=0.9):
+    vectorizer = TfidfVectorizer(tokenizer=tokenizer, ngram_range=(min_ngram, max_ngram), min_df=min_df, max_df=max_df)
+    x = vectorizer.fit_transform(contents)
+    strip_stop_words(vectorizer)
+    return vectorizer, x
+
+
+def fit_from_features(vectorizer, x, labels, alpha=1.0, feature_selection=None, num_features=None):
+    """Fit Naive Bayes on vectorized documents, optionally keeping only the `num_features` best terms"""
+    if feature_selection and num_features:
+        x = select_features(vectorizer, x, labels, feature_selection, num_features)
+
+    clf = MultinomialNB(alpha=alpha)
+    clf.fit(x, labels)
+    return Pipeline([('vector', vectorizer), ('clf', clf)])
+
+
+def fit_classifier(contents, labels, tokenizer, min_ngram, max_ngram, min_df=0.1, max_df=0.9, alpha=1.0,
+                   feature_selection=None, num_features=None):
+    """Fit the vectorizer and Naive Bayes pipeline"""
+    vectorizer, x = vectorize(contents, tokenizer, min_ngram, max_ngram, min_df=min_df, max_df=max_df)
+    return fit_from_features(vectorizer, x, labels, alpha=alpha, feature_selection=feature_selection,
+                             num_features=num_features)
+
+
 class WebPageTypeModeler(object):
-    def __init__(self, urls, content_getter, model_file_path, tokenizer, min_ngram, max_ngram):
+    def __init__(self, urls, content_getter, model_file_path, tokenizer, min_ngram, max_ngram, min_df=0.1, max_df=0.9,
+                 alpha=1.0, feature_selection=None, num_features=None, feature_store=None, tokenizer_name='general'):
         self.logger = get_logger(self.__class__.__name__)
         self.urls = urls
         self.content_getter = content_getter
@@ -19,6 +48,13 @@ class WebPageTypeModeler(object):
         self.tokenizer = tokenizer
         self.min_ngram = min_ngram
         self.max_ngram = max_ngram
+        self.min_df = min_df
+        self.max_df = max_df
+        self.alpha = alpha
+        self.feature_selection = feature_selection
+        self.num_features = num_features
+        self.feature_store = feature_store
+        self.tokenizer_name = tokenizer_name
 
     def _convert_to_df(self, data):
         result = []
@@ -40,7 +76,56 @@ class WebPageTypeModeler(object):
         self.logger.info('Data info:\n %s' % df['type'].value_counts())
         return df
 
+    def get_labels(self):
+        """Return the current {url: type} of the training urls, None without a crawler page storage.
+
+        Content getters without a crawler, like the SnapshotContentGetter, have no page storage.
+        """
+        storage = getattr(getattr(self.content_getter, 'crawler', None), 'storage', None)
+        if storage is None:
+            return None
+        return {page['_id']: page.get('type') for page in storage.find({'_id': {'$in': self.urls}}, ['type'])}
+
+    def get_features(self):
+        """Load the vectorized training data from the feature store, building it on the first call"""
+        params = {
+            'ngram_range': [self.min_ngram, self.max_ngram],
+            'min_df': self.min_df,
+            'max_df': self.max_df
+        }
+        key = FeatureStore.build_key(self.content_getter.extractor.name, self.tokenizer_name, params, self.urls,
+                                     self.get_labels())
+        if self.feature_store.exists(key):
+            return self.feature_store.load(key)
+
+        data_frame = self._convert_to_df(self.content_getter.process(self.urls))
+        if data_frame.empty:
+            return None
+        vectorizer, x = vectorize(data_frame['content'].values, self.tokenizer, self.min_ngram, self.max_ngram,
+                                  min_df=self.min_df, max_df=self.max_df)
+        self.feature_store.save(key, x, vectorizer, data_frame['url'].values, data_frame['type'].values, params)
+        return self.feature_store.load(key)
+
+    def _train_from_store(self):
+        features = self.get_features()
+        if features is None:
+            return False, 'Empty training data set, remember to label your data firstly.'
+
+        self.logger.info('Start train from feature store and create model file...')
+        labels = np.asarray(features.labels)
+        # feature selection prunes the vectorizer, keep the stored one intact
+        classifier = fit_from_features(copy.deepcopy(features.vectorizer), features.matrix, labels, alpha=self.alpha,
+                                       feature_selection=self.feature_selection, num_features=self.num_features)
+        with open(self.model_file_path, 'wb') as f:
+            dill.dump(classifier, f)
+
+        self.logger.info('End train from feature store and create model file...')
+        return True, pd.Series(labels).value_counts().to_dict()
+
     def train(self):
+        if self.feature_store:
+            return self._train_from_store()
+
         random.shuffle(self.urls)
         pages = self.content_getter.process(self.urls)
         data_frame = self._convert_to_df(pages)
@@ -48,14 +133,11 @@ class WebPageTypeModeler(object):
             return False, 'Empty training data set, remember to label your data firstly.'
         data_frame = data_frame.reindex(np.random.permutation(data_frame.index))
 
-        classifier = Pipeline([
-            ('vector', TfidfVectorizer(tokenizer=self.tokenizer, ngram_range=(self.min_ngram, self.max_ngram),
-                                       min_df=0.1, max_df=0.9)),
-            ('clf', MultinomialNB())
-        ])
-
         self.logger.info('Start train and create model file...')
-        classifier.fit(data_frame['content'].values, data_frame['type'].values)
+        classifier = fit_classifier(data_frame['content'].values, data_frame['type'].values, self.tokenizer,
+                                    self.min_ngram, self.max_ngram, min_df=self.min_df, max_df=self.max_df,
+                                    alpha=self.alpha, feature_selection=self.feature_selection,
+                                    num_features=self.num_features)
         with open(self.model_file_path, 'wb') as f:
             dill.dump(classifier, f)
 
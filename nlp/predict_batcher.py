@@ -0,0 +1,216 @@
+import os
+import sys
+import threading
+import time
+from Queue import Queue, Empty
+from contextlib import contextmanager
+
+from nlp.scoring_engine import timed_predict_proba
+from util import metrics
+from util.timing import StageTimer
+from util.utils import get_logger
+
+
+class _BatchItem(object):
+    __slots__ = ('classifier', 'docs', 'result', 'error', 'done')
+
+    def __init__(self, classifier, docs):
+        self.classifier = classifier
+        self.docs = docs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class PredictBatcher(object):
+    """Merge `predict_proba` calls of concurrent requests into one vectorize and predict call.
+
+    A caller blocks until its documents were scored. The flushing thread waits at most
+    `max_wait_ms` after the first queued call, or until `max_batch_size` documents are queued, and only
+    while other requests (see `session`) may still add documents. A worker that serves one request at a
+    time never waits. A caller not answered after `result_timeout` seconds predicts by itself.
+    """
+
+    def __init__(self, max_batch_size=64, max_wait_ms=5, result_timeout=30):
+        self.logger = get_logger(self.__class__.__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.result_timeout = result_timeout
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sessions = 0
+        # batch size instrumentation, buckets are upper bounds of batch sizes
+        self.size_buckets = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+        self._size_counts = [0] * (len(self.size_buckets) + 1)
+        self._batch_count = 0
+        self._doc_count = 0
+        self._max_size = 0
+
+    def predict_proba(self, classifier, docs):
+        docs = list(docs)
+        if not docs:
+            return []
+        if self.max_batch_size <= 1:
+            self._record(len(docs))
+            return classifier.predict_proba(docs)
+
+        self._ensure_started()
+        item = _BatchItem(classifier, docs)
+        self._queue.put(item)
+        if not item.done.wait(self.result_timeout):
+            self.logger.error('No batch result after %s seconds, predict %s docs directly' %
+                              (self.result_timeout, len(docs)))
+            return classifier.predict_proba(docs)
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    @contextmanager
+    def session(self):
+        """Mark a request that may call `predict_proba`, batches only wait for the documents of other sessions"""
+        with self._lock:
+            self._sessions += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sessions -= 1
+
+    def get_stats(self):
+        buckets = {}
+        for bound, count in zip(self.size_buckets, self._size_counts):
+            buckets['<=%s' % bound] = count
+        buckets['>%s' % self.size_buckets[-1]] = self._size_counts[-1]
+        return {
+            'batch_count': self._batch_count,
+            'doc_count': self._doc_count,
+            'mean_batch_size': round(float(self._doc_count) / self._batch_count, 2) if self._batch_count else 0,
+            'max_batch_size': self._max_size,
+            'batch_size_buckets': buckets
+        }
+
+    def _record(self, size):
+        metrics.predict_batch_size.observe(size)
+        with self._lock:
+            self._batch_count += 1
+            self._doc_count += size
+            self._max_size = max(self._max_size, size)
+            for idx, bound in enumerate(self.size_buckets):
+                if size <= bound:
+                    self._size_counts[idx] += 1
+                    break
+            else:
+                self._size_counts[-1] += 1
+
+    def _ensure_started(self):
+        # the flushing thread does not survive fork, so start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='predict-batcher')
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            items = [item]
+            size = len(item.docs)
+            deadline = time.time() + self.max_wait
+            # each session has at most one call queued, wait only if another session may still queue one
+            while size < self.max_batch_size and self._sessions > len(items):
+                remain = deadline - time.time()
+                if remain <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remain)
+                except Empty:
+                    break
+                items.append(item)
+                size += len(item.docs)
+
+            self._flush(items)
+
+    def _flush(self, items):
+        try:
+            self._flush_groups(items)
+        except Exception as ex:
+            self.logger.error('Flush batch error: %s' % ex)
+            for item in items:
+                if item.result is None and item.error is None:
+                    item.error = ex
+        finally:
+            # a caller must never wait for a batch that failed
+            for item in items:
+                item.done.set()
+
+    def _flush_groups(self, items):
+        # the model may be reloaded between calls, so only merge calls of the same classifier
+        groups = []
+        for item in items:
+            for classifier, group in groups:
+                if classifier is item.classifier:
+                    group.append(item)
+                    break
+            else:
+                groups.append((item.classifier, [item]))
+
+        for classifier, group in groups:
+            docs = [d for item in group for d in item.docs]
+            self.logger.debug('Predict batch of %s docs from %s calls' % (len(docs), len(group)))
+            try:
+                probs = timed_predict_proba(classifier, docs, StageTimer(prefix='batch.'))
+                offset = 0
+                for item in group:
+                    item.result = probs[offset:offset + len(item.docs)]
+                    offset += len(item.docs)
+            except Exception as ex:
+                for item in group:
+                    item.error = ex
+            for item in group:
+                item.done.set()
+            self._record(len(docs))
+
+
+def iter_ready_groups(items, max_size):
+    """Yield lists of the items of an iterator that are ready, at most `max_size` per list.
+
+    The iterator is read by a thread, so a list is yielded as soon as one item is ready and holds the items
+    that became ready meanwhile, e.g. to predict streamed pages together without delaying the first one.
+    """
+    # unbounded, the reader finishes the iterator even if the consumer stops early
+    queue = Queue()
+    end = object()
+
+    def read():
+        try:
+            for item in items:
+                queue.put((item, None))
+            queue.put((end, None))
+        except Exception:
+            queue.put((end, sys.exc_info()))
+
+    thread = threading.Thread(target=read, name='ready-groups')
+    thread.daemon = True
+    thread.start()
+    while True:
+        group = []
+        item, error = queue.get()
+        while item is not end:
+            group.append(item)
+            if len(group) >= max_size:
+                break
+            try:
+                item, error = queue.get_nowait()
+            except Empty:
+                break
+        if group:
+            yield group
+        if item is end:
+            if error:
+                raise error[0], error[1], error[2]
+            return
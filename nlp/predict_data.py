@@ -1,59 +1,290 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import dill
 from os import path
 
+from nlp.model_watcher import CurrentModelWatcher
+from nlp.predict_batcher import iter_ready_groups
+from nlp.scoring_engine import NaiveBayesScoringEngine, timed_predict_proba
+from util import metrics
 from util.database import get_redis_conn
+from util.timing import StageTimer
 from util.utils import get_logger
 
 
+class ModelHandle(object):
+    """A loaded model, it is never modified after creation so requests can share it"""
+    __slots__ = ('name', 'classifier', 'labels', 'scoring_engine')
+
+    def __init__(self, name, classifier, scoring_engine=None):
+        self.name = name
+        self.classifier = classifier
+        self.labels = classifier.named_steps['clf'].classes_
+        self.scoring_engine = scoring_engine
+
+    @property
+    def scorer(self):
+        return self.scoring_engine or self.classifier
+
+
 class PredictWebPageType(object):
-    def __init__(self, model_loc_dir, model_name, content_getter, evaluate_mode=False):
+    """Classify urls with the current model.
+
+    A new model replaces the whole handle in one assignment and the content getter can be given
+    per call, so concurrent requests never see a half loaded model or another request's extractor.
+    """
+    # streamed pages extracted meanwhile are predicted together, up to this many
+    stream_group_size = 16
+
+    def __init__(self, model_loc_dir, model_name, content_getter, evaluate_mode=False, prediction_cache=None,
+                 predict_batcher=None, url_classifier=None, use_scoring_engine=False):
         self.logger = get_logger(self.__class__.__name__)
         self.content_getter = content_getter
-        self.web_page_type_classifier = None
-        self.labels = None
-        self.model_name = model_name
+        self.prediction_cache = prediction_cache if not evaluate_mode else None
+        self.predict_batcher = predict_batcher if not evaluate_mode else None
+        self.url_classifier = url_classifier if not evaluate_mode else None
+        self.use_scoring_engine = use_scoring_engine
+        self.model = None
+        self.default_model_name = model_name
         self.model_name_key = 'current_page_type_classifier_model'
         self.model_loc_dir = model_loc_dir
         self.kv_storage = get_redis_conn()
         self.evaluate_mode = evaluate_mode
-        # self.kv_storage.set(self.model_name_key, self.model_name)
+        self.model_watcher = CurrentModelWatcher(self.kv_storage, self.model_name_key, model_name)
+        self._load_lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        model = self.model
+        return model.name if model else self.default_model_name
+
+    @property
+    def web_page_type_classifier(self):
+        model = self.model
+        return model.classifier if model else None
+
+    @property
+    def labels(self):
+        model = self.model
+        return model.labels if model else None
 
     def get_current_model(self):
-        cur_model = self.kv_storage.get(self.model_name_key)
-        # if not cur_model:
-        #     self.kv_storage.set(self.model_name_key, self.model_name)
-        return cur_model if cur_model else self.model_name
+        return self.model_watcher.get()
 
-    def load_model(self):
-        self.logger.info('Start load model %s...' % self.model_name)
-        with open(path.join(self.model_loc_dir, self.model_name), 'rb') as f:
-            self.web_page_type_classifier = dill.load(f)
-            # self.kv_storage.set(self.model_name_key, self.model_name)
+    def set_current_model(self, model_name):
+        self.model_watcher.set(model_name)
 
-        self.labels = self.web_page_type_classifier.named_steps['clf'].classes_
-        self.logger.info('End load model %s...' % self.model_name)
+    def load_model(self, model_name=None):
+        """Load a model file and swap it in, return its handle"""
+        model_name = model_name or self.model_name
+        self.logger.info('Start load model %s...' % model_name)
+        start = time.time()
+        with open(path.join(self.model_loc_dir, model_name), 'rb') as f:
+            classifier = dill.load(f)
 
-    def predict(self, urls):
-        self.logger.info('Start predict url %s...' % urls)
-        current_model = self.get_current_model() if not self.evaluate_mode else self.model_name
-        if not self.web_page_type_classifier or self.model_name != current_model:
-            self.model_name = current_model
-            self.load_model()
+        scoring_engine = None
+        if self.use_scoring_engine:
+            try:
+                scoring_engine = NaiveBayesScoringEngine.from_pipeline(classifier)
+            except (ValueError, AttributeError, KeyError) as ex:
+                self.logger.info('Model %s is not supported by scoring engine, use pipeline: %s' % (model_name, ex))
+        previous_model_name = self.model.name if self.model else None
+        self.model = ModelHandle(model_name, classifier, scoring_engine)
+        metrics.model_load_duration.labels(model=model_name).observe(time.time() - start)
+        if not self.evaluate_mode:
+            metrics.set_current_model(model_name, previous_model_name)
+        self.logger.info('End load model %s...' % model_name)
+        return self.model
+
+    def preload_model(self):
+        """Load the current model without starting any thread, e.g. in a process that forks workers later"""
+        model_name = self.model_watcher.refresh() if not self.evaluate_mode else self.default_model_name
+        return self.load_model(model_name)
+
+    def share_model(self, other):
+        """Use the model already loaded by `other` instead of loading the file again"""
+        self.model = other.get_model()
+        self.default_model_name = self.model.name
+
+    def get_model(self):
+        """Return the handle of the current model, load it first if the current model has changed"""
+        model_name = self.get_current_model() if not self.evaluate_mode else self.default_model_name
+        model = self.model
+        if model and model.name == model_name:
+            return model
+        # concurrent requests wait for a single load instead of each loading the file
+        with self._load_lock:
+            model = self.model
+            if model and model.name == model_name:
+                return model
+            return self.load_model(model_name)
+
+    def _predict_proba(self, model, docs, timer):
+        if self.predict_batcher:
+            # the batcher times tokenize and predict_proba of merged batches as `batch.*`
+            with timer.stage('predict'):
+                return self.predict_batcher.predict_proba(model.scorer, docs)
+        return timed_predict_proba(model.scorer, docs, timer) if docs else []
+
+    @contextmanager
+    def _predict_session(self):
+        if not self.predict_batcher:
+            yield
+            return
+        with self.predict_batcher.session():
+            yield
+
+    def _predict_by_url(self, urls, url_threshold):
+        """Return the pages the url classifier is confident about and the urls left for crawling"""
+        if not self.url_classifier or not self.url_classifier.is_available():
+            return [], urls
 
         result = []
-        # crawl web pages content
-        web_pages = [(url, page['content'], page['error'], page.get('message', ''))
-                     for url, page in self.content_getter.process(urls).items()]
-        types = self.web_page_type_classifier.predict_proba(c[1] for c in web_pages)
-        for (url, content, error, message), p_type in zip(web_pages, types):
-            max_prob = max(p_type)
+        remain_urls = []
+        for url, (page_type, confident) in zip(urls, self.url_classifier.predict(urls)):
+            if confident < url_threshold:
+                remain_urls.append(url)
+                continue
             result.append({
                 'url': url,
-                'content': content if not error else '',
-                'error': error,
-                'message': message,
-                'type': self.labels[list(p_type).index(max_prob)] if content and not error else '',
-                'confident': round(max_prob, 2) if content and not error else 0
+                'content': '',
+                'error': False,
+                'message': '',
+                'type': page_type,
+                # compared unrounded above, 0.895 must not pass a 0.9 threshold
+                'confident': round(confident, 2),
+                'cached': False,
+                'predicted_by': 'url'
             })
+        self.logger.info('Url classifier answered %s/%s urls' % (len(result), len(urls)))
+        return result, remain_urls
+
+    def _predict_without_crawl(self, urls, extractor_name, model_name, use_cache, refresh_cache, url_threshold,
+                               timer):
+        """Return pages answered by the prediction cache or the url classifier, and the urls left for crawling"""
+        result = []
+        if use_cache and not refresh_cache:
+            with timer.stage('cache'):
+                cached_pages = self.prediction_cache.get_many(urls, extractor_name, model_name)
+            for url in urls:
+                if url in cached_pages:
+                    page = dict(cached_pages[url])
+                    # entries are keyed by the normalized url, answer with the url that was asked for
+                    page['url'] = url
+                    page['cached'] = True
+                    result.append(page)
+            urls = [u for u in urls if u not in cached_pages]
+
+        if urls and url_threshold is not None:
+            with timer.stage('url_model'):
+                url_predicted, urls = self._predict_by_url(urls, url_threshold)
+            result.extend(url_predicted)
+        return result, urls
+
+    @staticmethod
+    def _record(pages):
+        for page in pages:
+            predicted_by = 'cache' if page.get('cached') else page.get('predicted_by', 'content')
+            if predicted_by == 'content' and not page['error']:
+                metrics.urls_total.labels(stage='classify').inc()
+            metrics.predictions_total.labels(predicted_by=predicted_by).inc()
+
+    @staticmethod
+    def _build_page(model, url, page, p_type):
+        content, error = page['content'], page['error']
+        max_prob = max(p_type)
+        return {
+            'url': url,
+            'content': content if not error else '',
+            'error': error,
+            'message': page.get('message', ''),
+            'type': model.labels[list(p_type).index(max_prob)] if content and not error else '',
+            'confident': round(max_prob, 2) if content and not error else 0,
+            'cached': False,
+            'predicted_by': 'content'
+        }
+
+    def predict(self, urls, content_getter=None, use_cache=True, refresh_cache=False, url_threshold=None,
+                timer=None):
+        """Classify urls, if `url_threshold` is set, urls the url classifier is confident about are not crawled.
+
+        The time of each stage is added to `timer`.
+        """
+        self.logger.info('Start predict url %s...' % urls)
+        timer = timer or StageTimer()
+        content_getter = content_getter or self.content_getter
+        with timer.stage('model'):
+            model = self.get_model()
+        use_cache = use_cache and self.prediction_cache is not None
+        extractor_name = content_getter.extractor.name
+        result, urls = self._predict_without_crawl(urls, extractor_name, model.name, use_cache, refresh_cache,
+                                                   url_threshold, timer)
+        if not urls:
+            self._record(result)
+            self.logger.info('End predict, all urls were answered without crawling...')
+            return result
+
+        # crawl web pages content
+        with self._predict_session():
+            web_pages = content_getter.process(urls, timer).items()
+            types = self._predict_proba(model, [page['content'] for _, page in web_pages], timer)
+        predicted = [self._build_page(model, url, page, p_type) for (url, page), p_type in zip(web_pages, types)]
+
+        if use_cache:
+            # failed pages may succeed on the next call, so do not cache them
+            with timer.stage('cache'):
+                self.prediction_cache.set_many([p for p in predicted if not p['error']], extractor_name, model.name)
+        result.extend(predicted)
+        self._record(result)
         self.logger.info('End predict url %s...' % urls)
         return result
+
+    def predict_iter(self, urls, content_getter=None, use_cache=True, refresh_cache=False, url_threshold=None,
+                     timer=None, with_timings=False):
+        """Same as `predict` but yield each page as soon as it was classified.
+
+        If `with_timings` is set, each page has the milliseconds spent on its url in `timings`.
+        """
+        # resolve the model now, a model loaded while streaming does not change this response
+        timer = timer or StageTimer()
+        content_getter = content_getter or self.content_getter
+        with timer.stage('model'):
+            model = self.get_model()
+        return self._predict_iter(urls, content_getter, model, use_cache, refresh_cache, url_threshold, timer,
+                                  with_timings)
+
+    def _predict_iter(self, urls, content_getter, model, use_cache, refresh_cache, url_threshold, timer,
+                      with_timings):
+        self.logger.info('Start predict iter url %s...' % urls)
+        use_cache = use_cache and self.prediction_cache is not None
+        extractor_name = content_getter.extractor.name
+        result, urls = self._predict_without_crawl(urls, extractor_name, model.name, use_cache, refresh_cache,
+                                                   url_threshold, timer)
+        self._record(result)
+        for page in result:
+            if with_timings:
+                page = dict(page, timings={})
+            yield page
+
+        if not urls:
+            return
+        with self._predict_session():
+            for web_pages in iter_ready_groups(content_getter.process_iter(urls, timer), self.stream_group_size):
+                start = time.time()
+                types = self._predict_proba(model, [page['content'] for _, page in web_pages], timer)
+                predict_time = time.time() - start
+                predicted = [self._build_page(model, url, page, p_type)
+                             for (url, page), p_type in zip(web_pages, types)]
+                self._record(predicted)
+                if use_cache:
+                    self.prediction_cache.set_many([p for p in predicted if not p['error']], extractor_name,
+                                                   model.name)
+                for page in predicted:
+                    timer.add_url(page['url'], 'predict', predict_time)
+                    if with_timings:
+                        # a copy, the page may be the one just cached
+                        page = dict(page, timings=timer.get_url(page['url']))
+                    yield page
+        self.logger.info('End predict iter url %s...' % urls)
@@ -0,0 +1,65 @@
+import hashlib
+
+from util import metrics
+from util.cache import LRUCache, RedisCache
+from util.utils import get_logger, normalize_url
+
+
+class PredictionCache(object):
+    """Two tier (in-process LRU then Redis) cache of predicted pages.
+
+    Entries are keyed by normalized url, extractor and model name, so loading another model
+    implicitly stops serving the predictions of the old one.
+    """
+    # per request fields (cached, timings) are not stored
+    cached_fields = ('url', 'content', 'error', 'message', 'type', 'confident', 'predicted_by')
+
+    def __init__(self, kv_storage, ttl=3600, local_max_size=10000, prefix='page_type_prediction'):
+        self.logger = get_logger(self.__class__.__name__)
+        self.ttl = ttl
+        self.local = LRUCache(max_size=local_max_size, ttl=ttl)
+        self.shared = RedisCache(kv_storage, prefix, ttl=ttl) if kv_storage is not None else None
+
+    @staticmethod
+    def build_key(url, extractor_name, model_name):
+        url_hash = hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+        return '%s:%s:%s' % (model_name, extractor_name, url_hash)
+
+    def get_many(self, urls, extractor_name, model_name):
+        """Return cached pages by url"""
+        result = {}
+        missed = {}
+        local_hits = 0
+        for url in urls:
+            key = self.build_key(url, extractor_name, model_name)
+            page = self.local.get(key)
+            if page is not None:
+                result[url] = page
+                local_hits += 1
+            else:
+                # urls normalized to the same key (http://a.com and http://a.com/) share the entry
+                missed.setdefault(key, []).append(url)
+
+        if missed and self.shared:
+            for key, page in self.shared.get_many(list(missed.keys())).items():
+                self.local.set(key, page)
+                for url in missed[key]:
+                    result[url] = page
+
+        metrics.prediction_cache_total.labels(result='local_hit').inc(local_hits)
+        metrics.prediction_cache_total.labels(result='redis_hit').inc(len(result) - local_hits)
+        metrics.prediction_cache_total.labels(result='miss').inc(len(urls) - len(result))
+        self.logger.debug('Prediction cache hit %s/%s urls' % (len(result), len(urls)))
+        return result
+
+    def set_many(self, pages, extractor_name, model_name):
+        items = {}
+        for page in pages:
+            key = self.build_key(page['url'], extractor_name, model_name)
+            # a copy, the caller keeps changing its page after it was cached
+            page = {f: page[f] for f in self.cached_fields if f in page}
+            self.local.set(key, page)
+            items[key] = page
+
+        if self.shared:
+            self.shared.set_many(items)
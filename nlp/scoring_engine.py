@@ -0,0 +1,171 @@
+import numpy as np
+
+from util.utils import get_logger
+
+
+def get_unsupported_settings(vectorizer):
+    """Return the settings of the vectorizer the engine would not score the same as the pipeline.
+
+    The engine decodes, lowercases, tokenizes (custom tokenizer or token_pattern) and counts word ngrams,
+    then applies binary, sublinear_tf, idf and l1/l2 norm. Anything else is not reproduced.
+    """
+    result = []
+    if getattr(vectorizer, 'input', 'content') != 'content':
+        result.append('input=%r' % vectorizer.input)
+    if getattr(vectorizer, 'analyzer', None) != 'word':
+        result.append('analyzer=%r' % getattr(vectorizer, 'analyzer', None))
+    for name in ['preprocessor', 'strip_accents', 'stop_words']:
+        if getattr(vectorizer, name, None) is not None:
+            result.append('%s=%r' % (name, getattr(vectorizer, name)))
+    if getattr(vectorizer, 'norm', None) not in [None, 'l1', 'l2']:
+        result.append('norm=%r' % vectorizer.norm)
+    return result
+
+
+def export_model(pipeline):
+    """Export the arrays needed for scoring from a fitted TfidfVectorizer + MultinomialNB pipeline"""
+    vectorizer = pipeline.named_steps['vector']
+    clf = pipeline.named_steps['clf']
+    unsupported = get_unsupported_settings(vectorizer)
+    if unsupported:
+        raise ValueError('Vectorizer settings not supported by the scoring engine: %s' % ', '.join(unsupported))
+    if not hasattr(clf, 'feature_log_prob_'):
+        raise ValueError('Only Naive Bayes classifier is supported')
+
+    use_idf = getattr(vectorizer, 'use_idf', False)
+    return {
+        'vocabulary': dict(vectorizer.vocabulary_),
+        'idf': np.asarray(vectorizer.idf_, dtype=np.float64) if use_idf else None,
+        'ngram_range': tuple(vectorizer.ngram_range),
+        'encoding': vectorizer.encoding,
+        'decode_error': vectorizer.decode_error,
+        'lowercase': vectorizer.lowercase,
+        'binary': vectorizer.binary,
+        'sublinear_tf': getattr(vectorizer, 'sublinear_tf', False),
+        'norm': getattr(vectorizer, 'norm', None),
+        'tokenizer': vectorizer.build_tokenizer(),
+        'feature_log_prob': np.asarray(clf.feature_log_prob_, dtype=np.float64),
+        'class_log_prior': np.asarray(clf.class_log_prior_, dtype=np.float64),
+        'classes': clf.classes_
+    }
+
+
+class NaiveBayesScoringEngine(object):
+    """Score documents with an exported Naive Bayes model using plain NumPy.
+
+    Same result as the sklearn pipeline `predict_proba` (within float tolerance) without its
+    per call validation and sparse matrix construction overhead.
+    """
+
+    def __init__(self, model):
+        self.logger = get_logger(self.__class__.__name__)
+        self.vocabulary = model['vocabulary']
+        self.idf = model['idf']
+        self.min_n, self.max_n = model['ngram_range']
+        self.encoding = model['encoding']
+        self.decode_error = model['decode_error']
+        self.lowercase = model['lowercase']
+        self.binary = model['binary']
+        self.sublinear_tf = model['sublinear_tf']
+        self.norm = model['norm']
+        self.tokenizer = model['tokenizer']
+        # (n_features, n_classes) so the weights of one feature are contiguous
+        self.feature_weights = np.ascontiguousarray(model['feature_log_prob'].T)
+        self.class_log_prior = model['class_log_prior']
+        self.classes_ = model['classes']
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        return cls(export_model(pipeline))
+
+    def _ngrams(self, tokens):
+        # same order and join as sklearn word ngrams
+        if self.max_n == 1:
+            return tokens
+        min_n = self.min_n
+        result = []
+        if min_n == 1:
+            result = list(tokens)
+            min_n += 1
+        num_tokens = len(tokens)
+        for n in xrange(min_n, min(self.max_n + 1, num_tokens + 1)):
+            for i in xrange(num_tokens - n + 1):
+                result.append(' '.join(tokens[i: i + n]))
+        return result
+
+    def tokenize(self, text):
+        # same preprocessing as the sklearn word analyzer: decode, lowercase, tokenize
+        if isinstance(text, bytes):
+            text = text.decode(self.encoding, self.decode_error)
+        return self.tokenizer(text.lower() if self.lowercase else text)
+
+    def _features(self, token_lists):
+        """Return row ids, feature ids and term counts of the documents, rows are in order"""
+        rows, cols, counts = [], [], []
+        vocabulary = self.vocabulary
+        for row, tokens in enumerate(token_lists):
+            doc_counts = {}
+            for term in self._ngrams(tokens):
+                idx = vocabulary.get(term)
+                if idx is not None:
+                    doc_counts[idx] = doc_counts.get(idx, 0) + 1
+            rows.extend([row] * len(doc_counts))
+            cols.extend(doc_counts.keys())
+            counts.extend(doc_counts.values())
+        return (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp),
+                np.asarray(counts, dtype=np.float64))
+
+    def predict_proba_tokens(self, token_lists):
+        num_docs = len(token_lists)
+        rows, cols, values = self._features(token_lists)
+        if self.binary:
+            values[:] = 1
+        elif self.sublinear_tf:
+            values = np.log(values) + 1
+        if self.idf is not None:
+            values *= self.idf[cols]
+        if self.norm == 'l2':
+            norms = np.sqrt(np.bincount(rows, values * values, minlength=num_docs))
+        elif self.norm == 'l1':
+            norms = np.bincount(rows, np.abs(values), minlength=num_docs)
+        else:
+            norms = None
+        if norms is not None:
+            norms[norms == 0] = 1
+            values /= norms[rows]
+
+        # sparse row x weight product, summed per document
+        jll = np.tile(self.class_log_prior, (num_docs, 1))
+        if len(values):
+            weighted = self.feature_weights[cols] * values[:, np.newaxis]
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            jll[rows[starts]] += np.add.reduceat(weighted, starts, axis=0)
+
+        # normalize by log-sum-exp
+        max_jll = jll.max(axis=1)[:, np.newaxis]
+        log_prob_x = np.log(np.exp(jll - max_jll).sum(axis=1))[:, np.newaxis] + max_jll
+        return np.exp(jll - log_prob_x)
+
+    def predict_proba(self, texts):
+        return self.predict_proba_tokens([self.tokenize(t) for t in texts])
+
+    def predict(self, texts):
+        return self.classes_[self.predict_proba(texts).argmax(axis=1)]
+
+
+def timed_predict_proba(scorer, docs, timer):
+    """`scorer.predict_proba(docs)` with the tokenize/vectorize and predict_proba stages timed separately"""
+    if isinstance(scorer, NaiveBayesScoringEngine):
+        with timer.stage('tokenize'):
+            tokens = [scorer.tokenize(d) for d in docs]
+        with timer.stage('predict_proba'):
+            return scorer.predict_proba_tokens(tokens)
+
+    if [name for name, _ in getattr(scorer, 'steps', [])] != ['vector', 'clf']:
+        with timer.stage('predict_proba'):
+            return scorer.predict_proba(docs)
+    # the vectorizer tokenizes inside transform, so tokenizing is part of the vectorize stage here
+    with timer.stage('vectorize'):
+        x = scorer.named_steps['vector'].transform(docs)
+    with timer.stage('predict_proba'):
+        return scorer.named_steps['clf'].predict_proba(x)
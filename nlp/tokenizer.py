@@ -1,4 +1,6 @@
+import re
 import string
+import urlparse
 from abc import ABCMeta, abstractmethod
 from nltk import wordpunct_tokenize
 
@@ -27,3 +29,37 @@ class GeneralTokenizer(Tokenizer):
             if word:
                 result.append(word)
         return result
+
+
+class UrlTokenizer(Tokenizer):
+    """Split an url into host, path and query words, dates and numbers are replaced by place holders"""
+    date_pattern = re.compile(r'(19|20)\d{2}[/_-]?(0?[1-9]|1[0-2])([/_-]?(0?[1-9]|[12]\d|3[01]))?(?!\d)')
+    number_pattern = re.compile(r'^\d+$')
+    split_pattern = re.compile(r'[^\w]+|_', re.UNICODE)
+
+    def tokenize(self, url):
+        result = []
+        if type(url) is not unicode:
+            url = unicode(url, 'utf-8', errors='ignore')
+        parts = urlparse.urlsplit(url.strip().lower())
+        for word in parts.netloc.split('.'):
+            if word and word != 'www':
+                result.append('host:' + word)
+
+        segments = [s for s in parts.path.split('/') if s]
+        result.append('depth:%s' % len(segments))
+        # dates become their own segment, e.g. /2016/03/01/ or post-20160301.html
+        segments = [s for s in self.date_pattern.sub('/__date__/', '/'.join(segments)).split('/') if s]
+        for segment in segments:
+            if segment == '__date__':
+                result.append(segment)
+                continue
+            for word in self.split_pattern.split(segment):
+                if not word:
+                    continue
+                result.append('__num__' if self.number_pattern.match(word) else word)
+
+        for word in self.split_pattern.split(parts.query):
+            if word:
+                result.append('query:' + word)
+        return result
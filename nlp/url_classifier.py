@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from os import path
+
+import dill
+
+from nlp.model_watcher import CurrentModelWatcher
+from util.utils import get_logger
+
+
+class WebPageUrlTypeModeler(object):
+    """Train a small classifier on the labeled urls only (char and word ngrams of the url)"""
+
+    def __init__(self, storage, model_file_path, page_types=None, max_urls_per_type=None, test_ratio=0.1):
+        self.logger = get_logger(self.__class__.__name__)
+        self.storage = storage
+        self.model_file_path = model_file_path
+        self.page_types = page_types
+        self.max_urls_per_type = max_urls_per_type
+        self.test_ratio = test_ratio
+
+    def load_labeled_urls(self):
+        q_filter = {'type': {'$in': self.page_types} if self.page_types else {'$nin': ['', None]}}
+        type_urls = {}
+        for page in self.storage.find(q_filter, ['type']):
+            type_urls.setdefault(page['type'], []).append(page['_id'])
+
+        urls, labels = [], []
+        for page_type, type_url in type_urls.items():
+            if self.max_urls_per_type and len(type_url) > self.max_urls_per_type:
+                type_url = random.sample(type_url, self.max_urls_per_type)
+            self.logger.info('Training urls for type %s: %s' % (page_type, len(type_url)))
+            urls += type_url
+            labels += [page_type] * len(type_url)
+        return urls, labels
+
+    def train(self):
+        # training only imports, serving only needs dill to load the model
+        from sklearn.cross_validation import train_test_split
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.metrics import accuracy_score
+        from sklearn.pipeline import Pipeline, FeatureUnion
+        from nlp.tokenizer import UrlTokenizer
+
+        urls, labels = self.load_labeled_urls()
+        if len(set(labels)) < 2:
+            return False, 'Need labeled urls of at least 2 web page types.'
+
+        classifier = Pipeline([
+            ('vector', FeatureUnion([
+                ('char', TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 5), min_df=2, sublinear_tf=True)),
+                ('word', TfidfVectorizer(tokenizer=UrlTokenizer().tokenize, lowercase=False, ngram_range=(1, 2),
+                                         min_df=2))
+            ])),
+            ('clf', LogisticRegression(C=10.0))
+        ])
+
+        self.logger.info('Start train url model...')
+        x_train, x_test, y_train, y_test = train_test_split(urls, labels, test_size=self.test_ratio, random_state=0)
+        classifier.fit(x_train, y_train)
+        accuracy = accuracy_score(y_test, classifier.predict(x_test))
+        self.logger.info('Url model hold out accuracy: %s' % accuracy)
+
+        # refit on all labeled urls for the saved model
+        classifier.fit(urls, labels)
+        with open(self.model_file_path, 'wb') as f:
+            dill.dump(classifier, f)
+        self.logger.info('End train url model...')
+
+        data = {}
+        for label in labels:
+            data[label] = data.get(label, 0) + 1
+        return True, {'data': data, 'accuracy': round(accuracy, 4)}
+
+
+class UrlTypeClassifier(object):
+    """Predict web page type from the url alone, no crawling.
+
+    A new model is written to the same file, `publish_model` stores a new version in Redis and every process
+    with a `kv_storage` loads the file again before its next prediction.
+    """
+    version_key = 'current_url_type_classifier_model'
+    version_channel = 'url_type_classifier_model_changed'
+
+    def __init__(self, model_loc_dir, model_name, kv_storage=None):
+        self.logger = get_logger(self.__class__.__name__)
+        self.model_loc_dir = model_loc_dir
+        self.model_name = model_name
+        self.classifier = None
+        self.labels = None
+        # version of the loaded model file
+        self.version = None
+        self.version_watcher = None
+        if kv_storage is not None:
+            self.version_watcher = CurrentModelWatcher(kv_storage, self.version_key, None,
+                                                       channel=self.version_channel)
+        self._load_lock = threading.Lock()
+
+    def load_model(self, version=None):
+        if version is None and self.version_watcher:
+            # does not start the watcher thread, the master may load the model before forking
+            version = self.version_watcher.refresh()
+        self.version = version
+        model_file_path = path.join(self.model_loc_dir, self.model_name)
+        if not path.exists(model_file_path):
+            self.logger.info('Url model %s does not exist, url classifier is disabled' % self.model_name)
+            self.classifier = None
+            return False
+
+        self.logger.info('Start load url model %s...' % self.model_name)
+        with open(model_file_path, 'rb') as f:
+            classifier = dill.load(f)
+        self.labels = classifier.named_steps['clf'].classes_
+        self.classifier = classifier
+        self.logger.info('End load url model %s (version %s)...' % (self.model_name, version))
+        return True
+
+    def publish_model(self):
+        """Load the model file just written and tell the other processes to load it"""
+        version = '%s:%.3f' % (self.model_name, time.time())
+        if self.version_watcher:
+            self.version_watcher.set(version)
+        with self._load_lock:
+            return self.load_model(version)
+
+    def _ensure_current(self):
+        if not self.version_watcher:
+            return
+        version = self.version_watcher.get()
+        if not version or version == self.version:
+            return
+        # concurrent requests wait for a single load
+        with self._load_lock:
+            if version != self.version:
+                self.load_model(version)
+
+    def is_available(self):
+        self._ensure_current()
+        return self.classifier is not None
+
+    def predict(self, urls):
+        """Return (type, confident) for each url, the confident is not rounded"""
+        result = []
+        # read the attribute once, a new model may be loaded meanwhile
+        self._ensure_current()
+        classifier = self.classifier
+        if not urls or not classifier:
+            return result
+        labels = classifier.named_steps['clf'].classes_
+        for p_type in classifier.predict_proba(urls):
+            max_prob = max(p_type)
+            result.append((labels[list(p_type).index(max_prob)], max_prob))
+        return result
@@ -1,5 +1,14 @@
+import threading
+
+from parser.crawler import PageCrawler
+from parser.extractor import get_extractor, list_extractor
+from util import metrics
+from util.timing import StageTimer
 from util.utils import get_logger
 
+_content_getters = {}
+_content_getters_lock = threading.Lock()
+
 
 class ContentGetter(object):
 
@@ -8,10 +17,53 @@ class ContentGetter(object):
         self.extractor = extractor
         self.logger = get_logger(self.__class__.__name__)
 
-    def process(self, urls):
+    def process(self, urls, timer=None):
+        timer = timer or StageTimer()
         # crawl pages
-        result = self.crawler.process(urls)
+        with timer.stage('crawl'):
+            result = self.crawler.process(urls)
         # extract content from pages
-        result = self.extractor.process(result)
+        with timer.stage('extract'):
+            result = self.extractor.process(result)
+        for url, page in result.items():
+            self._record(timer, url, page)
         return result
 
+    def process_iter(self, urls, timer=None):
+        """Yield (url, page) as soon as each page was crawled and extracted"""
+        timer = timer or StageTimer()
+        if hasattr(self.crawler, 'process_iter'):
+            pages = self.crawler.process_iter(urls)
+        else:
+            pages = self.crawler.process(urls).iteritems()
+        for url, page in self.extractor.process_iter(pages, item_num=len(set(urls))):
+            self._record(timer, url, page)
+            yield url, page
+
+    @staticmethod
+    def _record(timer, url, page):
+        # crawler and extractor leave the time spent on each url in the page
+        timer.add_url(url, 'crawl', page.crawl_time)
+        timer.add_url(url, 'extract', page.extract_time)
+        page.crawl_time = page.extract_time = None
+        if not page['error']:
+            metrics.urls_total.labels(stage='extract').inc()
+
+
+def get_content_getter(extractor_name=None):
+    """Return the shared content getter of an extractor, None if the extractor is not supported.
+
+    Crawlers and extractors keep no per request state, so one content getter per extractor
+    is shared by all requests of the process.
+    """
+    extractor_name = extractor_name or list_extractor[0]
+    content_getter = _content_getters.get(extractor_name)
+    if content_getter:
+        return content_getter
+    with _content_getters_lock:
+        if extractor_name not in _content_getters:
+            extractor = get_extractor(extractor_name)
+            if not extractor:
+                return None
+            _content_getters[extractor_name] = ContentGetter(crawler=PageCrawler(), extractor=extractor)
+        return _content_getters[extractor_name]
@@ -1,12 +1,25 @@
+import time
 from multiprocessing import cpu_count
 from multiprocessing.dummy import Pool
 from datetime import datetime
 
 import requests
 
+from parser.page import PageRecord
+from util import metrics
 from util.utils import get_logger, get_unicode
 
 
+def get_crawl_error_type(ex):
+    if isinstance(ex, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(ex, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(ex, requests.exceptions.TooManyRedirects):
+        return 'redirects'
+    return 'other'
+
+
 class PageCrawler(object):
 
     def __init__(self):
@@ -30,35 +43,52 @@ class PageCrawler(object):
 
         return result
 
+    def process_iter(self, urls):
+        """Yield (url, page) as soon as each page was crawled"""
+        urls = list(set(urls))
+        if len(urls) > 2:
+            pool = Pool(cpu_count() * 2)
+            try:
+                for r in pool.imap_unordered(self._crawl_page, urls):
+                    for item in r.items():
+                        yield item
+            finally:
+                pool.terminate()
+        else:
+            for url in urls:
+                for item in self._crawl_page(url).items():
+                    yield item
+
     def _crawl_page(self, url):
         self.logger.debug('Start crawl %s...' % url)
-        result = {
-            url: {
-                'content': '',
-                'error': False,
-                'message': ''
-            }
-        }
+        start = time.time()
+        page = PageRecord(url)
         if url:
             try:
                 response = requests.get(url, verify=False, timeout=5)
                 # raise exception when something error
                 if response.status_code == requests.codes.ok:
-                    result[url]['content'] = response.content
+                    page.raw = response.content
+                    metrics.urls_total.labels(stage='crawl').inc()
                 else:
-                    result[url]['error'] = True
-                    result[url]['message'] = 'Page not found'
+                    page.error = True
+                    page.message = 'Page not found'
+                    metrics.crawl_errors_total.labels(error_type='http_%s' % response.status_code).inc()
 
             except Exception as ex:
                 self.logger.error('crawl_page error: %s' % ex.message)
-                result[url]['error'] = True
-                result[url]['message'] = str(ex.message)  # 'Page not found'
+                page.error = True
+                page.message = str(ex.message)  # 'Page not found'
+                metrics.crawl_errors_total.labels(error_type=get_crawl_error_type(ex)).inc()
         else:
-            result[url]['error'] = True
-            result[url]['message'] = 'url is empty'
+            page.error = True
+            page.message = 'url is empty'
+            metrics.crawl_errors_total.labels(error_type='empty_url').inc()
 
+        # moved by the content getter into the request timings
+        page.crawl_time = time.time() - start
         self.logger.debug('End crawl %s...' % url)
-        return result
+        return {url: page}
 
 
 class PageCrawlerWithStorage(object):
@@ -74,7 +104,7 @@ class PageCrawlerWithStorage(object):
         for page in self.storage.find({'_id': {'$in': urls}}):
             if page.get('crawled_date'):
                 self.logger.debug('Page was crawled: ' + page['_id'])
-                result[page['_id']] = page
+                result[page['_id']] = PageRecord.from_document(page)
 
         self.logger.info("Num of crawled urls: %s" % len(result))
         # filter crawled page
@@ -115,24 +145,28 @@ class PageCrawlerWithStorage(object):
             page = self.storage.find_one({'_id': url})
             if page and page.get('crawled_date'):
                 self.logger.debug('Page was crawled (2nd check): ' + page['_id'])
-                return {url: self.storage.find_one({'_id': url})}
+                return {url: PageRecord.from_document(page)}
 
             try:
                 response = requests.get(url, verify=False, timeout=5)
                 # raise exception when something error
                 if response.status_code == requests.codes.ok:
                     result['content'] = response.content
+                    metrics.urls_total.labels(stage='crawl').inc()
                 else:
                     result['error'] = True
                     result['message'] = 'Page not found'
+                    metrics.crawl_errors_total.labels(error_type='http_%s' % response.status_code).inc()
 
             except Exception as ex:
                 self.logger.error('crawl_page error: %s' % ex.message)
                 result['error'] = True
                 result['message'] = str(ex.message)  # 'Page not found'
+                metrics.crawl_errors_total.labels(error_type=get_crawl_error_type(ex)).inc()
         else:
             result['error'] = True
             result['message'] = 'url is empty'
+            metrics.crawl_errors_total.labels(error_type='empty_url').inc()
 
         # storage to database
         result['_id'] = url
@@ -141,4 +175,22 @@ class PageCrawlerWithStorage(object):
         self.logger.info('Update crawled page to db...')
         self.storage.update_one({'_id': url}, {'$set': result}, upsert=True)
         self.logger.debug('End crawl %s...' % url)
-        return {url: self.storage.find_one({'_id': url})}
+        # the label is the only field of the stored page not in `result`, do not read the html back
+        page = PageRecord.from_document(result)
+        page.type = (self.storage.find_one({'_id': url}, ['type']) or {}).get('type')
+        return {url: page}
+
+
+class StaticPageCrawler(object):
+    """Serve pages downloaded beforehand (saved html files, crawl archives) instead of crawling them"""
+
+    def __init__(self, raw_pages):
+        self.raw_pages = raw_pages
+
+    def process(self, urls):
+        result = {}
+        for url in set(urls):
+            raw_content = self.raw_pages.get(url)
+            result[url] = PageRecord(url, raw=raw_content or '', error=raw_content is None,
+                                     message='Page not found' if raw_content is None else '')
+        return result
@@ -1,68 +1,102 @@
 import re
-from multiprocessing import Pool, cpu_count
+import threading
+import time
+from multiprocessing import Pool, TimeoutError as PoolTimeoutError, cpu_count
 
-from bs4 import BeautifulSoup
-from dragnet import content_comments_extractor
-from readability.readability import Document
-from goose import Goose
 from abc import ABCMeta, abstractmethod
 
+from util import metrics
 from util.timeout import timeout, TimeoutError
 from util.utils import get_logger, get_unicode
 
 logger = get_logger(__name__)
 
+# extractor backends (bs4, dragnet, readability, goose) are imported on first use, so that a worker
+# only loads the backends of the extractors it is asked for
+
 
 class PageExtractor(object):
     __metaclass__ = ABCMeta
+    name = ''
+    # extract several pages in a process pool, set to False in daemon processes, they cannot fork
+    use_pool = True
 
     def __init__(self):
         self.logger = get_logger(__name__)
 
-    def process(self, pages):
-        self.logger.debug('Start extract pages: %s' % pages.keys())
-        item_num = len(pages)
-        if item_num > 2:
-            # get function
+    def get_extract_func(self):
+        # module level function, so that it can be sent to pool processes
+        func = dragnet_extractor
+        if isinstance(self, DragnetPageExtractor):
             func = dragnet_extractor
-            if isinstance(self, DragnetPageExtractor):
-                func = dragnet_extractor
-            elif isinstance(self, ReadabilityPageExtractor):
-                func = readability_extractor
-            elif isinstance(self, GoosePageExtractor):
-                func = goose_extractor
-            elif isinstance(self, GooseDragnetPageExtractor):
-                func = goose_dragnet_extractor
-            # use multi thread to crawl pages
-            pool = Pool(cpu_count())
-            data = [(get_unicode(url), get_unicode(page.get('content', ''))) for url, page in pages.items() if page.get('content')]
-            pool_results = pool.map(func, data)
-            # get results
-            for r in pool_results:
-                pages[r[0]]['content'] = r[1]
-
-            pool.close()
-            pool.terminate()
-            for url, page in pages.items():
-                if not page['content']:
-                    page['content'] = url
-                    continue
-                page['content'] = ', '.join(c for c in [url, page['content']] if c)
-        else:
-            for url, page in pages.items():
-                if not page['content']:
-                    page['content'] = url
-                    continue
-                page['content'] = ', '.join(c for c in [url, self.extract((url, page['content']))[1]] if c)
+        elif isinstance(self, ReadabilityPageExtractor):
+            func = readability_extractor
+        elif isinstance(self, GoosePageExtractor):
+            func = goose_extractor
+        elif isinstance(self, GooseDragnetPageExtractor):
+            func = goose_dragnet_extractor
+        return func
 
+    def process(self, pages):
+        """Extract {url: PageRecord} pages in place and return them"""
+        self.logger.debug('Start extract pages: %s' % pages.keys())
+        for _ in self.process_iter(pages.iteritems(), item_num=len(pages)):
+            pass
         self.logger.debug('End extract pages: %s' % pages.keys())
         return pages
-    
+
+    def process_iter(self, pages, item_num=None):
+        """Extract (url, PageRecord) items as they come and yield them as soon as they are extracted.
+
+        The raw html of a page is released once it is extracted, or sent to a pool process.
+        """
+        if (item_num is not None and item_num <= 2) or not self.use_pool:
+            for url, page in pages:
+                start = time.time()
+                content = self.extract((url, page.raw))[1] if page.raw else ''
+                self._set_content(url, page, content, time.time() - start)
+                yield url, page
+            return
+
+        func = self.get_extract_func()
+        pending = {}
+
+        def contents():
+            # runs in the pool task feeder thread, as soon as the previous page was crawled
+            for url, page in pages:
+                pending[url] = page
+                raw_content = page.raw or ''
+                page.release_raw()
+                yield func, get_unicode(url), get_unicode(raw_content)
+
+        pool = Pool(cpu_count())
+        try:
+            for url, content, extract_time in pool.imap_unordered(extract_page, contents()):
+                page = pending.pop(url)
+                self._set_content(url, page, content, extract_time)
+                yield url, page
+        finally:
+            pool.terminate()
+
+    @staticmethod
+    def _set_content(url, page, content, extract_time):
+        page.content = ', '.join(c for c in [url, content] if c)
+        page.extract_time = extract_time
+        page.release_raw()
+
     @abstractmethod
     def extract(self, (url, raw_content)):
         pass
 
 
+def extract_page((func, url, raw_content)):
+    if not raw_content:
+        return url, '', 0.0
+    start = time.time()
+    url, content = func((url, raw_content))
+    return url, content, time.time() - start
+
+
 def get_soup_meta(soup, name):
     metas = soup.findAll('meta')
     for meta in metas:
@@ -76,6 +110,8 @@ def get_soup_meta(soup, name):
 
 
 def get_common_info(raw_html):
+    from bs4 import BeautifulSoup
+
     try:
         soup = BeautifulSoup(raw_html, 'lxml')
         title = soup.title.string if soup.title else u''
@@ -89,6 +125,8 @@ def get_common_info(raw_html):
 
 
 def dragnet_extractor((url, raw_content)):
+    from dragnet import content_comments_extractor
+
     logger.debug('Start dragnet_extractor: %s' % url)
     content = ''
     try:
@@ -110,6 +148,7 @@ def dragnet_extractor((url, raw_content)):
 
 
 class DragnetPageExtractor(PageExtractor):
+    name = 'dragnet'
 
     def __init__(self):
         super(DragnetPageExtractor, self).__init__()
@@ -119,6 +158,8 @@ class DragnetPageExtractor(PageExtractor):
 
 
 def readability_extractor((url, raw_content)):
+    from readability.readability import Document
+
     logger.debug('Start readability_extractor: %s' % url)
     content = ''
     try:
@@ -132,10 +173,11 @@ def readability_extractor((url, raw_content)):
     elements.append(get_unicode(content))
     result = ', '.join(c for c in elements if c)
     logger.debug('End readability_extractor: %s' % url)
-    return result
+    return url, result
 
 
 class ReadabilityPageExtractor(PageExtractor):
+    name = 'readability'
 
     def __init__(self):
         super(ReadabilityPageExtractor, self).__init__()
@@ -144,6 +186,12 @@ class ReadabilityPageExtractor(PageExtractor):
         return readability_extractor((url, raw_content))
 
 
+goose_timeout = 5
+goose_fields = ['title', 'meta_description', 'meta_keywords', 'cleaned_text']
+_goose_pool = None
+_goose_pool_lock = threading.Lock()
+
+
 def get_goose_content(url, doc, name):
     result = ''
     try:
@@ -163,9 +211,39 @@ def get_goose_content(url, doc, name):
     return result
 
 
-@timeout(seconds=5)
-def get_goose_doc(raw_content):
-    return Goose().extract(raw_html=raw_content)
+def get_goose_pool():
+    global _goose_pool
+    with _goose_pool_lock:
+        if _goose_pool is None:
+            _goose_pool = Pool(cpu_count())
+        return _goose_pool
+
+
+def get_goose_doc(url, raw_content):
+    """Return the goose fields of the page as a dict, raise TimeoutError after `goose_timeout` seconds.
+
+    The timeout is a SIGALRM, which only the main thread can set. Other threads (gthread request
+    handlers, the stream reader) extract in a pool process and stop waiting after the timeout.
+    """
+    if isinstance(threading.current_thread(), threading._MainThread):
+        # import before the alarm is set, the first import must not count in the extraction timeout
+        from goose import Goose
+
+        return extract_goose_doc(Goose, url, raw_content)
+
+    # the pool process runs get_goose_doc in its main thread, so the alarm stops it there as well
+    result = get_goose_pool().apply_async(get_goose_doc, (get_unicode(url), get_unicode(raw_content)))
+    try:
+        return result.get(goose_timeout + 1)
+    except PoolTimeoutError:
+        raise TimeoutError('Function got timeout after running %s seconds' % goose_timeout)
+
+
+@timeout(seconds=goose_timeout)
+def extract_goose_doc(goose_class, url, raw_content):
+    doc = goose_class().extract(raw_html=raw_content)
+    # plain strings, the lxml trees of the document cannot be sent back from a pool process
+    return dict((name, get_goose_content(url, doc, name)) for name in goose_fields)
 
 
 def goose_extractor((url, raw_content)):
@@ -174,14 +252,15 @@ def goose_extractor((url, raw_content)):
     try:
         if raw_content and raw_content.strip():
             try:
-                doc = get_goose_doc(raw_content)
-                cleaned_text = get_goose_content(url, doc, 'cleaned_text')
+                doc = get_goose_doc(url, raw_content)
+                cleaned_text = doc['cleaned_text']
                 elements = get_common_info(raw_content)
                 elements.append(get_unicode(cleaned_text))
                 result = ', '.join(c for c in elements if c)
             except TimeoutError as ex:
                 logger.error('get_goose_doc error: %s' % ex.message)
                 logger.error('Url: %s' % url)
+                metrics.extractor_timeouts_total.labels(extractor='goose').inc()
 
     except Exception as ex:
         logger.error('goose extract_page_content timout error: %s' % ex.message)
@@ -192,6 +271,7 @@ def goose_extractor((url, raw_content)):
 
 
 class GoosePageExtractor(PageExtractor):
+    name = 'goose'
 
     def __init__(self):
         super(GoosePageExtractor, self).__init__()
@@ -201,6 +281,8 @@ class GoosePageExtractor(PageExtractor):
 
 
 def goose_dragnet_extractor((url, raw_content)):
+    from dragnet import content_comments_extractor
+
     logger.debug('Start goose_dragnet_extractor: %s' % url)
     content = ''
     try:
@@ -212,17 +294,19 @@ def goose_dragnet_extractor((url, raw_content)):
     try:
         if raw_content and raw_content.strip():
             try:
-                doc = get_goose_doc(raw_content)
-                title = get_goose_content(url, doc, 'title')
-                meta_description = get_goose_content(url, doc, 'meta_description')
-                meta_keywords = get_goose_content(url, doc, 'meta_keywords')
+                doc = get_goose_doc(url, raw_content)
+                title = doc['title']
+                meta_description = doc['meta_description']
+                meta_keywords = doc['meta_keywords']
                 if not content:
-                    content = get_goose_content(url, doc, 'cleaned_text')
+                    content = doc['cleaned_text']
                 meta_text = ', '.join(c for c in [get_unicode(title), get_unicode(meta_description),
                                                   get_unicode(meta_keywords)] if c)
             except Exception as ex:
                 logger.error('get_goose_doc error: %s' % ex.message)
                 logger.error('Url: %s' % url)
+                if isinstance(ex, TimeoutError):
+                    metrics.extractor_timeouts_total.labels(extractor='goose_dragnet').inc()
 
     except Exception as ex:
         logger.error('goose extract_page_content error: %s' % ex)
@@ -234,6 +318,7 @@ def goose_dragnet_extractor((url, raw_content)):
 
 
 class GooseDragnetPageExtractor(PageExtractor):
+    name = 'goose_dragnet'
 
     def __init__(self):
         super(GooseDragnetPageExtractor, self).__init__()
@@ -242,3 +327,17 @@ class GooseDragnetPageExtractor(PageExtractor):
         return goose_dragnet_extractor((url, raw_content))
 
 
+list_extractor = ['dragnet', 'readability', 'goose']
+
+
+def get_extractor(name):
+    if name == 'dragnet':
+        return DragnetPageExtractor()
+    elif name == 'readability':
+        return ReadabilityPageExtractor()
+    elif name == 'goose':
+        return GoosePageExtractor()
+    elif name == 'goose_dragnet':
+        return GooseDragnetPageExtractor()
+    else:
+        return None
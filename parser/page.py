@@ -0,0 +1,58 @@
+class PageRecord(object):
+    """One page through crawl, extract and classify.
+
+    `raw` is the downloaded html and `content` the extracted "url, text" the classifier reads. The extractor
+    releases `raw` as soon as the page is extracted, so a batch does not keep every html page until its end.
+    Pages are read like the dicts they replace (`page['content']`, `page.get('type')`), `to_dict` gives the
+    dict returned at the HTTP boundary.
+    """
+    __slots__ = ('url', 'raw', 'content', 'error', 'message', 'type', 'crawled_date', 'crawl_time',
+                 'extract_time')
+    fields = frozenset(__slots__)
+    # timings are moved to the request timer, raw html is never returned
+    dict_fields = ('content', 'error', 'message', 'type', 'crawled_date')
+
+    def __init__(self, url, raw=None, content='', error=False, message='', type=None, crawled_date=None):
+        self.url = url
+        self.raw = raw
+        self.content = content
+        self.error = error
+        self.message = message
+        self.type = type
+        self.crawled_date = crawled_date
+        self.crawl_time = None
+        self.extract_time = None
+
+    @classmethod
+    def from_document(cls, doc):
+        """Return the record of a web.page document, its `content` is the crawled html"""
+        return cls(doc['_id'], raw=doc.get('content') or '', error=doc.get('error', False),
+                   message=doc.get('message', ''), type=doc.get('type'), crawled_date=doc.get('crawled_date'))
+
+    def release_raw(self):
+        self.raw = None
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.dict_fields if getattr(self, f) is not None}
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.fields else None
+        return default if value is None else value
+
+    def __repr__(self):
+        return '<PageRecord %s error=%r message=%r content=%d chars raw=%s>' % (
+            self.url, self.error, self.message, len(self.content or ''),
+            '%d bytes' % len(self.raw) if self.raw is not None else 'released')
@@ -0,0 +1,52 @@
+import sys
+import time
+from os import path
+
+import dill
+import numpy as np
+
+from nlp.scoring_engine import NaiveBayesScoringEngine
+from test.train_model import load_data, FIELD_CONTENT
+from util.utils import get_logger
+
+logger = get_logger(__name__)
+
+model_loc_dir = path.dirname(path.realpath(__file__)) + '/../model'
+model_name = '6k_ecommerce_news_blog_urls_dragnet_extractor.model'
+BATCH_SIZES = [1, 10, 100]
+NUM_DOCS = 1000
+TOLERANCE = 1e-8
+
+
+def bench(func, docs, batch_size):
+    """Return seconds per document when scoring `docs` in batches of `batch_size`"""
+    start = time.time()
+    for idx in range(0, len(docs), batch_size):
+        func(docs[idx:idx + batch_size])
+    return (time.time() - start) / len(docs)
+
+
+def main():
+    file_path = sys.argv[1] if len(sys.argv) > 1 else path.join(model_loc_dir, model_name)
+    with open(file_path, 'rb') as f:
+        pipeline = dill.load(f)
+    engine = NaiveBayesScoringEngine.from_pipeline(pipeline)
+    docs = list(load_data()[FIELD_CONTENT].values[:NUM_DOCS])
+
+    # same result as sklearn
+    diff = np.abs(pipeline.predict_proba(docs) - engine.predict_proba(docs)).max()
+    print 'Max probability difference on %s docs: %.2e (%s)' % (len(docs), diff, 'OK' if diff < TOLERANCE else 'FAIL')
+
+    # tokenization is the same for both, so also report scoring of pre-tokenized docs
+    token_lists = [engine.tokenize(d) for d in docs]
+    print '%10s %16s %16s %16s %8s' % ('batch size', 'sklearn ms/doc', 'engine ms/doc', 'tokens ms/doc', 'speedup')
+    for batch_size in BATCH_SIZES:
+        sklearn_time = bench(pipeline.predict_proba, docs, batch_size)
+        engine_time = bench(engine.predict_proba, docs, batch_size)
+        tokens_time = bench(engine.predict_proba_tokens, token_lists, batch_size)
+        print '%10d %16.3f %16.3f %16.3f %7.1fx' % (batch_size, sklearn_time * 1000, engine_time * 1000,
+                                                   tokens_time * 1000, sklearn_time / engine_time)
+
+
+if __name__ == '__main__':
+    main()
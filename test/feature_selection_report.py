@@ -0,0 +1,65 @@
+import time
+
+import dill
+import numpy as np
+from sklearn.cross_validation import train_test_split
+from sklearn.metrics import f1_score
+
+from nlp.modeler import fit_classifier
+from nlp.tokenizer import GeneralTokenizer
+from test.train_model import load_data, FIELD_CONTENT, FIELD_LABEL
+from util.utils import get_logger
+
+logger = get_logger(__name__)
+
+# None means keep the full vocabulary (baseline)
+LIST_NUM_FEATURES = [None, 50000, 20000, 10000, 5000, 2000, 1000]
+LIST_FEATURE_SELECTION = ['chi2', 'mutual_info']
+# keep every term in the baseline, feature selection does the pruning
+MIN_DF = 1
+MAX_DF = 1.0
+
+
+def report(x_train, x_test, y_train, y_test, feature_selection, num_features):
+    tokenizer = GeneralTokenizer().tokenize
+    start = time.time()
+    classifier = fit_classifier(x_train, y_train, tokenizer, 1, 2, min_df=MIN_DF, max_df=MAX_DF,
+                                feature_selection=feature_selection, num_features=num_features)
+    fit_time = time.time() - start
+
+    start = time.time()
+    y_predict = classifier.predict(x_test)
+    predict_time = (time.time() - start) / len(x_test)
+    return {
+        'feature_selection': feature_selection if num_features else 'none',
+        'num_features': len(classifier.named_steps['vector'].vocabulary_),
+        'model_size': len(dill.dumps(classifier)),
+        'f1': f1_score(y_test, y_predict, average='weighted'),
+        'fit_time': fit_time,
+        'predict_time_per_doc': predict_time
+    }
+
+
+def main():
+    data = load_data()
+    x_train, x_test, y_train, y_test = train_test_split(data[FIELD_CONTENT].values, data[FIELD_LABEL].values,
+                                                        test_size=0.2, random_state=0)
+    reports = []
+    for feature_selection in LIST_FEATURE_SELECTION:
+        for num_features in LIST_NUM_FEATURES:
+            if num_features is None and reports:
+                continue
+            logger.info('Start %s with %s features...' % (feature_selection, num_features))
+            reports.append(report(x_train, x_test, y_train, y_test, feature_selection, num_features))
+
+    baseline = reports[0]
+    print '%-12s %10s %12s %8s %8s %14s' % ('selection', 'features', 'model size', 'shrink', 'f1', 'predict ms/doc')
+    for r in reports:
+        print '%-12s %10d %12d %7.1fx %8.4f %14.3f' % (r['feature_selection'], r['num_features'], r['model_size'],
+                                                     float(baseline['model_size']) / r['model_size'], r['f1'],
+                                                     r['predict_time_per_doc'] * 1000)
+    print 'Baseline f1: %.4f, best pruned f1: %.4f' % (baseline['f1'], np.max([r['f1'] for r in reports[1:]]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+from os import path
+
+# each module is imported in a new interpreter, so a time includes the modules it imports itself
+MODULES = ['numpy', 'scipy.sparse', 'sklearn', 'pandas', 'nltk', 'dill', 'bs4', 'lxml.html', 'dragnet',
+           'readability.readability', 'goose', 'pymongo', 'redis', 'flask', 'flask_restplus', 'prometheus_client',
+           'parser.extractor', 'parser.content_getter', 'nlp.predict_data', 'nlp.modeler', 'api.api']
+# none of them should be imported by `import api.api`, they are loaded by warm_up or on first use
+LAZY_MODULES = ['sklearn', 'pandas', 'nltk', 'bs4', 'dragnet', 'readability', 'goose']
+
+repo_dir = path.join(path.dirname(path.realpath(__file__)), '..')
+
+IMPORT_CODE = """
+import time
+start = time.time()
+import %s
+print time.time() - start
+"""
+
+READY_CODE = """
+import sys
+import time
+start = time.time()
+import api.api
+imported = time.time() - start
+loaded = ','.join(m for m in %r if m in sys.modules)
+start = time.time()
+api.api.warm_up()
+print imported, time.time() - start, loaded or '-'
+"""
+
+
+def run(code):
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=repo_dir, stderr=subprocess.STDOUT)
+    # the last line, the app logs to stderr
+    return output.strip().splitlines()[-1]
+
+
+def main():
+    print '%-28s %10s' % ('module', 'import s')
+    for module in MODULES:
+        try:
+            print '%-28s %10.3f' % (module, float(run(IMPORT_CODE % module)))
+        except subprocess.CalledProcessError as ex:
+            print '%-28s %10s  %s' % (module, 'error', ex.output.strip().splitlines()[-1])
+
+    # what a gunicorn worker does between fork and accepting requests
+    imported, warm_up, loaded = run(READY_CODE % LAZY_MODULES).split()
+    print
+    print 'import api.api: %.3f s, warm_up: %.3f s, start to ready: %.3f s' % (
+        float(imported), float(warm_up), float(imported) + float(warm_up))
+    print 'heavy modules imported by api.api: %s' % loaded
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""Offline load test of the API.
+
+Fixture pages are served by a local stub web server with configurable latency, error rate and size, Mongo and
+Redis are replaced by mongomock and fakeredis (see requirements-test.txt), and the Flask app runs in this process
+on a threaded server. Each scenario posts requests at a fixed concurrency and reports throughput and latency.
+
+    python -m test.load_test                      # all scenarios
+    python -m test.load_test classify_10_urls     # only the named scenarios
+
+A small model is trained on the fixture pages, set PAGE_TYPE_MODEL_DIR and PAGE_TYPE_MODEL_NAME to load test
+with a real model.
+"""
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+from multiprocessing.dummy import Pool
+from os import path
+
+import dill
+import fakeredis
+import mongomock
+import requests
+
+from util import database
+
+# the app reads these at import, so replace them before importing it
+mg_client = mongomock.MongoClient()
+redis_conn = fakeredis.FakeStrictRedis()
+database.get_mg_client = lambda: mg_client
+database.get_redis_conn = lambda: redis_conn
+
+fixtures_dir = path.join(path.dirname(path.realpath(__file__)), 'fixtures')
+FIXTURE_TYPES = {
+    'ecommerce': 'ecommerce',
+    'news': 'news/blog',
+    'blog': 'news/blog'
+}
+TRAINING_PAGES_PER_FIXTURE = 20
+TEST_MODEL_NAME = 'load_test.model'
+
+# latency_ms, error_rate and size_kb configure the stub web server for the urls of a scenario,
+# repeat_urls sends the same urls in every request (prediction cache hits)
+SCENARIOS = [
+    {'name': 'classify_1_url', 'endpoint': '/type/classify', 'urls': 1, 'concurrency': 8, 'requests': 200,
+     'latency_ms': 20, 'error_rate': 0, 'size_kb': 30, 'params': {'cache': 'false'}},
+    {'name': 'classify_10_urls', 'endpoint': '/type/classify', 'urls': 10, 'concurrency': 4, 'requests': 50,
+     'latency_ms': 20, 'error_rate': 0, 'size_kb': 30, 'params': {'cache': 'false'}},
+    {'name': 'classify_10_urls_slow_errors', 'endpoint': '/type/classify', 'urls': 10, 'concurrency': 4,
+     'requests': 50, 'latency_ms': 300, 'error_rate': 0.2, 'size_kb': 30, 'params': {'cache': 'false'}},
+    {'name': 'classify_10_urls_large', 'endpoint': '/type/classify', 'urls': 10, 'concurrency': 4, 'requests': 30,
+     'latency_ms': 20, 'error_rate': 0, 'size_kb': 300, 'params': {'cache': 'false'}},
+    {'name': 'classify_10_urls_stream', 'endpoint': '/type/classify', 'urls': 10, 'concurrency': 4,
+     'requests': 50, 'latency_ms': 20, 'error_rate': 0, 'size_kb': 30,
+     'params': {'cache': 'false', 'stream': 'true'}},
+    {'name': 'classify_10_urls_cached', 'endpoint': '/type/classify', 'urls': 10, 'concurrency': 8,
+     'requests': 200, 'latency_ms': 20, 'error_rate': 0, 'size_kb': 30, 'params': {'cache': 'true'},
+     'repeat_urls': True},
+    {'name': 'extract_10_urls', 'endpoint': '/data/extract', 'urls': 10, 'concurrency': 4, 'requests': 50,
+     'latency_ms': 20, 'error_rate': 0, 'size_kb': 30, 'params': {'fields': 'error'}},
+    {'name': 'crawl_10_urls', 'endpoint': '/data/crawl', 'urls': 10, 'concurrency': 4, 'requests': 50,
+     'latency_ms': 20, 'error_rate': 0.1, 'size_kb': 30, 'params': {}},
+    # more urls in flight than the worker admits (PAGE_TYPE_MAX_IN_FLIGHT_URLS), the excess is refused with
+    # 429 or 503 instead of queueing, small_urls requests of 1 url are mixed in and use the small request reserve
+    {'name': 'classify_100_urls_overload', 'endpoint': '/type/classify', 'urls': 100, 'concurrency': 12,
+     'requests': 60, 'latency_ms': 300, 'error_rate': 0, 'size_kb': 30, 'params': {'cache': 'false'},
+     'small_urls': 1, 'small_every': 3}
+]
+
+
+def load_fixtures():
+    fixtures = {}
+    for name in FIXTURE_TYPES:
+        with open(path.join(fixtures_dir, name + '.html'), 'rb') as f:
+            fixtures[name] = f.read()
+    return fixtures
+
+
+def pad_page(html, size_kb):
+    """Repeat the body of a fixture page until the page has about `size_kb` KB"""
+    size = size_kb * 1024
+    if len(html) >= size:
+        return html
+    start, end = html.index('<body>') + len('<body>'), html.index('</body>')
+    body = html[start:end]
+    repeat = (size - len(html)) / len(body) + 1
+    return html[:end] + body * repeat + html[end:]
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve /<fixture>/<anything>?latency_ms=..&error_rate=..&size_kb=.."""
+    fixtures = {}
+
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(parts.query))
+        time.sleep(float(params.get('latency_ms', 0)) / 1000)
+
+        # the same url always fails or always succeeds
+        error_rate = float(params.get('error_rate', 0))
+        fixture = self.fixtures.get(parts.path.strip('/').split('/')[0])
+        if fixture is None or int(hashlib.md5(self.path).hexdigest()[:8], 16) % 1000 < error_rate * 1000:
+            self.send_response(500 if fixture is not None else 404)
+            self.end_headers()
+            return
+
+        content = pad_page(fixture, int(params.get('size_kb', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_stub_server():
+    StubHandler.fixtures = load_fixtures()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def train_test_model(model_dir):
+    from nlp.modeler import fit_classifier
+    from nlp.tokenizer import GeneralTokenizer
+    from parser.extractor import get_extractor, list_extractor
+
+    extractor = get_extractor(list_extractor[0])
+    contents, labels = [], []
+    for name, html in load_fixtures().items():
+        for idx in range(TRAINING_PAGES_PER_FIXTURE):
+            url = 'http://127.0.0.1/%s/train-%s.html' % (name, idx)
+            contents.append(', '.join([url, extractor.extract((url, html))[1]]))
+            labels.append(FIXTURE_TYPES[name])
+    classifier = fit_classifier(contents, labels, GeneralTokenizer().tokenize, 1, 2, min_df=1, max_df=1.0)
+    with open(path.join(model_dir, TEST_MODEL_NAME), 'wb') as f:
+        dill.dump(classifier, f)
+
+
+def start_app():
+    if 'PAGE_TYPE_MODEL_DIR' not in os.environ:
+        model_dir = tempfile.mkdtemp(prefix='page_type_load_test')
+        train_test_model(model_dir)
+        os.environ['PAGE_TYPE_MODEL_DIR'] = model_dir
+        os.environ['PAGE_TYPE_MODEL_NAME'] = TEST_MODEL_NAME
+
+    from werkzeug.serving import make_server
+    from api.api import app, warm_up
+
+    warm_up()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    # the default backlog of 5 refuses connections at higher concurrency
+    server.socket.listen(128)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def is_small_request(scenario, request_idx):
+    return 'small_every' in scenario and request_idx % scenario['small_every'] == 0
+
+
+def get_url_count(scenario, request_idx):
+    return scenario['small_urls'] if is_small_request(scenario, request_idx) else scenario['urls']
+
+
+def build_urls(stub_port, scenario, request_idx):
+    fixtures = sorted(FIXTURE_TYPES)
+    query = 'latency_ms=%s&error_rate=%s&size_kb=%s' % (scenario['latency_ms'], scenario['error_rate'],
+                                                         scenario['size_kb'])
+    urls = []
+    for idx in range(get_url_count(scenario, request_idx)):
+        page_idx = idx if scenario.get('repeat_urls') else request_idx * scenario['urls'] + idx
+        urls.append('http://127.0.0.1:%s/%s/%s/%s.html?%s' % (stub_port, fixtures[page_idx % len(fixtures)],
+                                                               scenario['name'], page_idx, query))
+    return urls
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))] if values else 0
+
+
+def run_scenario(app_url, stub_port, scenario):
+    def send(request_idx):
+        data = dict(scenario['params'], urls=','.join(build_urls(stub_port, scenario, request_idx)))
+        start = time.time()
+        status = None
+        try:
+            response = requests.post(app_url + scenario['endpoint'], data=data, timeout=300)
+            status = response.status_code
+            ok = status == 200
+            if ok and 'json' in response.headers.get('Content-Type', ''):
+                ok = not response.json().get('error')
+        except requests.RequestException:
+            ok = False
+        return time.time() - start, ok, status
+
+    pool = Pool(scenario['concurrency'])
+    start = time.time()
+    results = pool.map(send, range(scenario['requests']))
+    elapsed = time.time() - start
+    pool.terminate()
+
+    # refused requests answer right away, the percentiles are of the admitted ones
+    rejected = set(idx for idx, (_, _, status) in enumerate(results) if status in (429, 503))
+    latencies = [latency for latency, _, status in results if status not in (429, 503)]
+    small_latencies = [results[idx][0] for idx in range(len(results))
+                       if is_small_request(scenario, idx) and idx not in rejected]
+    url_count = sum(get_url_count(scenario, idx) for idx in range(len(results)) if idx not in rejected)
+    return {
+        'name': scenario['name'],
+        'requests': len(results),
+        'failed': len([ok for _, ok, status in results if not ok and status not in (429, 503)]),
+        'rejected': len(rejected),
+        'elapsed': elapsed,
+        'requests_per_second': len(results) / elapsed,
+        'urls_per_second': url_count / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'small_p99': percentile(small_latencies, 99) * 1000 if small_latencies else None
+    }
+
+
+def main():
+    # per url debug and info logs would dominate the measures
+    logging.disable(logging.INFO)
+    names = sys.argv[1:]
+    scenarios = [s for s in SCENARIOS if not names or s['name'] in names]
+    stub_server = start_stub_server()
+    app_server = start_app()
+    app_url = 'http://127.0.0.1:%s' % app_server.server_port
+
+    print '%-30s %8s %7s %8s %9s %9s %9s %10s %10s' % ('scenario', 'requests', 'failed', 'rejected', 'seconds',
+                                                        'req/s', 'urls/s', 'p50 ms', 'p99 ms')
+    for scenario in scenarios:
+        report = run_scenario(app_url, stub_server.server_address[1], scenario)
+        print '%-30s %8d %7d %8d %9.2f %9.2f %9.2f %10.1f %10.1f' % (
+            report['name'], report['requests'], report['failed'], report['rejected'], report['elapsed'],
+            report['requests_per_second'], report['urls_per_second'], report['p50'], report['p99'])
+        if report['small_p99'] is not None:
+            print '%-30s p99 of the small requests: %.1f ms' % ('', report['small_p99'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Measure the peak memory of crawling and extracting one batch of urls, with and without releasing the raw html.
+
+    python -m test.measure_page_memory [urls] [size_kb] [extractor]     # default 500 100 dragnet
+
+Fixture pages padded to `size_kb` are served by the load test stub web server. Each mode runs in its own process
+and reports its peak RSS (ru_maxrss) above the RSS it had before the batch:
+
+- `records`: the pipeline as it is, each PageRecord drops its raw html as soon as it was extracted
+- `keep_raw`: the pipeline before PageRecord, every raw page and the unicode copy sent to the extractor pool
+  stay alive until the end of the batch
+"""
+import json
+import resource
+import subprocess
+import sys
+
+from parser.content_getter import ContentGetter
+from parser.crawler import PageCrawler
+from parser.extractor import get_extractor
+from test.load_test import FIXTURE_TYPES, start_stub_server
+from util.utils import get_unicode
+
+URL_COUNT = 500
+SIZE_KB = 100
+MODES = ['keep_raw', 'records']
+
+
+class KeepRawPageCrawler(PageCrawler):
+    """Keep a reference to each raw page, as the dict pages did until the batch was returned"""
+
+    def __init__(self):
+        super(KeepRawPageCrawler, self).__init__()
+        self.kept = []
+
+    def _crawl_page(self, url):
+        result = super(KeepRawPageCrawler, self)._crawl_page(url)
+        for page in result.values():
+            if page.raw:
+                self.kept.append((page.raw, get_unicode(page.raw)))
+        return result
+
+
+def get_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024
+
+
+def get_urls(base_url, url_count, size_kb):
+    fixtures = sorted(FIXTURE_TYPES)
+    return ['%s/%s/%s?size_kb=%s' % (base_url, fixtures[idx % len(fixtures)], idx, size_kb)
+            for idx in range(url_count)]
+
+
+def measure(mode, base_url, url_count, size_kb, extractor_name):
+    """Run in a child process, so that the peak RSS is the one of this mode only"""
+    urls = get_urls(base_url, url_count, size_kb)
+    crawler = KeepRawPageCrawler() if mode == 'keep_raw' else PageCrawler()
+    content_getter = ContentGetter(crawler, get_extractor(extractor_name))
+    start_rss = get_rss_kb()
+    pages = content_getter.process(urls)
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'mode': mode,
+        'pages': len(pages),
+        'failed': len([p for p in pages.values() if p.error]),
+        'start_mb': start_rss / 1024.0,
+        'peak_mb': peak_rss / 1024.0,
+        'batch_mb': (peak_rss - start_rss) / 1024.0
+    }
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        mode, base_url, url_count, size_kb, extractor_name = sys.argv[2:7]
+        print json.dumps(measure(mode, base_url, int(url_count), int(size_kb), extractor_name))
+        return
+
+    url_count = int(sys.argv[1]) if len(sys.argv) > 1 else URL_COUNT
+    size_kb = int(sys.argv[2]) if len(sys.argv) > 2 else SIZE_KB
+    extractor_name = sys.argv[3] if len(sys.argv) > 3 else 'dragnet'
+    server = start_stub_server()
+    base_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    try:
+        print '%s urls of %s KB, %s extractor' % (url_count, size_kb, extractor_name)
+        print '%10s %7s %7s %10s %10s %10s' % ('mode', 'pages', 'failed', 'start MB', 'peak MB', 'batch MB')
+        for mode in MODES:
+            output = subprocess.check_output([sys.executable, '-m', 'test.measure_page_memory', '--child', mode,
+                                              base_url, str(url_count), str(size_kb), extractor_name])
+            report = json.loads(output.strip().splitlines()[-1])
+            print '%10s %7d %7d %10.1f %10.1f %10.1f' % (report['mode'], report['pages'], report['failed'],
+                                                         report['start_mb'], report['peak_mb'],
+                                                         report['batch_mb'])
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Measure the memory of gunicorn workers with and without PAGE_TYPE_PRELOAD, for several worker counts.
+
+    python -m test.measure_worker_memory [workers ...]     # default 2 8 16
+
+RSS counts shared pages in every worker, PSS splits them between the processes sharing them and USS is the
+memory only this worker uses, so the memory a new worker costs is about its USS. Linux only (/proc).
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from os import path
+
+import requests
+
+WORKER_COUNTS = [2, 8, 16]
+READY_TIMEOUT = 600
+# a worker answers after its warm up, this endpoint touches neither Mongo nor Redis
+READY_PATH = '/stats/pools'
+
+repo_dir = path.join(path.dirname(path.realpath(__file__)), '..')
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def get_children(pid):
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                # the command may contain spaces, the parent pid is the second field after it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(name))
+    return children
+
+
+def get_memory(pid):
+    """Return RSS, PSS and USS of a process in MB"""
+    memory = {'Rss': 0, 'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    with open('/proc/%s/smaps' % pid) as f:
+        for line in f:
+            parts = line.split()
+            if parts[0].rstrip(':') in memory:
+                memory[parts[0].rstrip(':')] += int(parts[1])
+    return {
+        'rss': memory['Rss'] / 1024.0,
+        'pss': memory['Pss'] / 1024.0,
+        'uss': (memory['Private_Clean'] + memory['Private_Dirty']) / 1024.0
+    }
+
+
+def wait_ready(url, process, workers):
+    # all workers forked and one of them answering
+    deadline = time.time() + READY_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with code %s' % process.returncode)
+        children = get_children(process.pid)
+        if len(children) == workers:
+            try:
+                if requests.get(url, timeout=5).status_code == 200:
+                    return children
+            except requests.RequestException:
+                pass
+        time.sleep(1)
+    raise RuntimeError('gunicorn workers were not ready after %s seconds' % READY_TIMEOUT)
+
+
+def measure(workers, preload):
+    port = get_free_port()
+    env = dict(os.environ, PAGE_TYPE_PRELOAD='1' if preload else '0', PYTHONPATH=repo_dir)
+    command = ['gunicorn', '-c', 'gunicorn_conf.py', '-k', 'gthread', '--threads', '4', '-w', str(workers),
+               '-b', '127.0.0.1:%s' % port, 'main:app']
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(command, cwd=repo_dir, env=env, stdout=devnull, stderr=devnull)
+    try:
+        children = wait_ready('http://127.0.0.1:%s%s' % (port, READY_PATH), process, workers)
+        # warm_up runs in post_worker_init, give the slowest worker time to finish it
+        time.sleep(5)
+        master = get_memory(process.pid)
+        memories = [get_memory(pid) for pid in children]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+    return {
+        'workers': workers,
+        'preload': preload,
+        'master_rss': master['rss'],
+        'rss': sum(m['rss'] for m in memories) / len(memories),
+        'pss': sum(m['pss'] for m in memories) / len(memories),
+        'uss': sum(m['uss'] for m in memories) / len(memories),
+        'total_pss': master['pss'] + sum(m['pss'] for m in memories)
+    }
+
+
+def main():
+    worker_counts = [int(n) for n in sys.argv[1:]] or WORKER_COUNTS
+    print '%7s %7s %14s %14s %14s %14s %14s' % ('workers', 'preload', 'master RSS MB', 'worker RSS MB',
+                                                'worker PSS MB', 'worker USS MB', 'total PSS MB')
+    for workers in worker_counts:
+        for preload in (False, True):
+            report = measure(workers, preload)
+            print '%7d %7s %14.1f %14.1f %14.1f %14.1f %14.1f' % (
+                report['workers'], report['preload'], report['master_rss'], report['rss'], report['pss'],
+                report['uss'], report['total_pss'])
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,7 @@ def crawl_pages(input_file, output_file):
     content_getter = ContentGetter(page_crawler, page_extractor)
     result = content_getter.process(list_url)
     with open(output_file, 'w') as f:
-        data = json.dumps(result, f).encode('utf-8', errors='ignore')
+        data = json.dumps({url: page.to_dict() for url, page in result.items()}).encode('utf-8', errors='ignore')
         f.write(data)
 
     logger.info('End processing input %s...' % input_file)
@@ -64,15 +64,10 @@ def crawl_pages_and_save_to_db(input_file):
 
 def label_data(input_file, label):
     logger.info('Start processing input %s...' % input_file)
-    with open(input_file, 'r') as f:
-        list_url = [re.sub(r'\n', '', u.strip()) for u in f.readlines()]
-
-    params = {
-        'urls': ', '.join(list_url),
-        'type': label
-    }
-    logger.info('Num of url: %s' % len(list_url))
-    response = requests.post('http://159.203.170.25:1999/data/label', data=params)
+    # the file is read and upserted in batches by the server, one url per line
+    with open(input_file, 'rb') as f:
+        response = requests.post('http://159.203.170.25:1999/data/label/import', data={'type': label},
+                                 files={'file': (input_file, f, 'text/csv')})
     ret = response.json()
     logger.info('Error: %s' % ret['error'])
     logger.info('Message: %s' % ret.get('message'))
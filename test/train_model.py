@@ -4,12 +4,12 @@ import numpy as np
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cross_validation import KFold, cross_val_score
-from sklearn.metrics import f1_score, classification_report
 import pandas as pd
 import os
 import dill
 
+from data.snapshot import PageSnapshot
+from nlp.model_selection import ModelSelectionRunner, default_param_grid
 from nlp.tokenizer import GeneralTokenizer
 from util.utils import get_logger
 
@@ -24,6 +24,9 @@ FIELD_LABEL = 'label'
 
 CREATE_MODEL = True
 MODEL_FILE_PATH = '../model/160327_webpages_type_classification_model.model'
+TOKEN_CACHE_FILE = '/home/diepdt/data/dmoz/tokens.cache'
+# a snapshot exported by `python -m data.snapshot export`, loaded instead of the JSON dumps when set
+SNAPSHOT_FILE_PATH = os.environ.get('PAGE_TYPE_SNAPSHOT', '')
 
 
 def read_json_file(file_path, label):
@@ -53,8 +56,20 @@ def read_json_file(file_path, label):
     return df
 
 
+def load_snapshot(file_path):
+    df = PageSnapshot(file_path).read(['url', 'content', 'type'], page_types=['ecommerce', 'news/blog'])
+    return df.rename(columns={'type': FIELD_LABEL})
+
+
 def load_data():
     logger.info('Start load_data...')
+    if SNAPSHOT_FILE_PATH:
+        df = load_snapshot(SNAPSHOT_FILE_PATH)
+        logger.info('**Total row count: %s' % len(df))
+        logger.info('**Data info:\n %s' % df[FIELD_LABEL].value_counts())
+        logger.info('End load_data...')
+        return df
+
     dir_data = '/home/diepdt/data/dmoz'
     file_ecommerce = os.path.join(dir_data, 'shopping1000.json')
     file_news_blog = os.path.join(dir_data, 'news1000.json')
@@ -84,8 +99,6 @@ def main():
         ('clf', MultinomialNB())
         # ('clf', LinearSVC())
     ])
-    k_fold = KFold(n=len(data), n_folds=NUM_FOLD)
-
     if CREATE_MODEL:
         # train in all data set and create model file
         logger.info('Start train and create model file...')
@@ -95,35 +108,19 @@ def main():
 
         logger.info('End train and create model file...')
 
-    # evaluation
+    # evaluation, tokenize once and run the configurations x folds in a process pool
     logger.info('Start evaluation by KFOLD...')
-    # print('F1 score: ' + cross_val_score(classifier, data[FIELD_CONTENT].values, data[FIELD_LABEL].values,
-    #                                      n_jobs=-1, cv=10).mean())
-    fold = 1
-    scores = []
-    for train_indices, test_indices in k_fold:
-        x_train = data.iloc[train_indices][FIELD_CONTENT].values
-        y_train = data.iloc[train_indices][FIELD_LABEL].values
-
-        x = data.iloc[test_indices][FIELD_CONTENT].values
-        y_test = data.iloc[test_indices][FIELD_LABEL].values
-
-        logger.info('Start training fold: %s...' % fold)
-        classifier.fit(x_train, y_train)
-        logger.info('End training fold: %s...' % fold)
-
-        logger.info('Start testing fold: %s...' % fold)
-        y_predict = classifier.predict(x)
-        logger.info('End testing fold: %s...' % fold)
-
-        scores.append(f1_score(y_test, y_predict, average=None))
-        logger.info('***Test score for fold: %s' % fold)
-        logger.info(classification_report(y_test, y_predict))
-        fold += 1
-
+    runner = ModelSelectionRunner(tokenizer.tokenize, num_folds=NUM_FOLD, token_cache_file=TOKEN_CACHE_FILE)
+    reports = runner.run(data[FIELD_CONTENT].values, data[FIELD_LABEL].values, default_param_grid)
     logger.info('End evaluation by KFOLD...')
     print 'Total message classified: %s' % len(data)
-    print 'F1_score: %s' % (sum(scores) / len(scores))
+    for report in reports:
+        if report.get('error'):
+            print '%s: error %s' % (report['config'], report['error'])
+            continue
+        print '%s: F1_score %.4f (+/- %.4f), accuracy %.4f, fit %.2fs, predict %.3fms/doc, vocabulary %d' % \
+              (report['config'], report['f1'], report['f1_std'], report['accuracy'], report['fit_time'],
+               report['predict_time_per_doc'] * 1000, report['vocabulary_size'])
     return
 
 
@@ -1,7 +1,12 @@
 import random
 from os import path
 
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB, BernoulliNB
+from sklearn.svm import LinearSVC
+
 from nlp.evaluation_model import WebPageTypeModelEvaluation
+from nlp.feature_store import FeatureStore, evaluate_classifier
 from nlp.modeler import WebPageTypeModeler
 from nlp.predict_data import PredictWebPageType
 from nlp.tokenizer import GeneralTokenizer
@@ -16,6 +21,7 @@ logger = get_logger(__name__)
 model_loc_dir = path.dirname(path.realpath(__file__)) + '/../model'
 model_name = '6k_ecommerce_news_blog_urls_dragnet_extractor.model'
 s_extractor = DragnetPageExtractor()
+feature_store = FeatureStore(path.dirname(path.realpath(__file__)) + '/../feature_store')
 
 
 def get_training_urls(item_num_each_label):
@@ -37,7 +43,6 @@ def get_training_urls(item_num_each_label):
         logger.info('Training data for type %s: %s urls' % (page_type, len(s_urls)))
         result += s_urls
 
-    mg_client.close()
     logger.info('Total training urls: %s' % len(result))
     logger.info('End get_training_urls...')
     return result
@@ -57,9 +62,8 @@ def train_model(urls):
     storage = mg_client.web.page
     content_getter_with_storage = ContentGetter(PageCrawlerWithStorage(storage), s_extractor)
     modeler = WebPageTypeModeler(urls, content_getter_with_storage, path.join(model_loc_dir, model_name), tokenizer,
-                                 min_ngram, max_ngram)
+                                 min_ngram, max_ngram, feature_store=feature_store)
     ok, msg = modeler.train()
-    mg_client.close()
 
     if not ok:
         result['error'] = True
@@ -73,6 +77,28 @@ def train_model(urls):
     return result
 
 
+def try_classifiers(urls):
+    """Compare classifiers on the stored features of the urls, only the first run crawls and vectorizes"""
+    logger.info('Start try_classifiers...')
+    mg_client = get_mg_client()
+    storage = mg_client.web.page
+    content_getter_with_storage = ContentGetter(PageCrawlerWithStorage(storage), s_extractor)
+    modeler = WebPageTypeModeler(urls, content_getter_with_storage, path.join(model_loc_dir, model_name),
+                                 GeneralTokenizer().tokenize, 1, 2, feature_store=feature_store)
+    features = modeler.get_features()
+    if features is None:
+        logger.info('End try_classifiers, empty training data set...')
+        return {'error': True, 'message': 'Empty training data set, remember to label your data firstly.'}
+
+    result = {}
+    for name, clf in [('multinomial_nb', MultinomialNB()), ('bernoulli_nb', BernoulliNB()),
+                      ('logistic_regression', LogisticRegression()), ('linear_svc', LinearSVC())]:
+        result[name] = evaluate_classifier(features, clf)
+        logger.info('%s: %s' % (name, result[name]))
+    logger.info('End try_classifiers...')
+    return result
+
+
 def evaluate_model(urls):
     logger.info('Start evaluate_model...')
     logger.info('Num of test urls: %s' % len(urls))
@@ -86,7 +112,6 @@ def evaluate_model(urls):
     evaluation = WebPageTypeModelEvaluation(urls, storage, s_classifier)
     result.update(evaluation.evaluate())
     result['model_name'] = model_name
-    mg_client.close()
     logger.info('End evaluate_model...')
     return result
 
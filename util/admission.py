@@ -0,0 +1,106 @@
+import threading
+
+from util import metrics
+from util.utils import get_logger
+
+
+class AdmissionTicket(object):
+    """The urls a request holds in the worker, `release` gives them back once"""
+    __slots__ = ('controller', 'url_count', 'status', 'message', 'retry_after', '_released')
+
+    def __init__(self, controller, url_count, status=200, message='', retry_after=None):
+        self.controller = controller
+        self.url_count = url_count
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+        # a rejected ticket holds nothing
+        self._released = status != 200
+
+    @property
+    def admitted(self):
+        return self.status == 200
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self.url_count)
+
+
+class AdmissionController(object):
+    """Bound the urls being crawled, extracted or classified by a worker at the same time.
+
+    A request asking for more than `max_urls_per_request` urls is refused (413). Other requests are admitted
+    while the urls in flight stay under `max_in_flight_urls`, and refused right away otherwise (503), so that
+    clients retry after `retry_after` seconds instead of queueing behind a worker that is already busy.
+    The last `small_request_reserve` urls of the worker are kept for requests of at most `small_request_urls`
+    urls: a large request that only fits in the reserve is refused (429), small requests still get in.
+    """
+
+    def __init__(self, max_urls_per_request=200, max_in_flight_urls=400, small_request_urls=10,
+                 small_request_reserve=50, retry_after=1):
+        if max_urls_per_request > max_in_flight_urls - small_request_reserve:
+            raise ValueError('max_urls_per_request (%s) must fit in max_in_flight_urls (%s) without the small '
+                             'request reserve (%s)' % (max_urls_per_request, max_in_flight_urls,
+                                                       small_request_reserve))
+        self.logger = get_logger(self.__class__.__name__)
+        self.max_urls_per_request = max_urls_per_request
+        self.max_in_flight_urls = max_in_flight_urls
+        self.small_request_urls = small_request_urls
+        self.small_request_reserve = small_request_reserve
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rejected = {413: 0, 429: 0, 503: 0}
+
+    def acquire(self, url_count, endpoint=''):
+        """Return a ticket holding `url_count` urls, or a rejected ticket with the status and message"""
+        if url_count > self.max_urls_per_request:
+            message = 'Too many urls in a request (%s), the maximum is %s, split them or submit a job' % (
+                url_count, self.max_urls_per_request)
+            return self._reject(url_count, endpoint, 413, message)
+
+        small = url_count <= self.small_request_urls
+        limit = self.max_in_flight_urls if small else self.max_in_flight_urls - self.small_request_reserve
+        with self._lock:
+            in_flight = self._in_flight + url_count
+            if in_flight <= limit:
+                self._in_flight = in_flight
+                self._admitted += 1
+        if in_flight <= limit:
+            metrics.in_flight_urls.inc(url_count)
+            return AdmissionTicket(self, url_count)
+
+        if in_flight <= self.max_in_flight_urls:
+            # only the small request reserve is left
+            message = 'The server only accepts requests of at most %s urls at the moment, retry later' % (
+                self.small_request_urls)
+            return self._reject(url_count, endpoint, 429, message)
+        return self._reject(url_count, endpoint, 503, 'The server is busy, retry later')
+
+    def _reject(self, url_count, endpoint, status, message):
+        with self._lock:
+            self._rejected[status] += 1
+        metrics.admission_rejections_total.labels(endpoint=endpoint, status=status).inc()
+        self.logger.debug('Reject %s urls on %s with %s: %s' % (url_count, endpoint, status, message))
+        retry_after = self.retry_after if status != 413 else None
+        return AdmissionTicket(self, url_count, status=status, message=message, retry_after=retry_after)
+
+    def _release(self, url_count):
+        with self._lock:
+            self._in_flight -= url_count
+        metrics.in_flight_urls.dec(url_count)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'in_flight_urls': self._in_flight,
+                'max_in_flight_urls': self.max_in_flight_urls,
+                'max_urls_per_request': self.max_urls_per_request,
+                'small_request_urls': self.small_request_urls,
+                'small_request_reserve': self.small_request_reserve,
+                'admitted': self._admitted,
+                'rejected': {str(status): count for status, count in self._rejected.items()}
+            }
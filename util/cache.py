@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from util.utils import get_logger
+
+
+class LRUCache(object):
+    """Thread safe in-process LRU cache with per entry TTL"""
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            value, expired_at = item
+            if expired_at < time.time():
+                return None
+            # move to the most recently used position
+            self._data[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        expired_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expired_at)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache(object):
+    """JSON values shared between workers through Redis, errors are logged and treated as misses"""
+
+    def __init__(self, kv_storage, prefix, ttl=3600):
+        self.logger = get_logger(self.__class__.__name__)
+        self.kv_storage = kv_storage
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def get_many(self, keys):
+        result = {}
+        if not keys:
+            return result
+        try:
+            values = self.kv_storage.mget([self._key(k) for k in keys])
+        except Exception as ex:
+            self.logger.error('Redis cache get error: %s' % ex)
+            return result
+        for key, value in zip(keys, values):
+            if value is not None:
+                result[key] = json.loads(value)
+        return result
+
+    def set_many(self, items, ttl=None):
+        if not items:
+            return
+        try:
+            pipe = self.kv_storage.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.set(self._key(key), json.dumps(value), ex=ttl or self.ttl)
+            pipe.execute()
+        except Exception as ex:
+            self.logger.error('Redis cache set error: %s' % ex)
@@ -1,14 +1,148 @@
-from pymongo import MongoClient
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
 import redis
 
+from util import metrics
+
 
 dev_server = 'localhost'
 prod_server = '159.203.170.25'
 
+mongo_host = os.environ.get('MONGO_HOST', prod_server)
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+# how long a request waits for a free connection when the pool is exhausted
+mongo_wait_queue_timeout_ms = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+mongo_connect_timeout_ms = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+mongo_server_selection_timeout_ms = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+
+redis_host = os.environ.get('REDIS_HOST', prod_server)
+redis_max_connections = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+redis_wait_timeout = float(os.environ.get('REDIS_WAIT_TIMEOUT', 5))
+redis_connect_timeout = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 5))
+# must be longer than blocking commands (BLPOP of the job queue)
+redis_socket_timeout = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 30))
+
+# a checkout slower than this is counted as a wait for a free connection
+checkout_wait_threshold = 0.001
+
+_lock = threading.Lock()
+_mg_client = None
+_mg_pid = None
+_redis_pool = None
+
+_stats_lock = threading.Lock()
+_pool_stats = {
+    'mongo_checkouts': 0,
+    'mongo_checkout_waits': 0,
+    'mongo_checkout_wait_seconds': 0.0,
+    'mongo_checkout_failures': 0,
+    'redis_checkouts': 0,
+    'redis_checkout_waits': 0,
+    'redis_checkout_wait_seconds': 0.0,
+    'redis_checkout_failures': 0
+}
+
+
+def _record_checkout(name, wait):
+    metrics.pool_checkout_wait.labels(pool=name).observe(wait)
+    with _stats_lock:
+        _pool_stats[name + '_checkouts'] += 1
+        if wait > checkout_wait_threshold:
+            _pool_stats[name + '_checkout_waits'] += 1
+            _pool_stats[name + '_checkout_wait_seconds'] += wait
+
+
+def _record_checkout_failure(name):
+    metrics.pool_checkout_failures_total.labels(pool=name).inc()
+    with _stats_lock:
+        _pool_stats[name + '_checkout_failures'] += 1
+
+
+def get_pool_stats():
+    with _stats_lock:
+        result = dict(_pool_stats)
+    result['mongo_max_pool_size'] = mongo_max_pool_size
+    result['redis_max_connections'] = redis_max_connections
+    return result
+
+
+class _MongoPoolListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.time()
+
+    def connection_checked_out(self, event):
+        _record_checkout('mongo', time.time() - getattr(self._local, 'start', time.time()))
+
+    def connection_check_out_failed(self, event):
+        _record_checkout_failure('mongo')
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class _CountingConnectionPool(redis.BlockingConnectionPool):
+    def get_connection(self, command_name, *keys, **options):
+        start = time.time()
+        try:
+            connection = super(_CountingConnectionPool, self).get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            _record_checkout_failure('redis')
+            raise
+        _record_checkout('redis', time.time() - start)
+        return connection
+
 
 def get_mg_client():
-    return MongoClient(host=prod_server)
+    """Return the process wide pooled MongoClient, do not close it after use.
+
+    A new client is created after fork, because MongoClient is not fork safe.
+    """
+    global _mg_client, _mg_pid
+    if _mg_client is not None and _mg_pid == os.getpid():
+        return _mg_client
+    with _lock:
+        if _mg_client is None or _mg_pid != os.getpid():
+            _mg_client = MongoClient(host=mongo_host, maxPoolSize=mongo_max_pool_size,
+                                     waitQueueTimeoutMS=mongo_wait_queue_timeout_ms,
+                                     connectTimeoutMS=mongo_connect_timeout_ms,
+                                     serverSelectionTimeoutMS=mongo_server_selection_timeout_ms,
+                                     event_listeners=[_MongoPoolListener()])
+            _mg_pid = os.getpid()
+    return _mg_client
 
 
 def get_redis_conn():
-    return redis.Redis(host=prod_server)
+    """Return a Redis client on the process wide blocking connection pool (the pool reconnects after fork)"""
+    global _redis_pool
+    if _redis_pool is None:
+        with _lock:
+            if _redis_pool is None:
+                _redis_pool = _CountingConnectionPool(host=redis_host, max_connections=redis_max_connections,
+                                                      timeout=redis_wait_timeout,
+                                                      socket_connect_timeout=redis_connect_timeout,
+                                                      socket_timeout=redis_socket_timeout)
+    return redis.Redis(connection_pool=_redis_pool)
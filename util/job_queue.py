@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+from Queue import Queue, Empty
+
+import redis
+
+from util.utils import get_logger
+
+
+class RedisJobQueue(object):
+    """FIFO queue of JSON tasks in a Redis list, shared by the API and the job workers.
+
+    `pop` moves a task to the processing list of this worker, it is removed by `ack` once its results are
+    saved. A worker refreshes its `heartbeat`, `requeue_stale` puts the tasks of workers without heartbeat
+    (killed or crashed mid task) back in the queue.
+    """
+
+    def __init__(self, kv_storage, name, worker_id=None, heartbeat_ttl=30):
+        self.logger = get_logger(self.__class__.__name__)
+        self.kv_storage = kv_storage
+        self.name = name
+        self.worker_id = worker_id or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.heartbeat_ttl = heartbeat_ttl
+        self.workers_key = '%s:workers' % name
+
+    def _processing_key(self, worker_id):
+        return '%s:processing:%s' % (self.name, worker_id)
+
+    def _heartbeat_key(self, worker_id):
+        return '%s:heartbeat:%s' % (self.name, worker_id)
+
+    @staticmethod
+    def _dumps(task):
+        # sorted keys, so that `ack` finds the same string in the processing list
+        return json.dumps(task, sort_keys=True)
+
+    def push(self, tasks):
+        # pushed at the head and popped from the tail, in order
+        if tasks:
+            self.kv_storage.lpush(self.name, *[self._dumps(t) for t in tasks])
+
+    def pop(self, timeout=5):
+        """Return the next task, or None if the queue is still empty after `timeout` seconds"""
+        item = self.kv_storage.brpoplpush(self.name, self._processing_key(self.worker_id), timeout=timeout)
+        return json.loads(item) if item else None
+
+    def ack(self, task):
+        """Remove a popped task from the processing list, after its results are saved"""
+        self.kv_storage.lrem(self._processing_key(self.worker_id), 1, self._dumps(task))
+
+    def heartbeat(self):
+        self.kv_storage.sadd(self.workers_key, self.worker_id)
+        self.kv_storage.set(self._heartbeat_key(self.worker_id), 1, ex=self.heartbeat_ttl)
+
+    def requeue_stale(self, include_self=False):
+        """Put the tasks of the workers without heartbeat back in the queue, return their number.
+
+        `include_self` also requeues the tasks left under this worker id, by a previous process with the same
+        host name and pid (a restarted container). The `attempts` of each task is increased, so that a task
+        killing its workers is not retried forever.
+        """
+        result = 0
+        for worker_id in self.kv_storage.smembers(self.workers_key) | {self.worker_id}:
+            if worker_id == self.worker_id:
+                if not include_self:
+                    continue
+            elif self.kv_storage.exists(self._heartbeat_key(worker_id)):
+                continue
+            processing_key = self._processing_key(worker_id)
+            with self.kv_storage.pipeline() as pipe:
+                try:
+                    # another worker requeueing the same list makes the transaction fail
+                    pipe.watch(processing_key)
+                    items = pipe.lrange(processing_key, 0, -1)
+                    tasks = [json.loads(item) for item in items]
+                    for task in tasks:
+                        task['attempts'] = task.get('attempts', 0) + 1
+                    pipe.multi()
+                    if tasks:
+                        # at the tail, they are popped next
+                        pipe.rpush(self.name, *[self._dumps(t) for t in tasks])
+                    pipe.delete(processing_key)
+                    pipe.srem(self.workers_key, worker_id)
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+            if tasks:
+                self.logger.warning('Requeue %s tasks of stale worker %s' % (len(tasks), worker_id))
+            result += len(tasks)
+        return result
+
+    def size(self):
+        return self.kv_storage.llen(self.name)
+
+
+class LocalJobQueue(object):
+    """In-process stand-in of RedisJobQueue, for running the API and a worker thread without Redis.
+
+    The tasks die with the process, there is nothing to acknowledge or requeue.
+    """
+
+    def __init__(self, name='local'):
+        self.name = name
+        self._queue = Queue()
+
+    def push(self, tasks):
+        for task in tasks:
+            self._queue.put(task)
+
+    def pop(self, timeout=5):
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def ack(self, task):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    def requeue_stale(self, include_self=False):
+        return 0
+
+    def size(self):
+        return self._queue.qsize()
@@ -0,0 +1,65 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+
+# Set prometheus_multiproc_dir (or PROMETHEUS_MULTIPROC_DIR) to an empty directory shared by the gunicorn
+# workers before starting gunicorn, so that /metrics aggregates all workers instead of the one answering.
+multiprocess_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+request_latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+requests_total = Counter('page_type_requests_total', 'HTTP requests', ['endpoint', 'method', 'status'])
+request_duration = Histogram('page_type_request_duration_seconds',
+                             'HTTP request duration, until the first byte for streamed responses',
+                             ['endpoint', 'method'], buckets=request_latency_buckets)
+requests_in_progress = Gauge('page_type_requests_in_progress', 'HTTP requests being processed', ['endpoint'],
+                             multiprocess_mode='livesum')
+in_flight_urls = Gauge('page_type_in_flight_urls', 'Urls held by admitted requests', multiprocess_mode='livesum')
+admission_rejections_total = Counter('page_type_admission_rejections_total',
+                                     'Requests refused by admission control', ['endpoint', 'status'])
+
+urls_total = Counter('page_type_urls_total', 'Urls processed by stage (crawl, extract, classify)', ['stage'])
+predictions_total = Counter('page_type_predictions_total', 'Pages classified by source (content, url, cache)',
+                            ['predicted_by'])
+crawl_errors_total = Counter('page_type_crawl_errors_total', 'Failed crawls by error type', ['error_type'])
+# goose extraction runs in pool processes, their counts are only visible in multiprocess mode
+extractor_timeouts_total = Counter('page_type_extractor_timeouts_total', 'Extractions stopped by timeout',
+                                   ['extractor'])
+
+model_load_duration = Histogram('page_type_model_load_seconds', 'Duration of loading a model file', ['model'],
+                                buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+current_model = Gauge('page_type_current_model', 'The model a worker classifies with (value 1)', ['model'],
+                      multiprocess_mode='liveall')
+
+prediction_cache_total = Counter('page_type_prediction_cache_total', 'Prediction cache lookups by result',
+                                 ['result'])
+predict_batch_size = Histogram('page_type_predict_batch_size', 'Documents in a merged predict batch',
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+pool_checkout_wait = Histogram('page_type_pool_checkout_wait_seconds', 'Wait for a pooled connection', ['pool'],
+                               buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+pool_checkout_failures_total = Counter('page_type_pool_checkout_failures_total',
+                                       'Connection checkouts failed or timed out', ['pool'])
+
+
+def set_current_model(model_name, previous_model_name=None):
+    if previous_model_name and previous_model_name != model_name:
+        current_model.labels(model=previous_model_name).set(0)
+    current_model.labels(model=model_name).set(1)
+
+
+def get_metrics():
+    """Return the text exposition of all metrics and its content type"""
+    if multiprocess_dir:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of an exited worker, call it from the gunicorn `child_exit` hook"""
+    if multiprocess_dir:
+        multiprocess.mark_process_dead(pid)
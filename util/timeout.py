@@ -1,5 +1,6 @@
 from functools import wraps
 import signal
+import threading
 
 
 class TimeoutError(Exception):
@@ -12,6 +13,10 @@ def timeout(seconds=10):
             raise TimeoutError('Function got timeout after running %s seconds' % seconds)
 
         def wrapper(*args, **kwargs):
+            # signals are only handled by the main thread, callers in other threads must bound the call
+            # themselves, see parser.extractor.get_goose_doc
+            if not isinstance(threading.current_thread(), threading._MainThread):
+                return func(*args, **kwargs)
             signal.signal(signal.SIGALRM, _handle_timeout)
             signal.alarm(seconds)
             try:
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class LatencyHistogram(object):
+    """Latency samples of one stage, percentiles are computed over the last `max_samples` samples"""
+
+    def __init__(self, max_samples=2048):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    @staticmethod
+    def _percentile(samples, p):
+        # nearest rank on sorted samples
+        idx = int(round(p / 100.0 * (len(samples) - 1)))
+        return samples[idx]
+
+    def get_stats(self):
+        """Return the count and latencies in milliseconds"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total, max_latency = self.count, self.total, self.max
+        if not samples:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean': round(total * 1000 / count, 2),
+            'p50': round(self._percentile(samples, 50) * 1000, 2),
+            'p90': round(self._percentile(samples, 90) * 1000, 2),
+            'p99': round(self._percentile(samples, 99) * 1000, 2),
+            'max': round(max_latency * 1000, 2)
+        }
+
+
+class LatencyStats(object):
+    """Latency histograms of the process by stage name"""
+
+    def __init__(self, max_samples=2048):
+        self.max_samples = max_samples
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, LatencyHistogram(self.max_samples))
+        histogram.record(seconds)
+
+    def get_stats(self):
+        return {name: histogram.get_stats() for name, histogram in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+latency_stats = LatencyStats()
+
+
+class StageTimer(object):
+    """Time the stages of one request.
+
+    Durations of a stage entered several times are summed. Every measure is also recorded in the
+    process histograms, under `prefix` + stage name.
+    """
+
+    def __init__(self, prefix='', stats=latency_stats):
+        self.prefix = prefix
+        self.stats = stats
+        self.start = time.time()
+        self.stages = OrderedDict()
+        self.urls = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self.stats is not None:
+            self.stats.record(self.prefix + name, seconds)
+
+    def add_url(self, url, name, seconds):
+        """Keep the duration of a stage for one url, the process histogram is `<name>_url`"""
+        if seconds is None:
+            return
+        self.urls.setdefault(url, OrderedDict())[name] = seconds
+        if self.stats is not None:
+            self.stats.record(self.prefix + name + '_url', seconds)
+
+    def get_url(self, url):
+        return OrderedDict((name, round(seconds * 1000, 2)) for name, seconds in self.urls.get(url, {}).items())
+
+    def finish(self, name='total'):
+        """Record the time since the timer was created as stage `name`, return it in seconds"""
+        elapsed = time.time() - self.start
+        self.add(name, elapsed)
+        return elapsed
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header, durations in milliseconds"""
+        return ', '.join('%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in self.stages.items())
+
+    def to_dict(self):
+        return {
+            'stages': OrderedDict((name, round(seconds * 1000, 2)) for name, seconds in self.stages.items()),
+            'urls': {url: self.get_url(url) for url in self.urls}
+        }
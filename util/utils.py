@@ -1,5 +1,6 @@
 import logging
 import os
+import urlparse
 from datetime import datetime
 
 CRITICAL = logging.CRITICAL
@@ -46,3 +47,11 @@ def get_unicode(text):
     if isinstance(text, unicode):
         return text
     return unicode(text, encoding='utf-8', errors='ignore')
+
+
+def normalize_url(url):
+    url = url.strip()
+    if not url.startswith('http'):
+        url = 'http://' + url
+    parts = urlparse.urlsplit(url)
+    return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))